@@ -0,0 +1,236 @@
+# autotune.py
+"""
+Automatic choice of block_size and c_value for remove_background.
+
+A grid of (block_size, c_value) pairs is evaluated on a few text-rich crops
+from a sample of pages. The expensive part of adaptive thresholding, the local
+mean (or Sauvola/Niblack threshold), depends only on block_size, so it is
+computed once per window size and every C offset is then a single comparison
+against it. Each candidate is
+scored with cheap proxies for a clean result:
+  - speckles: ink components too small to be writing (background noise or
+    strokes broken up by a too strict threshold),
+  - stroke-width consistency: pen strokes have a roughly constant width, while
+    shadows and blotches turned into ink do not.
+
+The best parameters can be saved per input folder (TUNING_FILENAME), where
+batch runs and the GUI pick them up.
+"""
+import json
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+import bg_rem
+
+TUNING_FILENAME = '.notes_tuning.json'
+DEFAULT_BLOCK_SIZES = (11, 15, 21, 31, 41, 61, 81)
+DEFAULT_C_VALUES = (2, 4, 6, 8, 10, 12, 15, 20, 25)
+CROP_SIZE = 768 # Side of the square crops candidates are scored on
+CROPS_PER_PAGE = 3
+MAX_INK_RATIO = 0.35 # More ink than this is a flooded result, whatever its other scores
+
+
+def _binarizer_for(engine):
+    """
+    Returns prepare(gray_image, block_size) for engines whose result is a comparison
+    against a local threshold minus C, or None for other engines. prepare does the
+    C-independent work once and returns binarize(c_value), which gives exactly
+    remove_background's output for that C (see test_autotune.py).
+    """
+    if engine in ('gaussian', 'mean'):
+        if engine == 'gaussian':
+            # adaptiveThreshold blurs a float32 copy and rounds the mean back to uint8
+            local_mean = lambda gray, block_size: cv2.convertScaleAbs(cv2.GaussianBlur(
+                gray.astype(np.float32), (block_size, block_size), 0,
+                borderType=cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED))
+        else:
+            local_mean = lambda gray, block_size: cv2.blur(gray, (block_size, block_size),
+                                                           borderType=cv2.BORDER_REPLICATE)
+
+        def prepare(gray_image, block_size):
+            difference = gray_image.astype(np.int16) - local_mean(gray_image, block_size)
+            # adaptiveThreshold keeps pixels with pixel - mean > -ceil(C)
+            return lambda c_value: np.where(difference > -math.ceil(c_value), 255, 0).astype(np.uint8)
+        return prepare
+
+    local_threshold = {'sauvola': bg_rem.sauvola_threshold, 'niblack': bg_rem.niblack_threshold}.get(engine)
+    if local_threshold is None:
+        return None
+
+    def prepare(gray_image, block_size):
+        pixels, threshold = gray_image.astype(np.float32), local_threshold(gray_image, block_size)
+        return lambda c_value: cv2.compare(pixels, threshold - np.float32(c_value), cv2.CMP_GT)
+    return prepare
+
+
+def select_crops(gray_image, crop_size=CROP_SIZE, count=CROPS_PER_PAGE):
+    """
+    Returns up to count (y0, y1, x0, x1) regions with the most local contrast,
+    i.e. the ones most likely to contain writing.
+    """
+    height, width = gray_image.shape
+    crop_h, crop_w = min(crop_size, height), min(crop_size, width)
+    candidates = []
+    for y0 in range(0, height - crop_h + 1, max(1, crop_h // 2)):
+        for x0 in range(0, width - crop_w + 1, max(1, crop_w // 2)):
+            # Contrast measured on a cheap 4x subsample of the crop
+            sample = gray_image[y0:y0 + crop_h:4, x0:x0 + crop_w:4]
+            candidates.append((float(cv2.Laplacian(sample, cv2.CV_32F).var()), (y0, y0 + crop_h, x0, x0 + crop_w)))
+    candidates.sort(key=lambda item: -item[0])
+    return [region for _, region in candidates[:count]]
+
+
+def score_binary(binary):
+    """
+    Scores a binarized crop (ink = 0, paper = 255); higher is better.
+    Returns:
+        (score, metrics dict)
+    """
+    ink = (binary == 0).astype(np.uint8)
+    ink_ratio = float(ink.mean())
+    if ink_ratio == 0.0 or ink_ratio > MAX_INK_RATIO:
+        return -math.inf, {'ink_ratio': ink_ratio}
+
+    # Stroke widths: twice the distance to the paper along the middle of the strokes
+    distance = cv2.distanceTransform(ink, cv2.DIST_L2, 3)
+    ridge = (distance > 0) & (distance >= cv2.dilate(distance, np.ones((3, 3), np.uint8)))
+    widths = 2.0 * distance[ridge]
+    stroke_width = float(np.median(widths))
+    stroke_cv = float(widths.std() / max(widths.mean(), 1e-6))
+
+    # Speckles: components smaller than a dot of the typical pen width
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    speckle_area = max(3.0, stroke_width ** 2)
+    speckles = int(np.count_nonzero(areas < speckle_area))
+    speckle_ratio = speckles / max(1, count - 1)
+    speckle_ink = float(areas[areas < speckle_area].sum()) / max(1.0, float(areas.sum()))
+
+    score = -(stroke_cv + speckle_ratio + speckle_ink)
+    return score, {
+        'ink_ratio': ink_ratio,
+        'stroke_width': stroke_width,
+        'stroke_cv': stroke_cv,
+        'speckle_ratio': speckle_ratio,
+        'speckle_ink': speckle_ink,
+    }
+
+
+def sweep(gray_images, block_sizes=DEFAULT_BLOCK_SIZES, c_values=DEFAULT_C_VALUES, engine=bg_rem.DEFAULT_ENGINE):
+    """
+    Evaluates every (block_size, c_value) pair on text-rich crops of gray_images.
+    Returns:
+        List of dicts (block_size, c_value, score and the averaged metrics), best first.
+    """
+    prepare = _binarizer_for(engine)
+    halo_func = bg_rem.ENGINES[engine].halo
+    max_halo = max(block_sizes) // 2
+    scores = {} # (block_size, c_value) -> list of (score, metrics) per crop
+
+    for gray_image in gray_images:
+        height, width = gray_image.shape
+        for y0, y1, x0, x1 in select_crops(gray_image):
+            if halo_func is None: # Engine needs the whole page; crop its output instead
+                region, (top, left) = gray_image, (0, 0)
+            else:
+                # Extra rows/columns around the crop make its result identical to the full page's
+                top, left = max(0, y0 - max_halo), max(0, x0 - max_halo)
+                region = gray_image[top:min(height, y1 + max_halo), left:min(width, x1 + max_halo)]
+            inner = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+
+            for block_size in block_sizes:
+                if prepare is not None:
+                    # One local threshold per window size, shared by all C offsets
+                    binarize = prepare(region, block_size)
+                    binaries = ((c_value, binarize(c_value)[inner]) for c_value in c_values)
+                else:
+                    binaries = ((c_value, bg_rem.remove_background(region, block_size, c_value, engine)[inner])
+                                for c_value in c_values)
+                for c_value, binary in binaries:
+                    scores.setdefault((block_size, c_value), []).append(score_binary(binary))
+
+    results = []
+    for (block_size, c_value), crop_scores in scores.items():
+        entry = {'block_size': block_size, 'c_value': c_value,
+                 'score': float(np.mean([score for score, _ in crop_scores]))}
+        for name in crop_scores[0][1]:
+            entry[name] = float(np.mean([metrics.get(name, math.nan) for _, metrics in crop_scores]))
+        results.append(entry)
+    results.sort(key=lambda entry: -entry['score'])
+    return results
+
+
+def sample_paths(image_paths, sample_size):
+    """Picks sample_size paths spread evenly over the (sorted) list."""
+    image_paths = list(image_paths)
+    if len(image_paths) <= sample_size:
+        return image_paths
+    step = len(image_paths) / sample_size
+    return [image_paths[int(i * step)] for i in range(sample_size)]
+
+
+def autotune(image_paths, sample_size=4, engine=bg_rem.DEFAULT_ENGINE, block_sizes=DEFAULT_BLOCK_SIZES,
+             c_values=DEFAULT_C_VALUES):
+    """
+    Finds the best block_size / c_value for a set of pages.
+    Returns:
+        Dict with engine, block_size, c_value, score, the sampled files and
+        the number of candidates tried.
+    Raises:
+        ValueError if none of the sampled pages could be read.
+    """
+    sample = sample_paths(image_paths, sample_size)
+    gray_images = []
+    for path in sample:
+        try:
+            gray_images.append(bg_rem.load_gray(path))
+        except Exception as e:
+            print(f"Auto-tune: skipping {path}: {e}")
+    if not gray_images:
+        raise ValueError("None of the sampled images could be read.")
+
+    results = [entry for entry in sweep(gray_images, block_sizes, c_values, engine) if entry['score'] > -math.inf]
+    if not results:
+        raise ValueError("No parameter combination produced a usable result.")
+    best = results[0]
+    return {
+        'engine': engine,
+        'block_size': best['block_size'],
+        'c_value': best['c_value'],
+        'score': best['score'],
+        'sample': [os.path.basename(path) for path in sample],
+        'candidates': len(block_sizes) * len(c_values),
+        'updated': time.time(),
+    }
+
+
+def tuning_path(folder):
+    return os.path.join(folder, TUNING_FILENAME)
+
+
+def load_tuned_params(folder, engine=None):
+    """
+    Returns the parameters saved for folder (a dict as returned by autotune),
+    or None if there are none, or if engine is given and they were tuned for another one.
+    """
+    try:
+        with open(tuning_path(folder), 'r', encoding='utf-8') as f:
+            params = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if engine is not None and params.get('engine') != engine:
+        return None
+    return params
+
+
+def save_tuned_params(folder, params):
+    """Stores params (from autotune) for folder, replacing earlier ones atomically."""
+    path = tuning_path(folder)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+    os.replace(tmp_path, path)
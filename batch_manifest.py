@@ -0,0 +1,120 @@
+# batch_manifest.py
+"""
+Manifest of finished batch work, so interrupted or repeated runs only process
+new or changed files.
+
+The manifest is a JSON-lines file in the output folder. Every finished file
+appends one record (stage, source path, size, mtime, content hash, parameters,
+output path, status); when a file appears more than once, the last record wins.
+Appending keeps a crash from losing more than the record being written.
+"""
+import json
+import os
+import time
+
+import result_cache
+
+MANIFEST_FILENAME = '.batch_manifest.jsonl'
+
+
+def _normalize_params(params):
+    # Compare parameters the way they look after a JSON round trip (tuples -> lists etc.)
+    return json.loads(json.dumps(params, sort_keys=True))
+
+
+class BatchManifest:
+    """Tracks which (stage, source file) pairs are done and with which parameters."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self._records = {} # (stage, absolute source path) -> latest record
+        self._stats = {} # (stage, absolute source path) -> (size, mtime_ns) seen by pending()
+        line_count = self._load()
+        if line_count > 2 * len(self._records) + 100:
+            self.compact()
+
+    def _load(self):
+        line_count = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line_count += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # Partially written line from an interrupted run
+                    self._records[(record['stage'], record['source'])] = record
+        except FileNotFoundError:
+            pass
+        return line_count
+
+    def compact(self):
+        """Rewrites the manifest with only the latest record per file."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self._records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def is_current(self, stage, source_path, params):
+        """
+        True if source_path was already processed successfully for this stage
+        with the same parameters, is unchanged since, and its output still exists.
+        """
+        key = (stage, os.path.abspath(source_path))
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        self._stats[key] = (stat.st_size, stat.st_mtime_ns)
+
+        record = self._records.get(key)
+        if not record or record['status'] != 'done' or record['params'] != _normalize_params(params):
+            return False
+        if record.get('output') and not os.path.exists(record['output']):
+            return False
+        if stat.st_size != record['size']:
+            return False
+        if stat.st_mtime_ns == record['mtime_ns']:
+            return True
+        # Touched (e.g. copied again) but possibly unchanged: compare the contents
+        if record.get('hash') and result_cache.hash_file(source_path) == record['hash']:
+            self._append(dict(record, mtime_ns=stat.st_mtime_ns, updated=time.time()))
+            return True
+        return False
+
+    def pending(self, stage, source_paths, params):
+        """Returns the paths that still need processing for this stage."""
+        return [path for path in source_paths if not self.is_current(stage, path, params)]
+
+    def record(self, stage, result, params):
+        """Appends the outcome of a batch_processor.PageResult."""
+        key = (stage, os.path.abspath(result.source_path))
+        size, mtime_ns = self._stats.get(key) or self._stat(result.source_path)
+        self._append({
+            'stage': stage,
+            'source': key[1],
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'hash': result.source_hash,
+            'params': _normalize_params(params),
+            'output': os.path.abspath(result.output_path) if result.output_path else None,
+            'status': 'done' if result.ok else 'error',
+            'error': result.error,
+            'updated': time.time(),
+        })
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None, None
+
+    def _append(self, record):
+        self._records[(record['stage'], record['source'])] = record
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
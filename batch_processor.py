@@ -0,0 +1,815 @@
+# batch_processor.py
+"""
+Headless batch engine for cleaning (and optionally OCRing) folders of note images.
+
+The GUI uses it for "Batch Process Folder", and it can also be run on its own:
+    python batch_processor.py INPUT_FOLDER OUTPUT_FOLDER --workers 8 --ocr en
+
+With --pipeline, reading, cleaning, saving and OCR overlap instead of running
+as separate passes (see pipeline.py).
+
+Finished files are recorded in a manifest in the output folder, so repeated or
+interrupted runs only process new or changed files (--full turns this off).
+With --watch the input folder is polled and new scans are processed as they arrive.
+
+--autotune picks block_size / c_value for the folder (see autotune.py) and
+saves them there; later runs reuse the saved values unless --block-size or
+--c-value are given.
+
+--daemon sends the OCR pass to a running ocr_daemon.py, whose readers are
+already loaded, instead of loading the models in this process.
+
+--dedup finds retakes and burst shots of the same page, processes only the
+sharpest photo of each and links the others to its outputs (see dedup.py).
+
+--index adds the OCR results to the full-text search index as pages finish
+(see search_index.py).
+
+Cleaned pages are saved as 1-bit PNGs (--png-depth 8 for grayscale ones);
+--archive also collects them in one multi-page Group 4 TIFF or ZIP file
+(see page_archive.py), and with --archive-only they only go into the archive.
+
+--stats prints per-stage timings at the end of the run; --stats-log and
+--stats-prom write them as JSON lines or in the Prometheus text format
+(see instrumentation.py).
+"""
+import argparse
+import inspect
+import io
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+import autotune
+import batch_manifest
+import bg_rem
+import dedup
+import instrumentation
+import ocr_daemon
+import ocr_processor
+import page_archive
+import pipeline
+import result_cache
+import search_index
+# Shared with pipeline.py; re-exported here, where callers have always found them
+from page_outputs import PageResult, ocr_sidecar_paths, output_path_for, write_ocr_sidecars
+from page_outputs import copy_output, write_output
+
+VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+
+@dataclass
+class RunSummary:
+    """Results of run_folder, per stage."""
+    clean_results: list = field(default_factory=list)
+    ocr_results: list = field(default_factory=list)
+    skipped_clean: int = 0
+    skipped_ocr: int = 0
+
+    @property
+    def error_count(self):
+        return sum(1 for r in self.clean_results + self.ocr_results if not r.ok)
+
+    @property
+    def duplicate_count(self):
+        """Pages that were linked to a near-duplicate's outputs instead of being cleaned."""
+        return sum(1 for r in self.clean_results if r.duplicate_of and r.ok)
+
+
+def list_image_files(folder_path):
+    """Returns the sorted paths of all supported image files in a folder."""
+    return sorted(
+        os.path.join(folder_path, fname)
+        for fname in os.listdir(folder_path)
+        if fname.lower().endswith(VALID_EXTENSIONS)
+    )
+
+
+def link_output(src, dst):
+    """
+    Makes dst a hard link to src, or a copy where links are not possible.
+    Every output writer replaces its file instead of writing into it (see
+    page_outputs.write_output), so a later rewrite of either name unlinks the pair.
+    """
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _link_duplicates(stage, result, duplicates, output_dir):
+    """Gives each of duplicates the outputs of result's page; returns their PageResults."""
+    results = []
+    for path in duplicates:
+        if not result.ok:
+            results.append(PageResult(path, error=f"Duplicate of {result.source_path}, which failed: {result.error}",
+                                      duplicate_of=result.source_path))
+            continue
+        try:
+            if stage == 'clean':
+                output_path = output_path_for(path, output_dir) if result.output_path else None
+                if output_path: # No PNG to link when pages only go into an archive
+                    link_output(result.output_path, output_path)
+            else: # OCR pages are cleaned images; both sidecars are linked
+                for src, dst in zip(ocr_sidecar_paths(result.source_path, output_dir), ocr_sidecar_paths(path, output_dir)):
+                    link_output(src, dst)
+                output_path = ocr_sidecar_paths(path, output_dir)[0]
+            results.append(PageResult(path, output_path, duplicate_of=result.source_path))
+        except OSError as e:
+            results.append(PageResult(path, error=str(e), duplicate_of=result.source_path))
+    return results
+
+
+def clean_image_file(image_path, output_dir, block_size=21, c_value=10, cache=None, max_tile_bytes=None,
+                     fast_decode=True, engine=bg_rem.DEFAULT_ENGINE, bit_depth=bg_rem.DEFAULT_PNG_BIT_DEPTH,
+                     compress_level=bg_rem.DEFAULT_PNG_COMPRESS_LEVEL, keep_encoded=False, write_png=True):
+    """
+    Cleans one image file and saves the result into output_dir.
+    Errors are captured in the returned PageResult instead of being raised,
+    so one bad file never aborts a whole batch.
+    If a result_cache.ResultCache is given, a cached result for the same
+    bytes and parameters is copied instead of being recomputed.
+    If max_tile_bytes is set, the page is processed in bands within that
+    memory budget and streamed to disk (see bg_rem.remove_background_to_file).
+    fast_decode decodes straight to grayscale (see bg_rem.load_gray); turn it
+    off to get exactly the pixels of the GUI's "Process Current".
+    engine names the thresholding method (see bg_rem.ENGINES).
+    bit_depth and compress_level set the PNG format (see bg_rem.encode_png).
+    keep_encoded returns the PNG in PageResult.encoded as well (for an archive);
+    with write_png off it is not saved to output_dir at all.
+    """
+    output_path = output_path_for(image_path, output_dir)
+    in_memory = keep_encoded or not write_png
+    try:
+        with instrumentation.stage('read') as timing:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            source_hash = result_cache.hash_bytes(data)
+            timing.add(bytes_read=len(data))
+
+        if cache is not None:
+            key = clean_cache_key(source_hash, dict(block_size=block_size, c_value=c_value, fast_decode=fast_decode,
+                                                    engine=engine, bit_depth=bit_depth, compress_level=compress_level))
+            cached_path = cache.get_image_path(key)
+            if cached_path is not None:
+                instrumentation.event('result_cache', hits=1)
+                encoded = None
+                if in_memory:
+                    with open(cached_path, 'rb') as f:
+                        encoded = f.read()
+                if write_png:
+                    copy_output(cached_path, output_path)
+                return PageResult(image_path, output_path if write_png else None, source_hash=source_hash,
+                                  encoded=encoded if keep_encoded else None)
+            instrumentation.event('result_cache', misses=1)
+
+        if max_tile_bytes:
+            target = io.BytesIO() if in_memory else output_path
+            with Image.open(io.BytesIO(data)) as pil_img:
+                if fast_decode and pil_img.format == 'JPEG':
+                    pil_img.draft('L', pil_img.size) # Keep the decoded source at one byte per pixel
+                bg_rem.remove_background_to_file(pil_img, target, block_size, c_value, max_tile_bytes,
+                                                 compress_level=compress_level, engine=engine, bit_depth=bit_depth)
+            encoded = target.getvalue() if in_memory else None
+            if in_memory and write_png:
+                write_output(output_path, encoded)
+        else:
+            if fast_decode:
+                gray_image = bg_rem.load_gray(data)
+            else:
+                with Image.open(io.BytesIO(data)) as pil_img:
+                    gray_image = bg_rem.pil_to_gray(pil_img)
+            cv_processed = bg_rem.remove_background(gray_image, block_size=block_size, c_value=c_value, engine=engine)
+            with instrumentation.stage('encode', width=cv_processed.shape[1], height=cv_processed.shape[0]) as timing:
+                encoded = bg_rem.encode_png(cv_processed, bit_depth, compress_level)
+                if write_png:
+                    write_output(output_path, encoded)
+                timing.add(bytes_written=len(encoded))
+
+        if cache is not None:
+            if encoded is not None:
+                cache.put_png(key, encoded)
+            else:
+                cache.put_image_file(key, output_path)
+        return PageResult(image_path, output_path if write_png else None, source_hash=source_hash,
+                          encoded=encoded if keep_encoded else None)
+    except Exception as e:
+        return PageResult(image_path, error=str(e))
+
+
+def _clean_chunk(image_paths, output_dir, clean_options, collect_stats=False):
+    """
+    Worker entry point: cleans a chunk of files inside a pool process.
+    Returns the PageResults, the instrumentation records of the chunk if
+    collect_stats is set (the parent process replays them into its own sinks),
+    and the bytes added to the result cache, which the parent accounts for.
+    """
+    cache = clean_options.get('cache')
+    if not collect_stats:
+        results, records = [clean_image_file(path, output_dir, **clean_options) for path in image_paths], []
+    else:
+        with instrumentation.recording(instrumentation.ListSink()) as sink:
+            results = [clean_image_file(path, output_dir, **clean_options) for path in image_paths]
+        records = sink.records
+    return results, records, cache.unaccounted_bytes if cache is not None else 0
+
+
+def _chunked(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def iter_batch(image_paths, output_dir, workers=None, chunk_size=4, ordered=True, **clean_options):
+    """
+    Cleans image_paths in parallel and yields a PageResult per file.
+    Args:
+        image_paths: Source image paths.
+        output_dir: Folder the cleaned PNGs are written to (must exist).
+        workers: Number of worker processes (defaults to the CPU count).
+                 With 1 worker everything runs in the calling process.
+        chunk_size: Files handed to a worker per task; larger chunks mean less
+                    inter-process overhead, smaller ones smoother progress.
+        ordered: If True, results come back in input order, otherwise as soon
+                 as they finish.
+        clean_options: Keyword arguments for clean_image_file (block_size,
+                       c_value, cache, max_tile_bytes, fast_decode, engine, bit_depth,
+                       compress_level).
+    """
+    image_paths = list(image_paths)
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, chunk_size)
+
+    if workers == 1:
+        for path in image_paths:
+            yield clean_image_file(path, output_dir, **clean_options)
+        return
+
+    chunks = _chunked(image_paths, chunk_size)
+    # Only keep a couple of chunks per worker in flight, so huge folders don't
+    # queue thousands of pending tasks (and their results) at once.
+    max_pending = workers * 2
+    collect_stats = instrumentation.enabled()
+
+    def chunk_results(future):
+        results, records, cache_bytes = future.result()
+        instrumentation.replay(records)
+        if cache_bytes:
+            clean_options['cache'].account(cache_bytes)
+        return results
+
+    # Forked workers would inherit the parent's sinks; they report through _clean_chunk instead
+    with ProcessPoolExecutor(max_workers=workers, initializer=instrumentation.reset) as executor:
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return None
+            return executor.submit(_clean_chunk, chunk, output_dir, clean_options, collect_stats)
+
+        if ordered:
+            pending = deque()
+            for _ in range(max_pending):
+                future = submit_next()
+                if future is None:
+                    break
+                pending.append(future)
+            while pending:
+                results = chunk_results(pending.popleft())
+                future = submit_next()
+                if future is not None:
+                    pending.append(future)
+                yield from results
+        else:
+            pending = set()
+            for _ in range(max_pending):
+                future = submit_next()
+                if future is None:
+                    break
+                pending.add(future)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for finished in done:
+                    future = submit_next()
+                    if future is not None:
+                        pending.add(future)
+                    yield from chunk_results(finished)
+
+
+def _collect(results_iter, total, progress_callback):
+    results = []
+    for result in results_iter:
+        results.append(result)
+        if progress_callback:
+            progress_callback(len(results), total, result)
+    return results
+
+
+def run_batch(image_paths, output_dir, progress_callback=None, **kwargs):
+    """
+    Runs iter_batch to completion and returns the list of PageResults.
+    progress_callback, if given, is called as progress_callback(done, total, result)
+    after every file. Remaining keyword arguments go to iter_batch.
+    """
+    image_paths = list(image_paths)
+    os.makedirs(output_dir, exist_ok=True)
+    return _collect(iter_batch(image_paths, output_dir, **kwargs), len(image_paths), progress_callback)
+
+
+def _ocr_group(image_paths, output_dir, lang, batch_size, cache, use_regions, target_text_height):
+    loaded, results, hashes = [], {}, {}
+    for path in image_paths:
+        try:
+            hashes[path] = result_cache.hash_file(path)
+            if cache is not None:
+                cached = cache.get_lines(result_cache.ocr_key(hashes[path], lang, regions=use_regions,
+                                                              text_height=target_text_height))
+                if cached is not None:
+                    text_path = write_ocr_sidecars(path, output_dir, lang, cached)
+                    results[path] = PageResult(path, text_path, source_hash=hashes[path])
+                    continue
+            with instrumentation.stage('ocr_load') as timing:
+                pil_img = Image.open(path)
+                pil_img.load()
+                timing.add(width=pil_img.width, height=pil_img.height)
+            loaded.append((path, pil_img))
+        except Exception as e:
+            results[path] = PageResult(path, error=str(e))
+
+    if loaded:
+        try:
+            page_lines = ocr_processor.extract_lines_from_images(
+                [img for _, img in loaded], lang=lang, batch_size=batch_size, use_regions=use_regions,
+                target_text_height=target_text_height)
+            for (path, _), lines in zip(loaded, page_lines):
+                try:
+                    text_path = write_ocr_sidecars(path, output_dir, lang, lines)
+                    results[path] = PageResult(path, text_path, source_hash=hashes[path])
+                    if cache is not None:
+                        cache.put_lines(result_cache.ocr_key(hashes[path], lang, regions=use_regions,
+                                                             text_height=target_text_height), lines)
+                except Exception as e:
+                    results[path] = PageResult(path, error=str(e))
+        except Exception as e:
+            for path, _ in loaded:
+                results[path] = PageResult(path, error=f"OCR failed: {e}")
+
+    return [results[path] for path in image_paths]
+
+
+def iter_ocr_batch(image_paths, output_dir, lang='en', pages_per_batch=8, batch_size=32, cache=None,
+                   use_regions=True, target_text_height=ocr_processor.TARGET_TEXT_HEIGHT):
+    """
+    Streams images through one warm EasyOCR reader and yields a PageResult per
+    file. For each page a <name>.txt and a <name>.json sidecar (lines, boxes,
+    confidences) are written into output_dir.
+    Args:
+        image_paths: Images to OCR; consumed lazily, so a generator works too.
+        lang: OCR language code or list of codes.
+        pages_per_batch: Pages whose text crops share recognizer batches.
+        batch_size: Text crops per recognizer batch.
+        cache: Optional result_cache.ResultCache; pages OCRed before are not OCRed again.
+        use_regions: OCR only the text blocks of each page and skip blank pages
+                     (see text_regions.py); False sends whole pages to the detector.
+        target_text_height: Glyph height large text is shrunk to for detection
+                            (see ocr_processor.ocr_scale); None turns this off.
+    """
+    group = []
+    for path in image_paths:
+        group.append(path)
+        if len(group) >= pages_per_batch:
+            yield from _ocr_group(group, output_dir, lang, batch_size, cache, use_regions, target_text_height)
+            group = []
+    if group:
+        yield from _ocr_group(group, output_dir, lang, batch_size, cache, use_regions, target_text_height)
+
+
+def run_ocr_batch(image_paths, output_dir, progress_callback=None, daemon=None, **kwargs):
+    """
+    Runs iter_ocr_batch to completion; see run_batch for progress_callback.
+    With daemon (an ocr_daemon.DaemonClient) the pages are OCRed by the daemon instead.
+    """
+    image_paths = list(image_paths)
+    os.makedirs(output_dir, exist_ok=True)
+    results = (daemon.iter_ocr_batch if daemon is not None else iter_ocr_batch)(image_paths, output_dir, **kwargs)
+    return _collect(results, len(image_paths), progress_callback)
+
+
+def _clean_params(clean_options):
+    """The clean_image_file options that change its output, as recorded in the manifest."""
+    defaults = inspect.signature(clean_image_file).parameters
+    names = ('block_size', 'c_value', 'fast_decode', 'engine', 'bit_depth', 'compress_level')
+    return {name: clean_options.get(name, defaults[name].default) for name in names}
+
+
+def clean_cache_key(source_hash, clean_options):
+    """
+    The result_cache key of clean_image_file's output for a source with these
+    options (missing ones take its defaults). The GUI's "Process Current" uses it
+    too, so it shares cache entries with batch runs.
+    """
+    params = _clean_params(clean_options)
+    return result_cache.clean_key(source_hash, params['block_size'], params['c_value'], params['engine'],
+                                  decode='gray' if params['fast_decode'] else 'rgb',
+                                  depth=params['bit_depth'], level=params['compress_level'])
+
+
+def _ocr_params(ocr_options):
+    """The iter_ocr_batch options that change its output, as recorded in the manifest."""
+    defaults = inspect.signature(iter_ocr_batch).parameters
+    lang = ocr_options.get('lang', 'en')
+    lang_list = [lang] if not isinstance(lang, list) else lang
+    params = {name: ocr_options.get(name, defaults[name].default) for name in ('use_regions', 'target_text_height')}
+    return dict(params, lang=sorted(set(lang_list)))
+
+
+class _ArchiveFeed:
+    """
+    Adds the pages of a run to an archive in input order as they are cleaned.
+    Cleaned pages arrive with their PNG in memory (PageResult.encoded), in any
+    order, and wait until the pages before them are in. Pages the run does not
+    clean (unchanged ones) are added from their PNGs in output_dir in their turn.
+    """
+
+    def __init__(self, archive, image_paths, output_dir, cleaned):
+        self.archive = archive
+        self.output_dir = output_dir
+        self._order = deque(image_paths)
+        self._cleaned = set(cleaned) # Pages that will arrive through add()
+        self._arrived = {} # path -> PageResult, until the pages before it are in
+
+    def add(self, result, encoded):
+        """Takes a cleaned page; encoded is its PNG, or None to read it from its output file."""
+        self._arrived[result.source_path] = (result, encoded)
+        self._flush()
+
+    def finish(self):
+        """Adds the remaining pages; call once the run is done."""
+        self._cleaned.clear()
+        self._flush()
+
+    def _flush(self):
+        while self._order and (self._order[0] in self._arrived or self._order[0] not in self._cleaned):
+            path = self._order.popleft()
+            result, encoded = self._arrived.pop(path, (None, None))
+            if result is not None and not result.ok:
+                continue
+            output_path = output_path_for(path, self.output_dir)
+            if encoded is None and not os.path.exists(output_path):
+                continue # Never cleaned (e.g. an earlier run failed on it)
+            with instrumentation.stage('archive') as timing:
+                try:
+                    if encoded is not None:
+                        self.archive.add_png(encoded, os.path.basename(output_path))
+                    else:
+                        self.archive.add_page(output_path)
+                    timing.add(pages=1)
+                except Exception as e: # A broken archive must not fail the batch
+                    print(f"Could not archive {output_path}: {e}")
+
+
+def run_folder(image_paths, output_dir, manifest=None, ocr_options=None, progress_callback=None,
+               pipelined=False, pipeline_options=None, index=None, skip_duplicates=False,
+               duplicate_distance=dedup.DEFAULT_MAX_DISTANCE, archive=None, write_png=True, **clean_options):
+    """
+    Cleans image_paths and, if ocr_options is given, OCRs the cleaned pages,
+    skipping everything the manifest records as already done.
+    Args:
+        image_paths: Source image paths.
+        output_dir: Folder for cleaned pages and OCR sidecars.
+        manifest: Optional batch_manifest.BatchManifest; every finished file is recorded in it.
+        ocr_options: Keyword arguments for run_ocr_batch (lang, pages_per_batch,
+                     batch_size, cache, use_regions, target_text_height, daemon),
+                     or None to skip OCR.
+        progress_callback: Called as progress_callback(stage, done, total, result)
+                           with stage 'clean' or 'ocr'.
+        pipelined: Run the stages overlapped with pipeline.iter_pipeline instead
+                   of a process pool followed by a separate OCR pass.
+        pipeline_options: Extra keyword arguments for pipeline.iter_pipeline
+                          (read_workers, save_workers, ocr_workers, queue_size).
+        index: Optional search_index.SearchIndex; OCRed pages are added to it as they finish.
+        skip_duplicates: Clean and OCR only the sharpest of each group of near-duplicate
+                         photos (see dedup.find_duplicates); the others get links to
+                         its outputs and PageResults with duplicate_of set.
+        duplicate_distance: Hash bits near-duplicates may differ in.
+        archive: Optional page_archive archive; every cleaned page of image_paths is
+                 added to it in input order as it is produced, straight from memory
+                 (unchanged pages from their PNGs in output_dir).
+        write_png: Save each cleaned page as a PNG in output_dir. Turning it off
+                   needs an archive, which then holds the only copy, and leaves out
+                   the manifest and OCR, since both work on the PNGs.
+        clean_options: Keyword arguments for iter_batch.
+    Returns:
+        RunSummary.
+    """
+    if not write_png and (archive is None or manifest is not None or ocr_options is not None):
+        raise ValueError("Pages can only be left out of output_dir with an archive and without a manifest or OCR.")
+    image_paths = list(image_paths)
+    os.makedirs(output_dir, exist_ok=True)
+    summary = RunSummary()
+
+    def track(stage, params, total, copies, results):
+        """Returns the callback recording, indexing and reporting each finished page of a stage."""
+        done = 0
+
+        def on_result(result):
+            nonlocal done
+            encoded, result.encoded = result.encoded, None # Not kept in the summary
+            for page_result in [result] + _link_duplicates(stage, result, copies.get(os.path.abspath(result.source_path), ()), output_dir):
+                if feed is not None and stage == 'clean':
+                    feed.add(page_result, encoded)
+                done += 1
+                results.append(page_result)
+                if manifest is not None:
+                    manifest.record(stage, page_result, params)
+                if index is not None and stage == 'ocr' and page_result.ok and not page_result.duplicate_of:
+                    try:
+                        index.add_page(ocr_sidecar_paths(page_result.source_path, output_dir)[1])
+                    except Exception as e: # A broken index must not stop the batch
+                        print(f"Could not index {page_result.source_path}: {e}")
+                if progress_callback:
+                    progress_callback(stage, done, total, page_result)
+        return on_result
+
+    clean_params = _clean_params(clean_options)
+    ocr_params = _ocr_params(ocr_options) if ocr_options is not None else None
+    todo = manifest.pending('clean', image_paths, clean_params) if manifest is not None else image_paths
+    summary.skipped_clean = len(image_paths) - len(todo)
+
+    # Near-duplicates stay out of the stages; they are linked to their representative's outputs
+    duplicates = dedup.find_duplicates(todo, duplicate_distance) if skip_duplicates and len(todo) > 1 else {}
+    # representative -> its duplicates, as source and as cleaned paths; keyed by absolute
+    # path, since results (e.g. from the OCR daemon) may not use the paths passed in
+    clean_copies, ocr_copies = {}, {}
+    for path, representative in duplicates.items():
+        clean_copies.setdefault(os.path.abspath(representative), []).append(path)
+        ocr_copies.setdefault(os.path.abspath(output_path_for(representative, output_dir)), []).append(
+            output_path_for(path, output_dir))
+    feed = _ArchiveFeed(archive, image_paths, output_dir, todo) if archive is not None else None
+    total = len(todo)
+    todo = [path for path in todo if path not in duplicates]
+    clean_options = dict(clean_options, keep_encoded=feed is not None, write_png=write_png)
+
+    on_clean = track('clean', clean_params, total, clean_copies, summary.clean_results)
+    ocr_done = set()
+    if pipelined:
+        on_ocr = track('ocr', ocr_params, total, ocr_copies, summary.ocr_results)
+        # The pipeline's OCR stage runs in-process; with a daemon, OCR is the separate pass below
+        pipeline_ocr = ocr_options if ocr_options is not None and ocr_options.get('daemon') is None else None
+        results = pipeline.iter_pipeline(
+            todo, output_dir, ocr_options=pipeline_ocr, clean_workers=clean_options.get('workers'),
+            cache=clean_options.get('cache'), max_tile_bytes=clean_options.get('max_tile_bytes'),
+            keep_encoded=feed is not None, write_png=write_png, **clean_params, **(pipeline_options or {}))
+        for clean_result, ocr_result in results:
+            on_clean(clean_result)
+            if ocr_result is not None:
+                ocr_done.add(clean_result.source_path)
+                ocr_done.update(clean_copies.get(os.path.abspath(clean_result.source_path), ()))
+                on_ocr(ocr_result)
+    else:
+        run_batch(todo, output_dir, progress_callback=lambda done, total, result: on_clean(result), **clean_options)
+
+    if ocr_options is not None:
+        # Pages that were already clean (or whose OCR is still missing) get a separate OCR pass
+        failed = {r.source_path for r in summary.clean_results if not r.ok}
+        cleaned = [output_path_for(path, output_dir) for path in image_paths
+                   if path not in failed and path not in ocr_done and path not in duplicates]
+        todo = manifest.pending('ocr', cleaned, ocr_params) if manifest is not None else cleaned
+        summary.skipped_ocr = len(cleaned) - len(todo)
+        if todo:
+            on_ocr = track('ocr', ocr_params, len(todo) + sum(len(ocr_copies.get(os.path.abspath(path), ())) for path in todo),
+                           ocr_copies, summary.ocr_results)
+            run_ocr_batch(todo, output_dir, progress_callback=lambda done, total, result: on_ocr(result), **ocr_options)
+
+    if feed is not None:
+        feed.finish()
+    return summary
+
+
+def watch_folder(input_folder, output_dir, interval=5.0, stop_event=None, on_summary=None, **run_options):
+    """
+    Polls input_folder and processes new or changed images as they appear.
+    A file is only picked up once its size and modification time are the same
+    on two consecutive polls, so scans still being written are left alone.
+    Files that failed are not tried again until they change.
+    Args:
+        interval: Seconds between polls.
+        stop_event: Optional threading.Event that ends the loop when set.
+        on_summary: Called with the RunSummary of every poll that found work.
+        run_options: Keyword arguments for run_folder; a manifest is created
+                     in output_dir if none is given.
+    """
+    if run_options.get('manifest') is None:
+        run_options['manifest'] = batch_manifest.BatchManifest(output_dir)
+    previous = {}
+    failed = {} # path -> (size, mtime_ns) of the version that failed
+    while not (stop_event and stop_event.is_set()):
+        current, stable = {}, []
+        for path in list_image_files(input_folder):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue # Removed between listing and stat
+            current[path] = (stat.st_size, stat.st_mtime_ns)
+            if previous.get(path) == current[path] and failed.get(path) != current[path]:
+                stable.append(path)
+        previous = current
+
+        if stable:
+            summary = run_folder(stable, output_dir, **run_options)
+            # OCR results are about the cleaned pages; map them back to their sources
+            sources = {os.path.abspath(output_path_for(path, output_dir)): path for path in stable}
+            for result in summary.clean_results + summary.ocr_results:
+                if not result.ok:
+                    path = sources.get(os.path.abspath(result.source_path), result.source_path)
+                    if path in current:
+                        failed[path] = current[path]
+            if on_summary and (summary.clean_results or summary.ocr_results):
+                on_summary(summary)
+
+        if stop_event:
+            stop_event.wait(interval)
+        else:
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clean the backgrounds of all note images in a folder.")
+    parser.add_argument("input_folder")
+    parser.add_argument("output_folder")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=4, help="files per worker task")
+    parser.add_argument("--unordered", action="store_true", help="report files as they finish")
+    parser.add_argument("--block-size", type=int, default=None, help="default: tuned value for the folder, else 21")
+    parser.add_argument("--c-value", type=int, default=None, help="default: tuned value for the folder, else 10")
+    parser.add_argument("--autotune", action="store_true",
+                        help="pick block size and C on a sample of the folder and save them for later runs")
+    parser.add_argument("--engine", default=bg_rem.DEFAULT_ENGINE, choices=bg_rem.get_available_engines(),
+                        help="binarization method (see bg_rem.ENGINES for the trade-offs)")
+    parser.add_argument("--png-depth", type=int, default=bg_rem.DEFAULT_PNG_BIT_DEPTH, choices=bg_rem.PNG_BIT_DEPTHS,
+                        help="bits per pixel of the cleaned PNGs (1: black and white, 8: grayscale)")
+    parser.add_argument("--compress-level", type=int, default=bg_rem.DEFAULT_PNG_COMPRESS_LEVEL, choices=range(10),
+                        metavar="0-9", help="PNG compression, from fastest to smallest (default: %(default)s)")
+    parser.add_argument("--archive", metavar="PATH",
+                        help="also collect the cleaned pages in one .tif (multi-page) or .zip file")
+    parser.add_argument("--archive-compression", default=page_archive.DEFAULT_TIFF_COMPRESSION,
+                        choices=page_archive.TIFF_COMPRESSIONS, help="compression of --archive TIFFs")
+    parser.add_argument("--archive-only", action="store_true",
+                        help="don't also save each page as a PNG (always processes every file; no --ocr)")
+    parser.add_argument("--tile-mb", type=float, default=None,
+                        help="process pages in bands within this working-memory budget (for very large scans)")
+    parser.add_argument("--exact-decode", action="store_true",
+                        help="decode via RGB like the GUI does instead of straight to grayscale")
+    parser.add_argument("--cache-dir", default=result_cache.DEFAULT_CACHE_DIR, help="result cache folder")
+    parser.add_argument("--no-cache", action="store_true", help="always recompute, never use the result cache")
+    parser.add_argument("--full", action="store_true", help="reprocess every file, ignoring the manifest of earlier runs")
+    parser.add_argument("--watch", action="store_true", help="keep running and process new files as they appear")
+    parser.add_argument("--watch-interval", type=float, default=5.0, help="seconds between polls in watch mode")
+    parser.add_argument("--pipeline", action="store_true", help="overlap reading, cleaning, saving and OCR")
+    parser.add_argument("--io-workers", type=int, default=2, help="read and save threads each, with --pipeline")
+    parser.add_argument("--queue-size", type=int, default=8, help="pages buffered between stages, with --pipeline")
+    parser.add_argument("--ocr", metavar="LANG", help="also OCR the cleaned pages (e.g. 'en' or 'en,pl')")
+    parser.add_argument("--ocr-pages-per-batch", type=int, default=8)
+    parser.add_argument("--ocr-batch-size", type=int, default=32)
+    parser.add_argument("--ocr-full-page", action="store_true",
+                        help="send whole pages to OCR instead of only the detected text blocks")
+    parser.add_argument("--ocr-text-height", type=int, default=ocr_processor.TARGET_TEXT_HEIGHT,
+                        help="shrink pages with taller text to this glyph height for text detection "
+                             "(0 = detect at full resolution)")
+    parser.add_argument("--daemon", metavar="URL", nargs="?", const=ocr_daemon.DEFAULT_URL,
+                        help="OCR through a running ocr_daemon.py (default URL: %(const)s)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="process only the sharpest of near-duplicate photos and link the others to its outputs")
+    parser.add_argument("--dedup-distance", type=int, default=dedup.DEFAULT_MAX_DISTANCE,
+                        help="ink hash bits (of %d) candidates may differ in before their content is compared"
+                             % dedup.HASH_SIZE ** 2)
+    parser.add_argument("--index", metavar="DB", nargs="?", const=search_index.DEFAULT_INDEX_PATH,
+                        help="add the OCR results to a search index (default: %(const)s)")
+    parser.add_argument("--stats", action="store_true", help="print a per-stage timing table at the end")
+    parser.add_argument("--stats-log", metavar="PATH", help="append per-stage timing records as JSON lines")
+    parser.add_argument("--stats-prom", metavar="PATH", help="write running totals in the Prometheus text format")
+    args = parser.parse_args(argv)
+    if args.archive and args.watch:
+        parser.error("--archive can't be combined with --watch")
+    if args.archive_only and not args.archive:
+        parser.error("--archive-only needs --archive")
+    if args.archive_only and args.ocr:
+        parser.error("--archive-only can't be combined with --ocr, which reads the page PNGs")
+
+    tuned = None
+    if args.autotune:
+        print("Auto-tuning block size and C...")
+        try:
+            tuned = autotune.autotune(list_image_files(args.input_folder), engine=args.engine)
+        except ValueError as e:
+            print(f"Auto-tune failed: {e}")
+            return 1
+        try:
+            autotune.save_tuned_params(args.input_folder, tuned)
+        except OSError as e:
+            print(f"Could not save the tuned parameters: {e}") # Still use them for this run
+    elif args.block_size is None or args.c_value is None:
+        tuned = autotune.load_tuned_params(args.input_folder, engine=args.engine)
+    block_size = args.block_size if args.block_size is not None else (tuned['block_size'] if tuned else 21)
+    c_value = args.c_value if args.c_value is not None else (tuned['c_value'] if tuned else 10)
+    print(f"Using engine {args.engine}, block size {block_size}, C {c_value}"
+          f"{' (tuned)' if tuned else ''}.")
+
+    cache = None if args.no_cache else result_cache.ResultCache(args.cache_dir)
+    daemon = None
+    if args.daemon and args.ocr:
+        daemon = ocr_daemon.DaemonClient(args.daemon)
+        if daemon.ping() is None:
+            print(f"No OCR daemon answers at {args.daemon}.")
+            return 1
+    # Without page PNGs there is nothing for a later run to reuse
+    manifest = None if args.full or args.archive_only else batch_manifest.BatchManifest(args.output_folder)
+
+    def report(stage, done, total, result):
+        if result.ok and result.duplicate_of:
+            print(f"[{stage} {done}/{total}] {os.path.basename(result.source_path)} "
+                  f"(duplicate of {os.path.basename(result.duplicate_of)})")
+        elif result.ok:
+            print(f"[{stage} {done}/{total}] {os.path.basename(result.source_path)}")
+        else:
+            print(f"[{stage} {done}/{total}] Error processing {result.source_path}: {result.error}")
+
+    def print_summary(summary):
+        clean_errors = sum(1 for r in summary.clean_results if not r.ok)
+        print(f"Batch complete: {len(summary.clean_results) - clean_errors} processed"
+              f"{f' ({summary.duplicate_count} as duplicates)' if summary.duplicate_count else ''}, "
+              f"{summary.skipped_clean} unchanged, {clean_errors} errors.")
+        if args.ocr:
+            ocr_errors = sum(1 for r in summary.ocr_results if not r.ok)
+            print(f"OCR complete: {len(summary.ocr_results) - ocr_errors} pages, "
+                  f"{summary.skipped_ocr} unchanged, {ocr_errors} errors.")
+
+    run_options = dict(
+        manifest=manifest, progress_callback=report,
+        workers=args.workers, chunk_size=args.chunk_size, ordered=not args.unordered,
+        block_size=block_size, c_value=c_value, engine=args.engine, cache=cache,
+        max_tile_bytes=int(args.tile_mb * 1024 * 1024) if args.tile_mb else None,
+        fast_decode=not args.exact_decode, bit_depth=args.png_depth, compress_level=args.compress_level,
+        pipelined=args.pipeline,
+        index=search_index.SearchIndex(args.index) if args.index and args.ocr else None,
+        skip_duplicates=args.dedup, duplicate_distance=args.dedup_distance,
+        pipeline_options=dict(read_workers=args.io_workers, save_workers=args.io_workers, queue_size=args.queue_size),
+        ocr_options=dict(
+            lang=args.ocr.split(','), pages_per_batch=args.ocr_pages_per_batch,
+            batch_size=args.ocr_batch_size, cache=cache, use_regions=not args.ocr_full_page,
+            target_text_height=args.ocr_text_height or None, daemon=daemon,
+        ) if args.ocr else None,
+    )
+
+    stage_totals = instrumentation.StageTotals() if args.stats else None
+    sinks = [sink for sink in (
+        stage_totals,
+        instrumentation.JsonLinesSink(args.stats_log) if args.stats_log else None,
+        instrumentation.PrometheusSink(args.stats_prom) if args.stats_prom else None,
+    ) if sink is not None]
+
+    with instrumentation.recording(*sinks):
+        if args.watch:
+            print(f"Watching {args.input_folder} (Ctrl+C to stop)...")
+            try:
+                watch_folder(args.input_folder, args.output_folder, interval=args.watch_interval,
+                             on_summary=print_summary, **run_options)
+            except KeyboardInterrupt:
+                pass
+            exit_code = 0
+        else:
+            image_paths = list_image_files(args.input_folder)
+            if not image_paths:
+                print("No supported image files found in the input folder.")
+                return 1
+            try:
+                archive = page_archive.open_archive(args.archive, args.archive_compression) if args.archive else None
+            except (OSError, ValueError) as e:
+                print(f"Could not create the archive: {e}")
+                return 1
+            try:
+                summary = run_folder(image_paths, args.output_folder, archive=archive,
+                                     write_png=not args.archive_only, **run_options)
+            finally:
+                if archive is not None:
+                    archive.close()
+            print_summary(summary)
+            if archive is not None:
+                print(f"Archived {archive.page_count} pages in {args.archive}.")
+            exit_code = 1 if summary.error_count else 0
+
+    if stage_totals is not None:
+        print()
+        print(stage_totals.format_table())
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
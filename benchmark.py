@@ -0,0 +1,333 @@
+# benchmark.py
+"""
+Benchmark for the cleaning and OCR stages on synthetic note pages.
+
+Pages are generated deterministically (seeded): handwriting-like text on a
+textured, unevenly lit paper background, encoded as JPEG like a phone photo.
+Each stage is timed per page and the results are written as JSON, so runs
+can be compared against a stored baseline:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json --threshold 0.10
+
+--engines also times the other binarization engines (bg_rem.ENGINES) on the
+same pages, reported as threshold[<engine>].
+
+Everything runs offline on CPU. The OCR stage is opt-in (--ocr) and needs the
+EasyOCR models to be downloaded already.
+
+The pages are rendered once in a separate process and cached as JPEG files
+(--page-cache), so the measured process only loads and processes them and its
+peak RSS reflects the pipeline, not the page generator.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import bg_rem
+
+# name -> (width, height)
+RESOLUTIONS = {
+    'small': (1240, 1754), # A4 at 150 dpi
+    'medium': (2480, 3508), # A4 at 300 dpi
+    'large': (4032, 3024), # 12 MP phone photo
+}
+PAGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'notes_digitizer_benchmark')
+PAGE_VERSION = 1 # Bump when make_note_page changes, so cached pages are rendered again
+# Stages of the default single-image path, whose sum gives pages/s
+PAGE_STAGES = ('decode', 'convert', 'threshold', 'encode')
+WORDS = ("the note page meeting agenda project review budget draft idea list todo "
+         "check update plan data result summary next week call email design test "
+         "lecture chapter formula proof example question answer remember").split()
+
+
+def make_note_page(width, height, seed=0):
+    """
+    Renders a synthetic photographed note page.
+    Returns:
+        RGB PIL image of the given size; identical for identical arguments.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Ink layer: ruled lines and lines of text drawn as coverage (0..255)
+    ink = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(ink)
+    line_height = max(12, height // 40)
+    font_size = int(line_height * 0.6)
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError: # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    margin = width // 10
+    for y in range(line_height * 2, height - line_height, line_height):
+        draw.line([(0, y), (width, y)], fill=60, width=max(1, height // 1500)) # Faint ruling
+        if rng.random() < 0.25:
+            continue # Leave some lines empty, as real notes do
+        x = margin + int(rng.integers(0, margin))
+        while x < width - margin:
+            word = str(rng.choice(WORDS))
+            draw.text((x, y - font_size - line_height // 8), word, fill=int(rng.integers(200, 256)), font=font)
+            x += int(draw.textlength(word, font=font)) + font_size // 2 + int(rng.integers(0, font_size))
+    coverage = np.asarray(ink, dtype=np.float32) / 255.0
+
+    # Paper: low-frequency blotches plus fine grain
+    blotches = cv2.resize(rng.random((height // 64 + 2, width // 64 + 2), dtype=np.float32),
+                          (width, height), interpolation=cv2.INTER_CUBIC)
+    paper = 232.0 + 16.0 * (blotches - 0.5) + rng.normal(0.0, 4.0, (height, width)).astype(np.float32)
+
+    # Uneven lighting: bright spot somewhere on the page, darker towards the far corners
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+    distance = np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2) / np.hypot(width, height)
+    lighting = 1.0 - 0.55 * distance
+
+    page = np.empty((height, width, 3), dtype=np.float32)
+    ink_color = (40.0, 45.0, 90.0) # Blue-black pen
+    paper_tint = (1.0, 0.97, 0.9)
+    for channel in range(3):
+        page[..., channel] = (paper * paper_tint[channel] * (1.0 - coverage) + ink_color[channel] * coverage) * lighting
+    return Image.fromarray(np.clip(page, 0, 255).astype(np.uint8), 'RGB')
+
+
+def encode_jpeg(pil_image, quality=90):
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _time_page(data, ocr_lang=None, engines=()):
+    """Runs every stage on one encoded page; returns {stage: seconds}."""
+    timings = {}
+
+    start = time.perf_counter()
+    pil_image = Image.open(io.BytesIO(data))
+    pil_image.load()
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cv_image = bg_rem.pil_to_cv(pil_image)
+    timings['convert'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    binary = bg_rem.remove_background(cv_image)
+    timings['threshold'] = time.perf_counter() - start
+
+    for engine in engines:
+        start = time.perf_counter()
+        bg_rem.remove_background(cv_image, engine=engine)
+        timings[f'threshold[{engine}]'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bg_rem.encode_png(binary)
+    timings['encode'] = time.perf_counter() - start
+
+    # Alternative fast path: decode straight to gray (replaces decode + convert)
+    start = time.perf_counter()
+    bg_rem.load_gray(data)
+    timings['decode_gray'] = time.perf_counter() - start
+
+    if ocr_lang:
+        import ocr_processor # Only pulled in (with torch) when OCR is benchmarked
+        start = time.perf_counter()
+        text = ocr_processor.extract_text_from_image(bg_rem.cv_to_pil(binary), lang=ocr_lang)
+        timings['ocr'] = time.perf_counter() - start
+        if text.startswith("OCR Error:"):
+            raise RuntimeError(text)
+    return timings
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def _summarize(values):
+    ordered = sorted(values)
+    return {
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': _percentile(ordered, 0.50) * 1000,
+        'p90_ms': _percentile(ordered, 0.90) * 1000,
+        'p99_ms': _percentile(ordered, 0.99) * 1000,
+    }
+
+
+def generate_pages(name, pages, seed=0, cache_dir=PAGE_CACHE_DIR):
+    """
+    Renders the pages of a resolution that are not cached yet and saves them
+    as JPEGs in cache_dir.
+    Returns:
+        Paths of the pages' JPEG files.
+    """
+    width, height = RESOLUTIONS[name]
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = []
+    for page_seed in range(seed, seed + pages):
+        path = os.path.join(cache_dir, f"v{PAGE_VERSION}_{width}x{height}_{page_seed}.jpg")
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_jpeg(make_note_page(width, height, page_seed)))
+            os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def run_resolution(name, page_paths, ocr_lang=None, engines=()):
+    """
+    Benchmarks one resolution on the JPEG files page_paths (see generate_pages).
+    Meant to run in a fresh process, so that the reported peak RSS belongs to
+    this resolution's processing only.
+    """
+    width, height = RESOLUTIONS[name]
+    encoded = []
+    for path in page_paths:
+        with open(path, 'rb') as f:
+            encoded.append(f.read())
+    _time_page(encoded[0], ocr_lang, engines) # Warm-up: imports, allocator, OCR model load
+
+    per_stage = {}
+    page_seconds = []
+    ocr_error = None
+    for data in encoded:
+        try:
+            timings = _time_page(data, ocr_lang, engines)
+        except RuntimeError as e:
+            ocr_error = str(e)
+            ocr_lang = None
+            timings = _time_page(data, engines=engines)
+        for stage, seconds in timings.items():
+            per_stage.setdefault(stage, []).append(seconds)
+        page_seconds.append(sum(timings[stage] for stage in PAGE_STAGES) + timings.get('ocr', 0.0))
+
+    result = {
+        'width': width,
+        'height': height,
+        'pages': len(encoded),
+        'stages': {stage: _summarize(values) for stage, values in per_stage.items()},
+        'pages_per_s': len(page_seconds) / sum(page_seconds),
+        'page_latency': _summarize(page_seconds),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # KiB on Linux
+    }
+    if ocr_error:
+        result['ocr_skipped'] = ocr_error
+    return result
+
+
+def _in_fresh_process(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+
+def run_benchmark(resolutions, pages, seed=0, ocr_lang=None, engines=(), cache_dir=PAGE_CACHE_DIR):
+    results = {}
+    for name in resolutions:
+        # Rendering the pages takes far more memory than processing them, so it gets
+        # its own process; a fresh process per resolution keeps peak RSS figures separate
+        page_paths = _in_fresh_process(generate_pages, name, pages, seed, cache_dir)
+        results[name] = _in_fresh_process(run_resolution, name, page_paths, ocr_lang, engines)
+        print_resolution(name, results[name])
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'pages': pages,
+            'seed': seed,
+            'ocr_lang': ocr_lang,
+            'engines': list(engines),
+        },
+        'results': results,
+    }
+
+
+def print_resolution(name, result):
+    print(f"\n{name} ({result['width']}x{result['height']}, {result['pages']} pages): "
+          f"{result['pages_per_s']:.2f} pages/s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    print(f"  {'stage':<20}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}  (ms)")
+    for stage, stats in list(result['stages'].items()) + [('page', result['page_latency'])]:
+        print(f"  {stage:<20}{stats['mean_ms']:>10.1f}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    if 'ocr_skipped' in result:
+        print(f"  OCR skipped: {result['ocr_skipped']}")
+
+
+def compare(current, baseline, threshold):
+    """
+    Compares two benchmark results (p50 per stage and pages/s).
+    Returns:
+        List of regression messages; empty if nothing got slower than threshold allows.
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for stage, stats in result['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if base_stats and stats['p50_ms'] > base_stats['p50_ms'] * (1 + threshold):
+                regressions.append(f"{name}/{stage}: p50 {base_stats['p50_ms']:.1f} -> {stats['p50_ms']:.1f} ms")
+        if result['pages_per_s'] < base['pages_per_s'] / (1 + threshold):
+            regressions.append(f"{name}: {base['pages_per_s']:.2f} -> {result['pages_per_s']:.2f} pages/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark background removal and OCR on synthetic note pages.")
+    parser.add_argument("--resolutions", default="small,medium,large",
+                        help=f"comma-separated subset of {', '.join(RESOLUTIONS)}")
+    parser.add_argument("--pages", type=int, default=5, help="pages per resolution")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--page-cache", default=PAGE_CACHE_DIR, help="folder the rendered pages are cached in")
+    parser.add_argument("--ocr", metavar="LANG", help="also time OCR (models must already be downloaded)")
+    parser.add_argument("--engines", default="",
+                        help=f"also time these binarization engines ({', '.join(bg_rem.get_available_engines())})")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against an earlier JSON result")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before failing (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    resolutions = [name.strip() for name in args.resolutions.split(',') if name.strip()]
+    unknown = [name for name in resolutions if name not in RESOLUTIONS]
+    if unknown:
+        parser.error(f"unknown resolution(s): {', '.join(unknown)}")
+    engines = [name.strip() for name in args.engines.split(',') if name.strip()]
+    unknown = [name for name in engines if name not in bg_rem.ENGINES]
+    if unknown:
+        parser.error(f"unknown engine(s): {', '.join(unknown)}")
+
+    current = run_benchmark(resolutions, args.pages, args.seed, args.ocr, engines, args.page_cache)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.compare}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,317 @@
+import io
+import os
+
 import cv2
 import numpy as np
 from PIL import Image
 
+import instrumentation
+import png_stream
+
+# Rough working memory per pixel of a band: source pixels, the RGB array,
+# the grayscale plane, the blurred local mean and the thresholded output
+TILE_BYTES_PER_PIXEL = 12
+DEFAULT_TILE_BYTES = 32 * 1024 * 1024 # 32 MiB
+
+# Cleaned pages are pure black and white, so by default they are stored at
+# 1 bit per pixel: 8x less data to deflate, and smaller files
+PNG_BIT_DEPTHS = (1, 8)
+DEFAULT_PNG_BIT_DEPTH = 1
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+# cv2.imdecode flags for decoding straight to gray, optionally downscaled in the decoder
+_GRAY_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
 def pil_to_cv(pil_image):
     """Converts a PIL image to an OpenCV image (BGR or Grayscale)."""
     if pil_image.mode == 'RGBA':
         # Convert RGBA to RGB then to BGR
         pil_image_rgb = pil_image.convert('RGB')
-        open_cv_image = cv2.cvtColor(np.array(pil_image_rgb), cv2.COLOR_RGB2BGR)
+        open_cv_image = cv2.cvtColor(np.asarray(pil_image_rgb), cv2.COLOR_RGB2BGR)
     elif pil_image.mode == 'P': # Palette mode
         # Convert to RGB then to BGR
         pil_image_rgb = pil_image.convert('RGB')
-        open_cv_image = cv2.cvtColor(np.array(pil_image_rgb), cv2.COLOR_RGB2BGR)
+        open_cv_image = cv2.cvtColor(np.asarray(pil_image_rgb), cv2.COLOR_RGB2BGR)
     elif pil_image.mode == 'L': # Grayscale PIL
         # OpenCV expects a 2D array for grayscale
         open_cv_image = np.array(pil_image)
     elif pil_image.mode == 'RGB':
-        open_cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+        # asarray wraps PIL's pixel buffer; cvtColor makes the only real copy
+        open_cv_image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
     else: # Default to converting to RGB then BGR
         pil_image_rgb = pil_image.convert('RGB')
-        open_cv_image = cv2.cvtColor(np.array(pil_image_rgb), cv2.COLOR_RGB2BGR)
+        open_cv_image = cv2.cvtColor(np.asarray(pil_image_rgb), cv2.COLOR_RGB2BGR)
     return open_cv_image
 
+def pil_to_gray(pil_image):
+    """
+    Converts a PIL image straight to a grayscale OpenCV image.
+    Gives the same pixels as pil_to_cv followed by the gray conversion in
+    remove_background, without the intermediate BGR copy. The result may be
+    read-only; remove_background only reads it.
+    """
+    if pil_image.mode == 'L':
+        return np.asarray(pil_image)
+    if pil_image.mode == '1': # Bilevel pages unpack straight to 0/255
+        return np.asarray(pil_image.convert('L'))
+    with instrumentation.stage('convert', width=pil_image.width, height=pil_image.height):
+        if pil_image.mode != 'RGB':
+            pil_image = pil_image.convert('RGB')
+        # One conversion instead of RGB->BGR->GRAY; the weights are identical
+        return cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2GRAY)
+
+def load_gray(source, reduce=1):
+    """
+    Decodes an image file directly into an 8-bit grayscale OpenCV image.
+    The decoder emits the luminance plane itself (for JPEGs libjpeg skips the
+    color conversion entirely), so no RGB/BGR frame is ever materialized.
+    Luminance can differ by a level or so from pil_to_cv + remove_background's
+    own gray conversion. EXIF orientation is ignored, as PIL does.
+    Args:
+        source: File path or the encoded file bytes.
+        reduce: Downscale factor applied while decoding (1, 2, 4 or 8).
+    Returns:
+        Grayscale OpenCV image (2D uint8 NumPy array).
+    """
+    if reduce not in _GRAY_DECODE_FLAGS:
+        raise ValueError(f"reduce must be one of {sorted(_GRAY_DECODE_FLAGS)}, got {reduce}")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = source
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+
+    with instrumentation.stage('decode', encoded_bytes=len(data)) as timing:
+        flags = _GRAY_DECODE_FLAGS[reduce] | cv2.IMREAD_IGNORE_ORIENTATION
+        gray_image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+        if gray_image is None:
+            # Formats OpenCV cannot read (e.g. some TIFF variants) go through PIL
+            with Image.open(io.BytesIO(data)) as pil_image:
+                if reduce > 1:
+                    pil_image = pil_image.reduce(reduce)
+                gray_image = pil_to_gray(pil_image)
+        timing.add(width=gray_image.shape[1], height=gray_image.shape[0])
+    return gray_image
+
 def cv_to_pil(cv_image):
     """Converts an OpenCV image to a PIL image."""
     if len(cv_image.shape) == 2: # Grayscale
+        if cv_image.dtype == np.uint8 and cv_image.flags['C_CONTIGUOUS']:
+            # Share the array's memory instead of copying it
+            height, width = cv_image.shape
+            return Image.frombuffer('L', (width, height), cv_image, 'raw', 'L', 0, 1)
         return Image.fromarray(cv_image)
     elif len(cv_image.shape) == 3 and cv_image.shape[2] == 3: # Color (BGR)
         return Image.fromarray(cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB))
     else:
         raise ValueError(f"Unsupported OpenCV image format for PIL conversion: shape {cv_image.shape}")
 
+def to_bilevel(cv_binary):
+    """
+    Packs a binary OpenCV image (as returned by remove_background) into a
+    1-bit PIL image, 8 pixels per byte. Non-zero pixels become white.
+    """
+    height, width = cv_binary.shape
+    packed = np.packbits(cv_binary != 0, axis=1)
+    return Image.frombytes('1', (width, height), packed.tobytes())
+
+def encode_png(cv_binary, bit_depth=DEFAULT_PNG_BIT_DEPTH, compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    """
+    Encodes a cleaned page as PNG bytes.
+    Args:
+        cv_binary: Binary OpenCV image (as returned by remove_background).
+        bit_depth: 1 writes a bilevel PNG (non-zero pixels become white), 8 a grayscale one.
+                   Both decode to the same 0/255 pixels.
+        compress_level: zlib level from 0 (none) to 9 (smallest, slowest).
+    """
+    if bit_depth not in PNG_BIT_DEPTHS:
+        raise ValueError(f"bit_depth must be one of {PNG_BIT_DEPTHS}, got {bit_depth}")
+    params = [cv2.IMWRITE_PNG_COMPRESSION, compress_level]
+    if bit_depth == 1:
+        params += [cv2.IMWRITE_PNG_BILEVEL, 1]
+    ok, encoded = cv2.imencode('.png', cv_binary, params)
+    if not ok:
+        raise ValueError("Could not encode the image as PNG.")
+    return encoded.tobytes()
+
 
-def remove_background(cv_image_input, block_size=21, c_value=10):
+class BinarizationEngine:
+    """
+    A named thresholding method for remove_background.
+    func(gray_image, block_size, c_value) returns the binary image.
+    halo(block_size) is how many rows around a pixel can influence its result,
+    so iter_background_bands knows how much overlap bands need; None means the
+    engine looks at the whole page and cannot be run band by band.
+    """
+
+    def __init__(self, name, func, halo, description):
+        self.name = name
+        self.func = func
+        self.halo = halo
+        self.description = description
+
+
+ENGINES = {} # name -> BinarizationEngine, in registration order
+DEFAULT_ENGINE = 'gaussian'
+
+def register_engine(name, halo, description):
+    """Decorator adding a thresholding function to ENGINES under name."""
+    def decorator(func):
+        ENGINES[name] = BinarizationEngine(name, func, halo, description)
+        return func
+    return decorator
+
+def get_available_engines():
+    """Returns the names of the registered binarization engines."""
+    return list(ENGINES)
+
+def _get_engine(name):
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown binarization engine '{name}'. Available: {', '.join(ENGINES)}")
+
+
+# Threshold time for a 12 MP synthetic page (benchmark.py pages, measured on
+# a shared build machine, so only the ratios mean much):
+#     engine      block 21   block 101
+#     gaussian      130 ms      377 ms
+#     mean           27 ms       27 ms
+#     sauvola       438 ms      458 ms   (niblack the same)
+#     flatten        28 ms       31 ms
+# Re-measure on your own hardware with
+#     python benchmark.py --engines gaussian,mean,sauvola,niblack,flatten
+
+@register_engine('gaussian', halo=lambda block_size: block_size // 2, description=
+    "Gaussian-weighted local mean minus C (the original method). Good on evenly lit "
+    "scans; cost grows with block_size, and strong shading needs large blocks.")
+def _threshold_gaussian(gray_image, block_size, c_value):
+    return cv2.adaptiveThreshold(
+        gray_image,
+        255,        # Max value to assign
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, # Text will be black, background white
+        block_size,
+        c_value
+    )
+
+@register_engine('mean', halo=lambda block_size: block_size // 2, description=
+    "Plain box mean minus C. Cost is independent of block_size, so large blocks stay "
+    "cheap; edges of thick strokes are a little noisier than with 'gaussian'.")
+def _threshold_mean(gray_image, block_size, c_value):
+    return cv2.adaptiveThreshold(gray_image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                 block_size, c_value)
+
+
+SAUVOLA_K = 0.2 # Sensitivity to local contrast
+SAUVOLA_R = 128.0 # Dynamic range of the standard deviation for 8-bit images
+NIBLACK_K = -0.2
+
+def _local_mean_std(gray_image, block_size):
+    """
+    Mean and standard deviation (float32) over a block_size window around every
+    pixel, from integral images of the values and their squares. Each window
+    costs four lookups whatever its size. Borders are replicated, like
+    adaptiveThreshold does.
+    """
+    half = block_size // 2
+    padded = cv2.copyMakeBorder(gray_image, half + 1, half, half + 1, half, cv2.BORDER_REPLICATE)
+    # Sums of uint8 values and their squares are exact in float64, so results
+    # do not depend on where the image was cut into bands
+    sums, square_sums = cv2.integral2(padded, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    height, width = gray_image.shape
+    inner, outer = slice(1, 1 + height), slice(block_size + 1, block_size + 1 + height)
+    left, right = slice(1, 1 + width), slice(block_size + 1, block_size + 1 + width)
+    scale = np.float32(1.0 / (block_size * block_size))
+
+    def window_mean(table):
+        total = cv2.subtract(table[outer, right], table[inner, right])
+        total = cv2.subtract(total, table[outer, left])
+        total = cv2.add(total, table[inner, left])
+        return total.astype(np.float32) * scale # float32 is plenty once the sums are taken
+
+    mean = window_mean(sums)
+    variance = window_mean(square_sums)
+    variance -= mean * mean
+    np.maximum(variance, 0, out=variance)
+    return mean, np.sqrt(variance, out=variance)
+
+def _above(gray_image, threshold):
+    """255 where the pixel is brighter than the float32 threshold image, else 0."""
+    return cv2.compare(gray_image.astype(np.float32), threshold, cv2.CMP_GT)
+
+@register_engine('sauvola', halo=lambda block_size: block_size // 2, description=
+    "Sauvola: T = mean * (1 + k * (std / R - 1)) - C over integral images. Cost is "
+    "independent of block_size; keeps faint pencil on flat paper and suppresses "
+    "texture in low-contrast areas. Slower than 'gaussian' at small blocks, and "
+    "needs several float planes of memory.")
+def _threshold_sauvola(gray_image, block_size, c_value):
+    threshold = sauvola_threshold(gray_image, block_size)
+    threshold -= np.float32(c_value)
+    return _above(gray_image, threshold)
+
+def sauvola_threshold(gray_image, block_size):
+    """The 'sauvola' threshold image (float32) before C is subtracted."""
+    mean, std = _local_mean_std(gray_image, block_size)
+    threshold = std # Computed in place: mean * (1 - k + k / R * std)
+    threshold *= np.float32(SAUVOLA_K / SAUVOLA_R)
+    threshold += np.float32(1.0 - SAUVOLA_K)
+    threshold *= mean
+    return threshold
+
+@register_engine('niblack', halo=lambda block_size: block_size // 2, description=
+    "Niblack: T = mean + k * std - C over integral images. As fast as 'sauvola' and "
+    "keeps more faint strokes, but turns paper texture in empty areas into speckles.")
+def _threshold_niblack(gray_image, block_size, c_value):
+    threshold = niblack_threshold(gray_image, block_size)
+    threshold -= np.float32(c_value)
+    return _above(gray_image, threshold)
+
+def niblack_threshold(gray_image, block_size):
+    """The 'niblack' threshold image (float32) before C is subtracted."""
+    mean, std = _local_mean_std(gray_image, block_size)
+    threshold = std
+    threshold *= np.float32(NIBLACK_K)
+    threshold += mean
+    return threshold
+
+
+FLATTEN_SIZE = 512 # Longest side of the background estimate
+
+@register_engine('flatten', halo=None, description=
+    "Estimates the paper brightness on a heavily downscaled copy (ink removed with a "
+    "morphological closing), subtracts it and applies one global threshold C. Usually the fastest "
+    "and best on phone photos with strong shading or shadows; loses strokes wider than "
+    "about block_size and needs the whole page at once.")
+def _threshold_flatten(gray_image, block_size, c_value):
+    height, width = gray_image.shape
+    scale = max(1, max(height, width) // FLATTEN_SIZE)
+    small = cv2.resize(gray_image, (max(1, width // scale), max(1, height // scale)), interpolation=cv2.INTER_AREA)
+    # A closing (max then min filter) wider than the strokes replaces ink with
+    # the surrounding paper without lifting the paper level itself
+    reach = max(3, (2 * block_size) // scale + 1)
+    background = cv2.morphologyEx(small, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (reach, reach)))
+    background = cv2.blur(background, (reach, reach))
+    background = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+    # How much darker than the paper each pixel is; ink where that exceeds C
+    darkness = cv2.subtract(background, gray_image)
+    _, binary = cv2.threshold(darkness, c_value, 255, cv2.THRESH_BINARY_INV)
+    return binary
+
+
+def remove_background(cv_image_input, block_size=21, c_value=10, engine=DEFAULT_ENGINE):
     """
     Removes or simplifies the background of an image using adaptive thresholding.
     Args:
         cv_image_input: OpenCV image (NumPy array, BGR or Grayscale).
         block_size: Block size for adaptive thresholding (odd number).
         c_value: Constant C for adaptive thresholding.
+        engine: Name of the thresholding method, see ENGINES.
     Returns:
         Processed OpenCV image (binary, grayscale).
     """
@@ -49,13 +322,75 @@ def remove_background(cv_image_input, block_size=21, c_value=10):
     else:
         raise ValueError("Input image must be BGR color or grayscale for background removal.")
 
-    # Adaptive Thresholding
-    processed_cv_image = cv2.adaptiveThreshold(
-        gray_image,
-        255,        # Max value to assign
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY, # Text will be black, background white
-        block_size,
-        c_value
-    )
-    return processed_cv_image
\ No newline at end of file
+    threshold_func = _get_engine(engine).func
+    with instrumentation.stage('threshold', engine=engine, width=gray_image.shape[1], height=gray_image.shape[0]):
+        processed_cv_image = threshold_func(gray_image, block_size, c_value)
+    return processed_cv_image
+
+
+def iter_background_bands(pil_image, block_size=21, c_value=10, max_tile_bytes=DEFAULT_TILE_BYTES,
+                          engine=DEFAULT_ENGINE):
+    """
+    Runs remove_background over horizontal bands of pil_image and yields the
+    processed bands top to bottom.
+    Each band is read with the engine's halo of extra rows above and below
+    (block_size // 2, the reach of the window), so the stacked bands are identical
+    to processing the whole image at once. Besides the decoded source image,
+    working memory stays within roughly max_tile_bytes however large the page is.
+    Engines without a halo (e.g. 'flatten') see the whole page at once, and only
+    its output is handed out in bands.
+    """
+    width, height = pil_image.size
+    halo = _get_engine(engine).halo
+    if halo is None:
+        processed = remove_background(pil_to_gray(pil_image), block_size=block_size, c_value=c_value, engine=engine)
+        band_rows = max(1, max_tile_bytes // max(1, width * TILE_BYTES_PER_PIXEL))
+        for y0 in range(0, height, band_rows):
+            yield processed[y0:y0 + band_rows]
+        return
+
+    halo = halo(block_size)
+    rows_in_budget = max_tile_bytes // max(1, width * TILE_BYTES_PER_PIXEL)
+    band_rows = max(block_size, rows_in_budget - 2 * halo)
+
+    for y0 in range(0, height, band_rows):
+        y1 = min(height, y0 + band_rows)
+        top = max(0, y0 - halo)
+        bottom = min(height, y1 + halo)
+        gray_band = pil_to_gray(pil_image.crop((0, top, width, bottom)))
+        processed = remove_background(gray_band, block_size=block_size, c_value=c_value, engine=engine)
+        yield processed[y0 - top:y1 - top]
+
+
+def remove_background_banded(pil_image, block_size=21, c_value=10, max_tile_bytes=DEFAULT_TILE_BYTES,
+                             engine=DEFAULT_ENGINE):
+    """
+    Like remove_background on pil_image, but computed band by band (see
+    iter_background_bands) so the working memory stays within max_tile_bytes.
+    Only the binary output, one byte per pixel, is held whole.
+    """
+    width, height = pil_image.size
+    processed = np.empty((height, width), dtype=np.uint8)
+    y0 = 0
+    for band in iter_background_bands(pil_image, block_size, c_value, max_tile_bytes, engine):
+        processed[y0:y0 + band.shape[0]] = band
+        y0 += band.shape[0]
+    return processed
+
+
+def remove_background_to_file(pil_image, output_path, block_size=21, c_value=10,
+                              max_tile_bytes=DEFAULT_TILE_BYTES, compress_level=DEFAULT_PNG_COMPRESS_LEVEL,
+                              engine=DEFAULT_ENGINE, bit_depth=DEFAULT_PNG_BIT_DEPTH):
+    """
+    Memory-bounded variant of remove_background for very large scans.
+    The image is processed band by band (see iter_background_bands) and each
+    band is streamed straight into a PNG of bit_depth 1 or 8 at output_path
+    (or into a binary file object).
+    """
+    width, height = pil_image.size
+    with instrumentation.stage('clean_tiled', width=width, height=height) as timing:
+        with png_stream.PngStripWriter(output_path, width, height, compress_level=compress_level,
+                                       bit_depth=bit_depth) as writer:
+            for band in iter_background_bands(pil_image, block_size, c_value, max_tile_bytes, engine):
+                writer.write_rows(band)
+        timing.add(bytes_written=os.path.getsize(output_path) if isinstance(output_path, str) else output_path.tell())
@@ -0,0 +1,208 @@
+# dedup.py
+"""
+Near-duplicate detection for retakes and burst shots of the same page.
+
+Finding candidates: every image is cleaned at thumbnail size and gets a
+difference hash (dHash) of its blurred ink: one bit per pair of horizontally
+neighbouring cells of a 17x16 downscale, set if the left one holds more ink.
+Hashing the ink rather than the photo keeps lighting out of it. The hashes go
+into a BK-tree, which finds every hash within a Hamming distance without
+comparing all pairs.
+
+Confirming them: pages with the same layout (a few lines of text at the top,
+say) hash alike whatever the text, so a candidate only counts as a duplicate
+once the content agrees. ORB features of the two cleaned pages must agree on
+one rotation/scale/shift, and with that applied the ink of each page must lie
+on the ink of the other. Pages that can't be confirmed are never merged.
+
+Each cluster of near-duplicates is then processed once, from its sharpest
+photo, and the other photos get links to its outputs (see
+batch_processor.run_folder's dedup option).
+
+Measured on synthetic pages (1240x1754), some with only 3 or 8 lines of text
+and all under the same lighting: retakes shifted by up to 1%, rotated by up
+to 1.5 degrees, zoomed by 3-4% or 10% brighter or darker differ in up to
+about 50 bits of the ink hash, but different pages can be as close as 12
+bits, so the hash alone decides nothing. Retakes had 23 or more matching
+features and an ink overlap of 0.94 or more. Different pages had at most 13
+matching features and an overlap of at most 0.68.
+"""
+import cv2
+import numpy as np
+from PIL import Image
+
+import bg_rem
+import instrumentation
+
+HASH_SIZE = 16 # HASH_SIZE**2 bits per hash
+DEFAULT_MAX_DISTANCE = 64 # Ink hash bits candidates may differ in; only a pre-filter for same_page
+MAX_CANDIDATES = 8 # Closest candidates checked on content per image
+THUMBNAIL_SIZE = 1024 # Long side of the thumbnail everything is computed on
+ORB_FEATURES = 1000
+MIN_MATCHED_FEATURES = 20 # Features that must agree on the transform between two photos of a page
+MIN_INK_OVERLAP = 0.9 # Share of each page's ink that must lie on the other's once aligned
+
+
+def load_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """Returns a grayscale thumbnail (long side at most size) of an image file."""
+    with Image.open(image_path) as pil_img:
+        if pil_img.format == 'JPEG':
+            pil_img.draft('L', (size, size)) # Let the JPEG decoder downscale by up to 8x
+        gray = pil_img.convert('L')
+        gray.thumbnail((size, size))
+        return np.array(gray)
+
+
+def dhash(gray_image, hash_size=HASH_SIZE):
+    """Returns the difference hash of a single-channel image as an int of hash_size**2 bits."""
+    small = cv2.resize(gray_image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, :-1] > small[:, 1:]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def sharpness(gray_image):
+    """Variance of the Laplacian: higher for sharper (less blurred, better focused) photos."""
+    return float(cv2.Laplacian(gray_image, cv2.CV_32F).var())
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over hashes with the Hamming distance. Children are
+    keyed by their distance to the parent, so by the triangle inequality a
+    search only visits subtrees that can hold a match.
+    """
+
+    def __init__(self):
+        self._root = None # [hash, value, {distance: child}]
+
+    def add(self, hash_value, value):
+        if self._root is None:
+            self._root = [hash_value, value, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, value, {}]
+                return
+            node = child
+
+    def find(self, hash_value, max_distance):
+        """Returns (distance, value) of every entry within max_distance, closest first."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(hash_value, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class PageContent:
+    """The cleaned thumbnail of one photo, with what find_duplicates compares."""
+
+    def __init__(self, image_path, size=THUMBNAIL_SIZE):
+        gray = load_thumbnail(image_path, size)
+        binary = bg_rem.remove_background(gray)
+        ink = (binary == 0).astype(np.float32)
+        self.hash = dhash(cv2.GaussianBlur(ink, (0, 0), max(1.0, size / 256)))
+        self.sharpness = sharpness(gray)
+        self.shape = binary.shape
+        self._packed = np.packbits(binary == 0, axis=1) # Kept for same_page at 1 bit per pixel
+        self._features = None
+
+    def ink(self):
+        """Boolean ink mask of the cleaned thumbnail."""
+        return np.unpackbits(self._packed, axis=1, count=self.shape[1]).astype(bool)
+
+    def features(self):
+        """ORB keypoint positions and descriptors of the cleaned thumbnail (computed on first use)."""
+        if self._features is None:
+            binary = np.where(self.ink(), 0, 255).astype(np.uint8)
+            keypoints, descriptors = cv2.ORB_create(nfeatures=ORB_FEATURES).detectAndCompute(binary, None)
+            self._features = (np.float32([keypoint.pt for keypoint in keypoints]).reshape(-1, 2), descriptors)
+        return self._features
+
+
+def _ink_overlap(ink, other_ink):
+    """Share of ink's pixels within one pixel of other_ink."""
+    near = cv2.dilate(other_ink.astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+    return np.count_nonzero(ink & near) / max(1, np.count_nonzero(ink))
+
+
+def same_page(page, other):
+    """True if two PageContents are confirmed to show the same page."""
+    points, descriptors = page.features()
+    other_points, other_descriptors = other.features()
+    if descriptors is None or other_descriptors is None or min(len(descriptors), len(other_descriptors)) < 2:
+        return False
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(descriptors, other_descriptors, k=2)
+    matches = [pair[0] for pair in pairs if len(pair) == 2 and pair[0].distance < 0.8 * pair[1].distance]
+    if len(matches) < MIN_MATCHED_FEATURES:
+        return False
+    # Rotation, scale and shift taking other onto page; a retake is not warped much beyond that
+    transform, inliers = cv2.estimateAffinePartial2D(
+        other_points[[match.trainIdx for match in matches]], points[[match.queryIdx for match in matches]],
+        method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if transform is None or np.count_nonzero(inliers) < MIN_MATCHED_FEATURES:
+        return False
+    ink = page.ink()
+    other_ink = cv2.warpAffine(other.ink().astype(np.uint8), transform, (ink.shape[1], ink.shape[0]),
+                               flags=cv2.INTER_NEAREST) > 0
+    return min(_ink_overlap(ink, other_ink), _ink_overlap(other_ink, ink)) >= MIN_INK_OVERLAP
+
+
+def find_duplicates(image_paths, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Groups near-duplicate images.
+    Each image joins the cluster of the closest of its (at most MAX_CANDIDATES)
+    earlier images within max_distance hash bits that same_page confirms; the
+    sharpest image of a cluster represents it.
+    Images that can't be read are left alone (they fail later with a proper error).
+    Returns:
+        Dict mapping every duplicate path to the path of its representative;
+        images without duplicates (and representatives) are not in it.
+    """
+    tree = BKTree()
+    pages = {}
+    cluster_of = {}
+    clusters = [] # lists of (sharpness, path)
+    with instrumentation.stage('dedup', pages=len(image_paths)) as timing:
+        compared = 0
+        for path in image_paths:
+            try:
+                page = PageContent(path)
+            except Exception:
+                continue
+            cluster_index = None
+            for _, candidate in tree.find(page.hash, max_distance)[:MAX_CANDIDATES]:
+                compared += 1
+                if same_page(page, pages[candidate]):
+                    cluster_index = cluster_of[candidate]
+                    break
+            if cluster_index is None:
+                cluster_index = len(clusters)
+                clusters.append([])
+            clusters[cluster_index].append((page.sharpness, path))
+            cluster_of[path] = cluster_index
+            pages[path] = page
+            tree.add(page.hash, path)
+
+        duplicates = {}
+        for cluster in clusters:
+            representative = max(cluster, key=lambda item: item[0])[1]
+            for _, path in cluster:
+                if path != representative:
+                    duplicates[path] = representative
+        timing.add(duplicates=len(duplicates), compared=compared)
+    return duplicates
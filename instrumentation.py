@@ -0,0 +1,253 @@
+# instrumentation.py
+"""
+Lightweight per-stage timing and statistics.
+
+Code marks its stages with
+
+    with instrumentation.stage('threshold', width=w, height=h) as s:
+        ...
+        s.add(bytes_written=n)
+
+Every finished stage becomes a record (name, wall and CPU time, plus the given
+fields) that is handed to the active sinks: a JSON-lines log, a Prometheus
+text file, or an in-memory summary printed at the end of a batch. While no
+sink is active, stage() returns a shared no-op object, so instrumented code
+costs one function call and one truth test per stage.
+
+CPU time is the calling thread's (time.thread_time), so concurrent pipeline
+threads don't count each other's work; threads OpenCV starts internally are
+not included.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = 'notes_digitizer'
+
+_sinks = []
+_lock = threading.Lock()
+
+
+class _NullStage:
+    """Returned by stage() while instrumentation is off."""
+
+    def add(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'fields', '_wall', '_cpu')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def add(self, **fields):
+        """Attaches more fields (e.g. sizes only known after the work) to the record."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            'stage': self.name,
+            'wall_s': time.perf_counter() - self._wall,
+            'cpu_s': time.thread_time() - self._cpu,
+        }
+        record.update(self.fields)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _emit(record)
+        return False
+
+
+def enabled():
+    """True while at least one sink is active."""
+    return bool(_sinks)
+
+
+def stage(name, **fields):
+    """Returns a context manager timing one stage; fields are stored with the record."""
+    if not _sinks:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+def event(name, **fields):
+    """Records something that happened without timing it (e.g. a cache hit)."""
+    if _sinks:
+        record = {'stage': name}
+        record.update(fields)
+        _emit(record)
+
+
+def replay(records):
+    """Emits records collected elsewhere, e.g. in a worker process (see ListSink)."""
+    if _sinks:
+        for record in records:
+            _emit(record)
+
+
+def _emit(record):
+    record.setdefault('ts', time.time())
+    record.setdefault('pid', os.getpid())
+    with _lock:
+        for sink in _sinks:
+            sink.emit(record)
+
+
+def reset():
+    """
+    Drops all sinks without closing them. Used as the initializer of worker
+    processes, which would otherwise inherit the parent's sinks when forked.
+    """
+    _sinks.clear()
+
+
+@contextmanager
+def recording(*sinks):
+    """
+    Activates sinks for the duration of the with-block, then closes them.
+    Blocks can be nested; records go to every active sink.
+    """
+    with _lock:
+        _sinks.extend(sinks)
+    try:
+        yield sinks[0] if len(sinks) == 1 else sinks
+    finally:
+        with _lock:
+            for sink in sinks:
+                _sinks.remove(sink)
+        for sink in sinks:
+            sink.close()
+
+
+class ListSink:
+    """Keeps the raw records, e.g. to send them back from a worker process."""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """Appends every record as one JSON line to a file."""
+
+    def __init__(self, path):
+        # Line buffered: every record is on disk right away, and a forked
+        # worker never inherits half a buffer it could write out twice
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def emit(self, record):
+        self._file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+class StageTotals:
+    """
+    Aggregates records per stage: number of calls, wall and CPU time, and the
+    sum of every other numeric field (bytes read/written, cache hits, ...).
+    width/height fields are summed as pixels instead.
+    """
+
+    def __init__(self):
+        self.totals = {} # stage -> {field: sum}
+
+    def emit(self, record):
+        totals = self.totals.setdefault(record['stage'], {'calls': 0})
+        totals['calls'] += 1
+        for field, value in record.items():
+            if field in ('ts', 'pid', 'width', 'height') or not isinstance(value, (int, float)):
+                continue
+            totals[field] = totals.get(field, 0) + value
+        if isinstance(record.get('width'), int) and isinstance(record.get('height'), int):
+            totals['pixels'] = totals.get('pixels', 0) + record['width'] * record['height']
+
+    def close(self):
+        pass
+
+    def format_table(self):
+        """Returns the totals as a plain-text table, slowest stage first."""
+        rows = sorted(self.totals.items(), key=lambda item: -item[1].get('wall_s', 0.0))
+        lines = [f"{'stage':<16}{'calls':>8}{'wall s':>10}{'cpu s':>10}{'ms/call':>10}{'MPix':>10}{'MB in':>10}{'MB out':>10}"]
+        for name, totals in rows:
+            wall = totals.get('wall_s')
+            lines.append(
+                f"{name:<16}{totals['calls']:>8}"
+                f"{_fmt(wall, 1):>10}{_fmt(totals.get('cpu_s'), 1):>10}"
+                f"{_fmt(wall and 1000 * wall / totals['calls'], 1):>10}"
+                f"{_fmt(totals.get('pixels'), 1e6):>10}"
+                f"{_fmt(totals.get('bytes_read'), 1024 * 1024):>10}"
+                f"{_fmt(totals.get('bytes_written'), 1024 * 1024):>10}"
+            )
+            extra = {k: v for k, v in totals.items()
+                     if k not in ('calls', 'wall_s', 'cpu_s', 'pixels', 'bytes_read', 'bytes_written')}
+            if extra:
+                lines.append('    ' + ', '.join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}"
+                                               for k, v in sorted(extra.items())))
+        return '\n'.join(lines)
+
+
+def _fmt(value, divisor):
+    if value is None:
+        return '-'
+    return f"{value / divisor:.2f}"
+
+
+class PrometheusSink(StageTotals):
+    """
+    Writes the running totals in the Prometheus text format to path, for a
+    local scrape (e.g. node_exporter's textfile collector). The file is
+    rewritten atomically at most every interval seconds and on close.
+    """
+
+    def __init__(self, path, interval=10.0):
+        super().__init__()
+        self.path = path
+        self.interval = interval
+        self._last_write = 0.0
+
+    def emit(self, record):
+        super().emit(record)
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def close(self):
+        self.write()
+
+    def write(self):
+        self._last_write = time.monotonic()
+        metrics = {} # metric name -> [(stage, value)]
+        for name, totals in self.totals.items():
+            for field, value in totals.items():
+                metric = field[:-2] + '_seconds' if field.endswith('_s') else field # wall_s -> wall_seconds
+                metrics.setdefault(f"{PROMETHEUS_PREFIX}_stage_{metric}_total", []).append((name, value))
+        lines = []
+        for metric, samples in sorted(metrics.items()):
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f'{metric}{{stage="{name}"}} {value}' for name, value in samples)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
@@ -7,6 +7,16 @@ import threading # For non-blocking operations
 # Import custom modules
 import bg_rem
 import ocr_processor
+import autotune
+import batch_manifest
+import batch_processor
+import instrumentation
+import ocr_daemon
+import result_cache
+import search_index
+import preview
+
+RESIZE_DEBOUNCE_MS = 150 # Wait for the pane size to settle before re-rendering previews
 
 class NoteAppGUI:
     def __init__(self, root_window):
@@ -19,6 +29,18 @@ class NoteAppGUI:
         self.current_image_path = None
         self.image_files_in_folder = []
         self.current_folder_path = None
+        self.current_folder_index = 0
+
+        # Downscaled previews are built and resized off the Tk thread
+        self.preview_cache = preview.PreviewCache()
+        self._preview_generation = 0 # Distinguishes successive in-memory images
+
+        # Background removal settings and the on-disk cache of earlier results
+        self.block_size = 21
+        self.c_value = 10
+        self.processed_params = None # Settings the current processed image was made with
+        self.result_cache = result_cache.ResultCache()
+        self._source_hashes = {} # image path -> content hash
 
         # --- UI Elements ---
         # Top Control Frame
@@ -31,12 +53,33 @@ class NoteAppGUI:
         self.btn_load_folder = ttk.Button(top_controls_frame, text="Load Folder", command=self.load_folder)
         self.btn_load_folder.pack(side=tk.LEFT, padx=5)
 
+        self.btn_prev_image = ttk.Button(top_controls_frame, text="< Prev", width=7, command=lambda: self.show_folder_image(self.current_folder_index - 1), state=tk.DISABLED)
+        self.btn_prev_image.pack(side=tk.LEFT)
+
+        self.btn_next_image = ttk.Button(top_controls_frame, text="Next >", width=7, command=lambda: self.show_folder_image(self.current_folder_index + 1), state=tk.DISABLED)
+        self.btn_next_image.pack(side=tk.LEFT, padx=(0, 5))
+
         self.btn_process_current = ttk.Button(top_controls_frame, text="Process Current", command=self.process_current_image_action, state=tk.DISABLED)
         self.btn_process_current.pack(side=tk.LEFT, padx=5)
 
         self.btn_save_processed = ttk.Button(top_controls_frame, text="Save Processed", command=self.save_processed_image_action, state=tk.DISABLED)
         self.btn_save_processed.pack(side=tk.LEFT, padx=5)
 
+        # Binarization engine used by "Process Current" and batch runs
+        engine_frame = ttk.LabelFrame(top_controls_frame, text="Engine", padding="5")
+        engine_frame.pack(side=tk.LEFT, padx=10)
+
+        self.engine_var = tk.StringVar(value=bg_rem.DEFAULT_ENGINE)
+        self.combo_engine = ttk.Combobox(engine_frame, textvariable=self.engine_var, values=bg_rem.get_available_engines(), width=9, state="readonly")
+        self.combo_engine.pack(side=tk.LEFT, padx=2)
+        self.combo_engine.bind('<<ComboboxSelected>>', lambda event: self._load_tuned_params())
+
+        self.params_var = tk.StringVar()
+        ttk.Label(engine_frame, textvariable=self.params_var).pack(side=tk.LEFT, padx=2)
+        self.btn_autotune = ttk.Button(engine_frame, text="Auto-tune", command=self.autotune_action, state=tk.DISABLED)
+        self.btn_autotune.pack(side=tk.LEFT, padx=2)
+        self._set_clean_params(self.block_size, self.c_value)
+
         # OCR Controls
         ocr_frame = ttk.LabelFrame(top_controls_frame, text="OCR", padding="5")
         ocr_frame.pack(side=tk.LEFT, padx=10)
@@ -47,14 +90,33 @@ class NoteAppGUI:
         self.ocr_lang_var = tk.StringVar(value=default_lang) 
         self.combo_ocr_lang = ttk.Combobox(ocr_frame, textvariable=self.ocr_lang_var, values=self.ocr_languages, width=5, state="readonly")
         self.combo_ocr_lang.pack(side=tk.LEFT, padx=2)
+        self.combo_ocr_lang.bind('<<ComboboxSelected>>', lambda event: self._start_ocr_warm_up())
         if not self.ocr_languages: self.combo_ocr_lang.config(state=tk.DISABLED)
 
+        # Loading the OCR model pulls in torch, so it is only preloaded (in the background,
+        # while files are being picked) if asked for here or once batch OCR is switched on
+        self.warm_up_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(ocr_frame, text="Preload", variable=self.warm_up_var,
+                        command=self._start_ocr_warm_up).pack(side=tk.LEFT, padx=2)
+        self.ocr_ready_var = tk.StringVar(value="Model: not loaded")
+        ttk.Label(ocr_frame, textvariable=self.ocr_ready_var, width=18).pack(side=tk.LEFT, padx=2)
+        self._warming_up = set() # Languages with a warm-up thread running
+
 
         self.btn_extract_text = ttk.Button(ocr_frame, text="Extract Text", command=self.extract_text_action, state=tk.DISABLED)
         self.btn_extract_text.pack(side=tk.LEFT, padx=5)
+
+        self.batch_ocr_var = tk.BooleanVar(value=False)
+        self.chk_batch_ocr = ttk.Checkbutton(ocr_frame, text="OCR in batch", variable=self.batch_ocr_var,
+                                             command=self._start_ocr_warm_up)
+        self.chk_batch_ocr.pack(side=tk.LEFT, padx=2)
         
         self.btn_process_folder = ttk.Button(top_controls_frame, text="Batch Process Folder", command=self.batch_process_folder_action, state=tk.DISABLED)
-        self.btn_process_folder.pack(side=tk.LEFT, padx=15)
+        self.btn_process_folder.pack(side=tk.LEFT, padx=(15, 2))
+
+        # Retakes / burst shots of the same page are processed once (see dedup.py)
+        self.dedup_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top_controls_frame, text="Skip duplicates", variable=self.dedup_var).pack(side=tk.LEFT, padx=2)
 
 
         # Main content area (Images and OCR Text)
@@ -75,6 +137,12 @@ class NoteAppGUI:
         self.lbl_processed_image = ttk.Label(image_display_frame, text="Processed Image", compound="top", relief="groove", anchor="center")
         self.lbl_processed_image.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+        for label in (self.lbl_original_image, self.lbl_processed_image):
+            label.preview_source = None # (cache key, path or PIL image, label text)
+            label.rendered_size = None
+            label.rerender_job = None
+            label.bind('<Configure>', lambda event, l=label: self._schedule_rerender(l))
+
         # OCR Text Area (Right Pane)
         ocr_text_frame = ttk.LabelFrame(paned_window, text="Extracted Text (OCR)", padding="5", width=400) # Initial width
         paned_window.add(ocr_text_frame, weight=1) # Less weight to text area
@@ -93,31 +161,119 @@ class NoteAppGUI:
         self.progress_bar = ttk.Progressbar(bottom_frame, orient=tk.HORIZONTAL, mode='determinate', length=200)
         self.progress_bar.pack(side=tk.RIGHT, padx=5)
 
+    def _start_ocr_warm_up(self):
+        """Loads the reader for the selected language in a background thread, if preloading or batch OCR is on."""
+        lang = self.ocr_lang_var.get()
+        if not lang or not (self.warm_up_var.get() or self.batch_ocr_var.get()) or lang in self._warming_up:
+            return
+        if ocr_processor.is_ready(lang):
+            self._show_ocr_ready(lang)
+            return
+        self._warming_up.add(lang)
+        self.ocr_ready_var.set(f"Model: loading {lang}...")
+        threading.Thread(target=self._run_ocr_warm_up, args=(lang,), daemon=True).start()
+
+    def _run_ocr_warm_up(self, lang):
+        try:
+            daemon = ocr_daemon.find_daemon()
+            if daemon is not None:
+                for _ in daemon.results(daemon.warmup(lang)):
+                    pass
+            else:
+                ocr_processor.warm_up(lang)
+            state = f"Model: ready ({lang}{', daemon' if daemon else ''})"
+        except Exception as e:
+            print(f"OCR warm-up failed: {e}")
+            state = "Model: failed to load"
+        self.root.after(0, self._finish_ocr_warm_up, lang, state)
+
+    def _finish_ocr_warm_up(self, lang, state):
+        self._warming_up.discard(lang)
+        if lang == self.ocr_lang_var.get():
+            self.ocr_ready_var.set(state)
+
+    def _show_ocr_ready(self, lang):
+        if lang == self.ocr_lang_var.get() and ocr_processor.is_ready(lang):
+            self.ocr_ready_var.set(f"Model: ready ({lang})")
+
     def _update_status(self, message):
         self.status_var.set(message)
         self.root.update_idletasks()
 
-    def _display_pil_image(self, pil_image, label_widget, label_text="Image"):
+    def _display_pil_image(self, pil_image, label_widget, label_text="Image", source_path=None):
+        """
+        Shows an image in a pane. The downscaled preview is rendered on a worker
+        thread; if source_path is given it is decoded from there at reduced size.
+        """
         if label_widget is None: return
 
-        if pil_image:
-            container_w = label_widget.winfo_width() if label_widget.winfo_width() > 1 else 400 # Estimate if not drawn
-            container_h = label_widget.winfo_height() if label_widget.winfo_height() > 1 else 500
+        old_source = label_widget.preview_source
+        if old_source and not isinstance(old_source[0], str):
+            self.preview_cache.discard(old_source[0]) # In-memory images are never shown again
 
-            img_copy = pil_image.copy()
-            img_copy.thumbnail((container_w - 10, container_h - 30), Image.LANCZOS) # -padding/border
-            
-            photo = ImageTk.PhotoImage(img_copy)
-            label_widget.config(image=photo, text=label_text)
-            label_widget.image = photo # Keep a reference!
+        if pil_image:
+            if source_path:
+                key, source = source_path, source_path
+            else:
+                self._preview_generation += 1
+                key, source = ('memory', self._preview_generation), pil_image
+            label_widget.preview_source = (key, source, label_text)
+            label_widget.rendered_size = None
+            label_widget.config(text=label_text)
+            self._render_preview(label_widget)
         else:
+            label_widget.preview_source = None
             label_widget.config(image='', text=label_text) # Clear image
             label_widget.image = None
 
+    def _render_preview(self, label_widget):
+        label_widget.rerender_job = None
+        if not label_widget.preview_source:
+            return
+        key, source, label_text = label_widget.preview_source
+
+        container_w = label_widget.winfo_width() if label_widget.winfo_width() > 1 else 400 # Estimate if not drawn
+        container_h = label_widget.winfo_height() if label_widget.winfo_height() > 1 else 500
+        size = (max(1, container_w - 10), max(1, container_h - 30)) # -padding/border
+        if size == label_widget.rendered_size:
+            return
+        label_widget.rendered_size = size
+
+        def deliver(preview_image):
+            self.root.after(0, self._apply_preview, label_widget, key, label_text, preview_image)
+        self.preview_cache.request(key, source, size, deliver)
+
+    def _apply_preview(self, label_widget, key, label_text, preview_image):
+        source = label_widget.preview_source
+        if not source or source[0] != key:
+            return # Another image was shown while this preview was rendering
+        photo = ImageTk.PhotoImage(preview_image)
+        label_widget.config(image=photo, text=label_text)
+        label_widget.image = photo # Keep a reference!
+
+    def _schedule_rerender(self, label_widget):
+        if label_widget.rerender_job:
+            self.root.after_cancel(label_widget.rerender_job)
+        label_widget.rerender_job = self.root.after(RESIZE_DEBOUNCE_MS, self._render_preview, label_widget)
+
+    def _source_hash(self):
+        """Content hash of the current image file (None if it did not come from disk)."""
+        path = self.current_image_path
+        if not path:
+            return None
+        if path not in self._source_hashes:
+            try:
+                self._source_hashes[path] = result_cache.hash_file(path)
+            except OSError:
+                return None
+        return self._source_hashes[path]
+
     def _clear_displays(self):
         self.original_image_pil = None
         self.processed_image_pil = None
+        self.processed_params = None
         self.current_image_path = None
+        self._source_hashes.clear() # Files may have changed on disk since they were hashed
         
         self._display_pil_image(None, self.lbl_original_image, "Original Image")
         self._display_pil_image(None, self.lbl_processed_image, "Processed Image")
@@ -143,17 +299,21 @@ class NoteAppGUI:
         self.image_files_in_folder = [] # Clear folder list
         self.current_folder_path = None
         self.btn_process_folder.config(state=tk.DISABLED)
+        self.btn_prev_image.config(state=tk.DISABLED)
+        self.btn_next_image.config(state=tk.DISABLED)
 
         try:
             self._update_status(f"Loading {os.path.basename(file_path)}...")
             self.original_image_pil = Image.open(file_path)
             self.current_image_path = file_path
+            self.preview_cache.discard(file_path) # The file may have changed since it was last shown
             
             # Wait for labels to have actual size before displaying
             self.root.update_idletasks() 
-            self._display_pil_image(self.original_image_pil, self.lbl_original_image, f"Original: {os.path.basename(file_path)}")
+            self._display_pil_image(self.original_image_pil, self.lbl_original_image, f"Original: {os.path.basename(file_path)}", source_path=file_path)
             
             self.btn_process_current.config(state=tk.NORMAL)
+            self.btn_autotune.config(state=tk.NORMAL)
             self.btn_extract_text.config(state=tk.NORMAL) # Can OCR original
             self._update_status(f"Loaded: {os.path.basename(file_path)}. Ready to process or OCR.")
         except Exception as e:
@@ -168,33 +328,95 @@ class NoteAppGUI:
 
         self._clear_displays()
         self.current_folder_path = folder_path
-        self.image_files_in_folder = []
-        valid_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
-        
-        for fname in os.listdir(folder_path):
-            if fname.lower().endswith(valid_extensions):
-                self.image_files_in_folder.append(os.path.join(folder_path, fname))
+        self.image_files_in_folder = batch_processor.list_image_files(folder_path)
         
         if not self.image_files_in_folder:
             messagebox.showinfo("No Images", "No supported image files found in the selected folder.")
             self._update_status("No images found in folder.")
             self.btn_process_folder.config(state=tk.DISABLED)
+            self.btn_prev_image.config(state=tk.DISABLED)
+            self.btn_next_image.config(state=tk.DISABLED)
             return
 
         # Load and display the first image from the folder as a preview
-        self.current_image_path = self.image_files_in_folder[0]
+        self.show_folder_image(0)
+        self._load_tuned_params()
+
+        self.btn_process_folder.config(state=tk.NORMAL)
+        self.btn_autotune.config(state=tk.NORMAL)
+        self._update_status(f"{len(self.image_files_in_folder)} images loaded from folder. Ready for batch processing.")
+
+    def _set_clean_params(self, block_size, c_value, tuned=False):
+        self.block_size = block_size
+        self.c_value = c_value
+        self.params_var.set(f"block {block_size}, C {c_value}{' (tuned)' if tuned else ''}")
+
+    def _load_tuned_params(self):
+        """Uses the parameters saved for the loaded folder and engine, or the defaults."""
+        tuned = autotune.load_tuned_params(self.current_folder_path, engine=self.engine_var.get()) if self.current_folder_path else None
+        if tuned:
+            self._set_clean_params(tuned['block_size'], tuned['c_value'], tuned=True)
+        else:
+            self._set_clean_params(21, 10)
+
+    def autotune_action(self):
+        # Tune on a sample of the loaded folder, or on the single loaded image
+        folder = self.current_folder_path if self.image_files_in_folder else None
+        image_paths = self.image_files_in_folder if folder else [self.current_image_path]
+        if not image_paths or not image_paths[0]:
+            messagebox.showwarning("No Image", "Load an image or folder first.")
+            return
+        engine = self.engine_var.get()
+        self.btn_autotune.config(state=tk.DISABLED)
+        self._update_status(f"Auto-tuning {engine} on {min(len(image_paths), 4)} image(s)...")
+        threading.Thread(target=self._run_autotune, args=(list(image_paths), engine, folder), daemon=True).start()
+
+    def _run_autotune(self, image_paths, engine, folder):
         try:
-            self.original_image_pil = Image.open(self.current_image_path)
+            tuned = autotune.autotune(image_paths, engine=engine)
+            message = f"Auto-tune: block size {tuned['block_size']}, C {tuned['c_value']}"
+            if folder:
+                try:
+                    autotune.save_tuned_params(folder, tuned)
+                    message += " (saved for this folder)."
+                except OSError as e:
+                    print(f"Could not save tuned parameters to {folder}: {e}") # Log to console
+                    message += " (could not be saved, see console)."
+            self.root.after(0, self._set_clean_params, tuned['block_size'], tuned['c_value'], True)
+            self.root.after(0, self._update_status, message)
+        except Exception as e:
+            print(f"Auto-tune failed: {e}") # Log to console
+            self.root.after(0, self._update_status, "Auto-tune failed. See console.")
+        self.root.after(0, self.btn_autotune.config, {'state': tk.NORMAL})
+
+    def show_folder_image(self, index):
+        """Shows the image at index in the loaded folder and prefetches its neighbours' previews."""
+        if not self.image_files_in_folder:
+            return
+        index = max(0, min(index, len(self.image_files_in_folder) - 1))
+
+        self._clear_displays()
+        self.current_folder_index = index
+        self.current_image_path = self.image_files_in_folder[index]
+        try:
+            self.original_image_pil = Image.open(self.current_image_path) # Lazy: pixels are read when processing
             self.root.update_idletasks()
-            self._display_pil_image(self.original_image_pil, self.lbl_original_image, f"Folder Preview: {os.path.basename(self.current_image_path)}")
+            self._display_pil_image(self.original_image_pil, self.lbl_original_image,
+                                    f"Folder {index + 1}/{len(self.image_files_in_folder)}: {os.path.basename(self.current_image_path)}",
+                                    source_path=self.current_image_path)
             self.btn_process_current.config(state=tk.NORMAL) # Allow processing this preview
             self.btn_extract_text.config(state=tk.NORMAL)
         except Exception as e:
             self._update_status(f"Error loading preview from folder: {e}")
             # Don't clear folder path or list
 
-        self.btn_process_folder.config(state=tk.NORMAL)
-        self._update_status(f"{len(self.image_files_in_folder)} images loaded from folder. Ready for batch processing.")
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < len(self.image_files_in_folder):
+                path = self.image_files_in_folder[neighbour]
+                self.preview_cache.prefetch(path, path)
+
+        self.btn_prev_image.config(state=tk.NORMAL if index > 0 else tk.DISABLED)
+        self.btn_next_image.config(state=tk.NORMAL if index < len(self.image_files_in_folder) - 1 else tk.DISABLED)
 
 
     def process_current_image_action(self):
@@ -204,9 +426,20 @@ class NoteAppGUI:
 
         self._update_status("Processing current image...")
         try:
-            cv_original = bg_rem.pil_to_cv(self.original_image_pil)
-            cv_processed = bg_rem.remove_background(cv_original) # Uses default params
+            params = {'block_size': self.block_size, 'c_value': self.c_value, 'engine': self.engine_var.get()}
+            source_hash = self._source_hash()
+            # Keyed and encoded like a batch run's page with fast_decode off (which decodes
+            # the way pil_to_cv does), so the GUI and batch runs share cache entries
+            cache_key = batch_processor.clean_cache_key(source_hash, dict(params, fast_decode=False)) if source_hash else None
+
+            cv_processed = self.result_cache.get_image(cache_key) if cache_key else None
+            if cv_processed is None:
+                cv_original = bg_rem.pil_to_cv(self.original_image_pil)
+                cv_processed = bg_rem.remove_background(cv_original, **params)
+                if cache_key:
+                    self.result_cache.put_png(cache_key, bg_rem.encode_png(cv_processed))
             self.processed_image_pil = bg_rem.cv_to_pil(cv_processed)
+            self.processed_params = params
             
             self.root.update_idletasks()
             self._display_pil_image(self.processed_image_pil, self.lbl_processed_image, "Processed")
@@ -218,6 +451,7 @@ class NoteAppGUI:
             messagebox.showerror("Processing Error", f"Error during processing: {e}")
             self._update_status("Error processing current image.")
             self.processed_image_pil = None
+            self.processed_params = None
             self._display_pil_image(None, self.lbl_processed_image, "Processed Image")
             self.btn_save_processed.config(state=tk.DISABLED)
 
@@ -279,15 +513,37 @@ class NoteAppGUI:
         self.txt_ocr_output.config(state=tk.NORMAL)
         self.txt_ocr_output.delete('1.0', tk.END)
 
+        # OCR of the processed image also depends on the settings it was cleaned with.
+        # The GUI caches plain text, so its entries are kept apart from the batch's OCR lines
+        source_hash = self._source_hash()
+        cache_params = self.processed_params if image_to_ocr is self.processed_image_pil else {}
+        cache_key = None
+        if source_hash:
+            cache_key = result_cache.ocr_key(source_hash, lang, kind='text', regions=True,
+                                             text_height=ocr_processor.TARGET_TEXT_HEIGHT, **cache_params)
+
         # Run OCR in a thread to avoid freezing GUI
-        threading.Thread(target=self._run_ocr, args=(image_to_ocr, lang), daemon=True).start()
+        threading.Thread(target=self._run_ocr, args=(image_to_ocr, lang, cache_key), daemon=True).start()
 
-    def _run_ocr(self, image_to_ocr, lang):
+    def _run_ocr(self, image_to_ocr, lang, cache_key=None):
         try:
-            extracted_text = ocr_processor.extract_text_from_image(image_to_ocr, lang=lang)
+            extracted_text = self.result_cache.get_text(cache_key) if cache_key else None
+            if extracted_text is None:
+                # A running OCR daemon already has the models loaded; otherwise load them here
+                daemon = ocr_daemon.find_daemon()
+                if daemon is not None:
+                    try:
+                        extracted_text = daemon.extract_text(image_to_ocr, lang=lang)
+                    except (OSError, ocr_daemon.DaemonError) as e:
+                        print(f"OCR daemon failed, running OCR locally: {e}")
+                if extracted_text is None:
+                    extracted_text = ocr_processor.extract_text_from_image(image_to_ocr, lang=lang)
+                if cache_key and "OCR Error:" not in extracted_text:
+                    self.result_cache.put_text(cache_key, extracted_text)
             
             # Update GUI from the main thread
             self.root.after(0, self.txt_ocr_output.insert, tk.END, extracted_text)
+            self.root.after(0, self._show_ocr_ready, lang)
             if "OCR Error:" in extracted_text:
                  self.root.after(0, self._update_status, f"OCR completed with issues from {self.current_image_path or 'current image'}.")
             else:
@@ -315,46 +571,82 @@ class NoteAppGUI:
 
         os.makedirs(output_folder, exist_ok=True)
         
+        ocr_lang = self.ocr_lang_var.get() if self.batch_ocr_var.get() else None
+
         self.progress_bar['value'] = 0
-        self.progress_bar['maximum'] = len(self.image_files_in_folder)
+        # OCR is a second pass over the cleaned pages
+        self.progress_bar['maximum'] = len(self.image_files_in_folder) * (2 if ocr_lang else 1)
         self._update_status("Starting batch processing...")
 
         # Run batch processing in a thread
-        threading.Thread(target=self._run_batch_process, args=(list(self.image_files_in_folder), output_folder), daemon=True).start()
+        threading.Thread(target=self._run_batch_process, args=(list(self.image_files_in_folder), output_folder, ocr_lang, self.engine_var.get(), self.dedup_var.get()), daemon=True).start()
 
 
-    def _run_batch_process(self, image_paths, output_dir):
-        processed_count = 0
-        error_count = 0
+    def _run_batch_process(self, image_paths, output_dir, ocr_lang=None, engine=bg_rem.DEFAULT_ENGINE, skip_duplicates=False):
         total_files = len(image_paths)
 
-        for i, img_path in enumerate(image_paths):
-            try:
-                self.root.after(0, self._update_status, f"Batch: Processing {i+1}/{total_files} - {os.path.basename(img_path)}")
-                
-                pil_img = Image.open(img_path)
-                cv_original = bg_rem.pil_to_cv(pil_img)
-                cv_processed = bg_rem.remove_background(cv_original)
-                pil_processed = bg_rem.cv_to_pil(cv_processed)
-
-                base, ext = os.path.splitext(os.path.basename(img_path))
-                output_filename = f"{base}_cleaned.png" # Always save as PNG for cleaned
-                output_path = os.path.join(output_dir, output_filename)
-                
-                pil_processed.save(output_path)
-                processed_count += 1
-
-            except Exception as e:
-                error_count += 1
-                print(f"Error processing {img_path}: {e}") # Log to console
-                self.root.after(0, self._update_status, f"Error processing {os.path.basename(img_path)}. See console.")
-            
-            # Update progress bar from main thread
-            self.root.after(0, self.progress_bar.config, {'value': i + 1})
+        def on_progress(stage, done, total, result):
+            if result.ok:
+                self.root.after(0, self._update_status, f"Batch ({stage}): Processed {done}/{total} - {os.path.basename(result.source_path)}")
+            else:
+                print(f"Error processing {result.source_path}: {result.error}") # Log to console
+                self.root.after(0, self._update_status, f"Error processing {os.path.basename(result.source_path)}. See console.")
+
+            # Update progress bar from main thread; unchanged files were skipped, so scale to the work left
+            offset = total_files if stage == 'ocr' else 0
+            self.root.after(0, self.progress_bar.config, {'value': offset + total_files * done / max(1, total)})
             self.root.after(0, self.progress_bar.update_idletasks)
 
+        daemon = ocr_daemon.find_daemon() if ocr_lang else None
+        self.root.after(0, self._update_status, f"Batch: Processing {total_files} files"
+                                                f"{' (OCR via daemon)' if daemon else ''}...")
+        # Pages are fanned out over a process pool and reported as they finish.
+        # The manifest in the output folder lets repeated runs skip unchanged files.
+        # Per-stage timings are collected for the run and printed to the console at the end
+        # OCR results also go into the search index (python search_index.py search ...).
+        # Like a page that fails to index, an index that cannot be opened must not stop the batch
+        index, index_error = None, None
+        if ocr_lang:
+            try:
+                index = search_index.SearchIndex()
+            except Exception as e: # e.g. SQLite built without FTS5
+                print(f"Could not open the search index: {e}")
+                index_error = str(e)
+        try:
+            with instrumentation.recording(instrumentation.StageTotals()) as stage_totals:
+                summary = batch_processor.run_folder(
+                    image_paths, output_dir, manifest=batch_manifest.BatchManifest(output_dir),
+                    ocr_options={'lang': ocr_lang, 'cache': self.result_cache, 'daemon': daemon} if ocr_lang else None,
+                    pipelined=bool(ocr_lang), # With OCR, overlap it with reading/cleaning/saving
+                    index=index, skip_duplicates=skip_duplicates,
+                    progress_callback=on_progress, ordered=False,
+                    block_size=self.block_size, c_value=self.c_value, engine=engine, cache=self.result_cache)
+            print(stage_totals.format_table())
+        except Exception as e:
+            print(f"Batch processing failed: {e}")
+            self.root.after(0, self._update_status, "Batch processing failed. See console.")
+            self.root.after(0, messagebox.showerror, "Batch Processing Failed", str(e))
+            self.root.after(0, self.progress_bar.config, {'value': 0})
+            return
+        finally:
+            if index is not None:
+                try:
+                    index.close()
+                except Exception as e:
+                    print(f"Could not close the search index: {e}")
+        error_count = sum(1 for r in summary.clean_results if not r.ok)
+        processed_count = len(summary.clean_results) - error_count
+
+        final_status = f"Batch complete: {processed_count} processed, {summary.skipped_clean} unchanged, {error_count} errors."
+        if summary.duplicate_count:
+            final_status += f" {summary.duplicate_count} near-duplicates linked instead of processed."
+
+        if ocr_lang:
+            ocr_errors = sum(1 for r in summary.ocr_results if not r.ok)
+            final_status += f" OCR: {len(summary.ocr_results) - ocr_errors} pages, {summary.skipped_ocr} unchanged, {ocr_errors} errors."
+            if index_error:
+                final_status += f" The pages were not added to the search index ({index_error})."
 
-        final_status = f"Batch complete: {processed_count} processed, {error_count} errors."
         self.root.after(0, self._update_status, final_status)
         self.root.after(0, messagebox.showinfo, "Batch Processing Finished", final_status)
         self.root.after(0, self.progress_bar.config, {'value': 0})
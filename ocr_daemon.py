@@ -0,0 +1,742 @@
+# ocr_daemon.py
+"""
+Local OCR service that keeps EasyOCR readers loaded between runs and clients.
+
+    python ocr_daemon.py --preload en --preload en,pl
+
+starts an HTTP server on localhost. The GUI, batch_processor.py --daemon and
+any other tool submit jobs to it instead of loading the models themselves,
+so the model load is paid once per daemon instead of once per process.
+
+Jobs wait in a priority queue (higher priority first, FIFO within a priority).
+Long jobs are worked on a few pages at a time and go back into the queue in
+between, so an interactive request never waits for a whole batch to finish.
+The number of unfinished jobs is bounded: beyond max_pending, submissions are
+refused with 503 and a Retry-After header, and clients back off.
+
+Endpoints (all JSON):
+    GET    /status             loaded readers, queue and job counts
+    POST   /jobs               submit a job -> 202 {"job_id": ...}, or 503 when full
+    GET    /jobs/<id>          state and progress of a job
+    GET    /jobs/<id>/results  results as JSON lines, streamed until the job ends
+    DELETE /jobs/<id>          cancel a job (pages already done are kept)
+
+Job kinds and their fields:
+    clean      paths, output_dir, optional block_size, c_value, engine, fast_decode
+    ocr        paths, output_dir, lang, optional pages_per_batch, batch_size,
+               use_regions, target_text_height
+    ocr_image  image (base64 encoded file bytes), lang, optional use_regions,
+               target_text_height; the single result holds the text
+    warmup     lang; loads the reader for those languages
+Every job also takes an optional priority (PRIORITY_BATCH by default).
+Paths are read and written by the daemon, so they must be absolute.
+
+The daemon reads and writes whatever paths it is sent, so only local
+processes of the same user may talk to it. It only listens on loopback
+addresses. At startup it writes a random token to a file only its user can
+read (token_path), and every request must carry it as
+"Authorization: Bearer <token>". DaemonClient does this by itself. Requests
+with an Origin header (i.e. from web pages) are refused, and job submissions
+must be sent as application/json.
+"""
+import argparse
+import base64
+import hmac
+import io
+import ipaddress
+import itertools
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+import bg_rem
+import instrumentation
+import ocr_processor
+import page_outputs
+import result_cache
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_URL = os.environ.get('NOTES_DIGITIZER_DAEMON', f'http://{DEFAULT_HOST}:{DEFAULT_PORT}')
+TOKEN_DIR = os.environ.get('NOTES_DIGITIZER_DAEMON_TOKEN_DIR',
+                           os.path.join(os.path.expanduser('~'), '.local', 'share', 'notes_digitizer'))
+
+PRIORITY_BATCH = 0
+PRIORITY_INTERACTIVE = 10 # Single pages someone is waiting for in the GUI
+
+MAX_PENDING_JOBS = 16 # Queued plus running; further submissions get 503
+MAX_FINISHED_JOBS = 200 # Finished jobs kept around for late status/result requests
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+CLEAN_PAGES_PER_STEP = 4 # Pages of a clean job done before it yields to other jobs
+HEARTBEAT_SECONDS = 10.0 # Idle result streams get a progress line this often
+RETRY_AFTER_SECONDS = 2
+
+JOB_OPTIONS = {
+    'clean': ('block_size', 'c_value', 'engine', 'fast_decode', 'bit_depth', 'compress_level'),
+    'ocr': ('pages_per_batch', 'batch_size', 'use_regions', 'target_text_height'),
+    'ocr_image': ('use_regions', 'target_text_height'),
+    'warmup': (),
+}
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+class ServiceBusy(Exception):
+    """Raised by OcrService.submit when max_pending jobs are already waiting or running."""
+
+
+class DaemonBusy(RuntimeError):
+    """The daemon refused a job because its queue is full."""
+
+
+class DaemonError(RuntimeError):
+    """The daemon rejected a request or a job failed."""
+
+
+class Job:
+    """One submitted job and the results it has produced so far."""
+
+    def __init__(self, job_id, kind, priority, params):
+        self.job_id = job_id
+        self.kind = kind
+        self.priority = priority
+        self.params = params
+        self.state = 'queued'
+        self.error = None
+        self.results = []
+        self.position = 0 # Index of the next page to process
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self._changed = threading.Condition()
+
+    @property
+    def total(self):
+        return len(self.params.get('paths', ())) if self.kind in ('clean', 'ocr') else 1
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED_STATES
+
+    def add_result(self, result):
+        with self._changed:
+            result['index'] = len(self.results)
+            self.results.append(result)
+            self._changed.notify_all()
+
+    def finish(self, state, error=None):
+        with self._changed:
+            self.state = state
+            self.error = error
+            self.finished = time.time()
+            self._changed.notify_all()
+
+    def describe(self):
+        """Returns the job's state and progress as a dict."""
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'priority': self.priority,
+            'state': self.state,
+            'error': self.error,
+            'total': self.total,
+            'completed': len(self.results),
+            'errors': sum(1 for r in self.results if r.get('error')),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+    def iter_results(self, start=0, heartbeat=HEARTBEAT_SECONDS):
+        """
+        Yields the results from index start on as they arrive, and None every
+        heartbeat seconds without news, until the job has finished.
+        """
+        index = start
+        while True:
+            with self._changed:
+                if index >= len(self.results) and not self.finished_state:
+                    self._changed.wait(heartbeat)
+                new_results = self.results[index:]
+                finished = self.finished_state
+            if new_results:
+                index += len(new_results)
+                yield from new_results
+            elif not finished:
+                yield None
+            if finished and index >= len(self.results):
+                return
+
+
+def _page_result_dict(page_result):
+    return {
+        'source_path': page_result.source_path,
+        'output_path': page_result.output_path,
+        'error': page_result.error,
+    }
+
+
+class OcrService:
+    """
+    The job queue and its worker threads, independent of HTTP.
+    Readers come from ocr_processor.READER_CACHE, so they stay loaded between jobs.
+    EasyOCR readers are not documented as thread-safe, so OCR steps run one
+    at a time; cleaning steps of other jobs run alongside them.
+    """
+
+    def __init__(self, workers=2, max_pending=MAX_PENDING_JOBS, cache=None):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.cache = cache
+        self._queue = queue.PriorityQueue() # (-priority, sequence, job)
+        self._sequence = itertools.count()
+        self._jobs = OrderedDict() # job_id -> Job, oldest first
+        self._lock = threading.Lock()
+        self._ocr_lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ocr-daemon-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stops the workers after their current step; queued jobs are cancelled."""
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put((float('-inf'), next(self._sequence), None)) # Ahead of any job
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished_state:
+                    job.finish('cancelled', "Daemon stopped.")
+
+    def submit(self, kind, priority=PRIORITY_BATCH, **params):
+        """
+        Queues a job and returns it.
+        Raises:
+            ValueError for an unknown kind or missing/invalid fields.
+            ServiceBusy if max_pending jobs are already unfinished.
+        """
+        params = self._validate(kind, params)
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.finished_state)
+            if pending >= self.max_pending:
+                raise ServiceBusy(f"{pending} jobs pending")
+            job = Job(f"{int(time.time() * 1000):x}-{next(self._sequence)}", kind, int(priority), params)
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._queue.put((-job.priority, next(self._sequence), job))
+        return job
+
+    @staticmethod
+    def _validate(kind, params):
+        if kind not in JOB_OPTIONS:
+            raise ValueError(f"Unknown job kind {kind!r}; expected one of {', '.join(JOB_OPTIONS)}.")
+        allowed = set(JOB_OPTIONS[kind])
+        if kind in ('clean', 'ocr'):
+            allowed |= {'paths', 'output_dir'}
+            if not isinstance(params.get('paths'), list) or not params.get('output_dir'):
+                raise ValueError(f"A {kind} job needs 'paths' (a list) and 'output_dir'.")
+            if not all(os.path.isabs(path) for path in params['paths'] + [params['output_dir']]):
+                raise ValueError("Paths must be absolute.")
+        if kind == 'ocr_image':
+            allowed.add('image')
+            if not params.get('image'):
+                raise ValueError("An ocr_image job needs 'image'.")
+        if kind in ('ocr', 'ocr_image', 'warmup'):
+            allowed.add('lang')
+            lang = params.get('lang', 'en')
+            params['lang'] = [lang] if not isinstance(lang, list) else lang
+        if kind == 'clean' and params.get('engine', bg_rem.DEFAULT_ENGINE) not in bg_rem.ENGINES:
+            raise ValueError(f"Unknown engine {params['engine']!r}.")
+        unknown = set(params) - allowed
+        if unknown:
+            raise ValueError(f"Unknown fields for a {kind} job: {', '.join(sorted(unknown))}.")
+        return params
+
+    def _prune(self):
+        """Forgets the oldest finished jobs beyond MAX_FINISHED_JOBS. Needs self._lock."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_state]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job ends right away, a running one after its
+        current step. Returns the job, or None if it is unknown.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_requested.set()
+        with self._lock:
+            if job.state == 'queued':
+                job.finish('cancelled')
+        return job
+
+    def status(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            'pid': os.getpid(),
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'jobs': {state: states.count(state) for state in set(states)},
+            'readers': ocr_processor.READER_CACHE.stats(),
+        }
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            _, sequence, job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.finished_state:
+                    continue # Cancelled while queued
+                if job.cancel_requested.is_set():
+                    job.finish('cancelled')
+                    continue
+                job.state = 'running'
+                job.started = job.started or time.time()
+            try:
+                more = self._step(job)
+            except Exception as e:
+                job.finish('failed', str(e))
+                continue
+            if job.cancel_requested.is_set():
+                job.finish('cancelled')
+            elif more:
+                # Back into the queue with its original place, so newer jobs
+                # of a higher priority get their turn first
+                with self._lock:
+                    job.state = 'queued'
+                self._queue.put((-job.priority, sequence, job))
+            else:
+                job.finish('done')
+
+    def _step(self, job):
+        """Does the next part of job. Returns True if there is more to do."""
+        import batch_processor # Deferred: batch_processor imports this module for --daemon
+        params = job.params
+        options = {name: params[name] for name in JOB_OPTIONS[job.kind] if name in params}
+        with instrumentation.stage('daemon_job', kind=job.kind):
+            if job.kind == 'clean':
+                paths = params['paths'][job.position:job.position + CLEAN_PAGES_PER_STEP]
+                os.makedirs(params['output_dir'], exist_ok=True)
+                for path in paths:
+                    result = batch_processor.clean_image_file(path, params['output_dir'], cache=self.cache, **options)
+                    job.add_result(_page_result_dict(result))
+                job.position += len(paths)
+                return job.position < len(params['paths'])
+
+            if job.kind == 'ocr':
+                pages_per_batch = options.get('pages_per_batch', 8)
+                paths = params['paths'][job.position:job.position + pages_per_batch]
+                os.makedirs(params['output_dir'], exist_ok=True)
+                with self._ocr_lock:
+                    for result in batch_processor.iter_ocr_batch(paths, params['output_dir'], lang=params['lang'],
+                                                                 cache=self.cache, **options):
+                        job.add_result(_page_result_dict(result))
+                job.position += len(paths)
+                return job.position < len(params['paths'])
+
+            if job.kind == 'ocr_image':
+                with Image.open(io.BytesIO(base64.b64decode(params['image']))) as pil_image:
+                    pil_image.load()
+                    with self._ocr_lock:
+                        text = ocr_processor.extract_text_from_image(pil_image, lang=params['lang'], **options)
+                job.add_result({'text': text, 'error': text if text.startswith("OCR Error:") else None})
+                return False
+
+            # warmup
+            with self._ocr_lock:
+                ocr_processor.READER_CACHE.get(params['lang'])
+            job.add_result({'lang': params['lang'], 'error': None})
+            return False
+
+
+def token_path(port, token_dir=TOKEN_DIR):
+    """Returns the path of the access token file of the daemon on port."""
+    return os.path.join(token_dir, f'daemon-{port}.token')
+
+
+def write_token(path):
+    """Creates a new random token and saves it at path, readable by the current user only."""
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+    return token
+
+
+def read_token(path):
+    """Returns the token saved at path, or None if there is none."""
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'NotesDigitizerOCR/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _allowed(self):
+        """Answers and returns False unless the request is from a local client holding the token."""
+        if self.headers.get('Origin') is not None:
+            self._send_json(403, {'error': "Requests from web pages are not accepted."})
+            return False
+        expected = f'Bearer {self.server.token}'.encode('utf-8')
+        supplied = self.headers.get('Authorization', '').encode('utf-8')
+        if self.server.token is None or not hmac.compare_digest(supplied, expected):
+            self._send_json(401, {'error': "Missing or wrong token."})
+            return False
+        return True
+
+    def _job_or_404(self, job_id):
+        job = self.server.service.get(job_id)
+        if job is None:
+            self._send_json(404, {'error': f"Unknown job {job_id}."})
+        return job
+
+    def _route(self):
+        """Returns (job_id, sub-resource) for /jobs/<id>[/<sub>] paths, else (None, None)."""
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            return parts[1], '/'.join(parts[2:])
+        return None, None
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path == '/status':
+            self._send_json(200, self.server.service.status())
+            return
+        job_id, sub = self._route()
+        if job_id is None or sub not in ('', 'results'):
+            self._send_json(404, {'error': f"Unknown path {self.path}."})
+            return
+        job = self._job_or_404(job_id)
+        if job is None:
+            return
+        if sub == '':
+            self._send_json(200, job.describe())
+            return
+
+        start = 0
+        query = self.path.split('?', 1)[1] if '?' in self.path else ''
+        for item in query.split('&'):
+            if item.startswith('start='):
+                value = item[len('start='):] or '0'
+                if not (value.isascii() and value.isdigit()):
+                    self._send_json(400, {'error': f"start must be a non-negative integer, not {value!r}."})
+                    return
+                start = int(value)
+        # No Content-Length: the stream ends when the connection is closed
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for result in job.iter_results(start):
+                line = {'event': 'result', **result} if result is not None else {'event': 'progress', **job.describe()}
+                self.wfile.write((json.dumps(line) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write((json.dumps({'event': 'end', **job.describe()}) + '\n').encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass # The client went away; the job carries on
+
+    def do_POST(self):
+        if not self._allowed():
+            return
+        if self.path.split('?', 1)[0].rstrip('/') != '/jobs':
+            self._send_json(404, {'error': f"Unknown path {self.path}."})
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self._send_json(415, {'error': "Jobs must be submitted as application/json."})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            self._send_json(413, {'error': f"Request larger than {MAX_REQUEST_BYTES} bytes."})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            kind = payload.pop('kind', None)
+            priority = payload.pop('priority', PRIORITY_BATCH)
+            job = self.server.service.submit(kind, priority, **payload)
+        except ServiceBusy as e:
+            self._send_json(503, {'error': f"Queue full ({e})."}, {'Retry-After': str(RETRY_AFTER_SECONDS)})
+            return
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(202, {'job_id': job.job_id})
+
+    def do_DELETE(self):
+        if not self._allowed():
+            return
+        job_id, sub = self._route()
+        if job_id is None or sub:
+            self._send_json(404, {'error': f"Unknown path {self.path}."})
+            return
+        job = self.server.service.cancel(job_id)
+        if job is None:
+            self._send_json(404, {'error': f"Unknown job {job_id}."})
+            return
+        self._send_json(200, job.describe())
+
+
+class OcrServer(ThreadingHTTPServer):
+    """HTTP front end of an OcrService; one thread per connection."""
+    daemon_threads = True
+
+    def __init__(self, address, service, token, verbose=False):
+        super().__init__(address, _Handler)
+        self.service = service
+        self.token = token
+        self.verbose = verbose
+
+
+class DaemonClient:
+    """Talks to a running ocr_daemon over HTTP (standard library only)."""
+
+    def __init__(self, url=DEFAULT_URL, timeout=30.0, token=None):
+        """
+        Args:
+            url: Base URL of the daemon.
+            timeout: Seconds to wait for a response; result streams send a
+                     progress line every HEARTBEAT_SECONDS, so this also
+                     detects a daemon that went away mid-job.
+            token: Access token; by default read from the daemon's token file
+                   (token_path of the URL's port).
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.token = token or read_token(token_path(urllib.parse.urlsplit(self.url).port or 80))
+
+    def _open(self, method, path, payload=None, timeout=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+        if data:
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=headers)
+        return urllib.request.urlopen(request, timeout=timeout or self.timeout)
+
+    def _request(self, method, path, payload=None, timeout=None):
+        try:
+            with self._open(method, path, payload, timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error')
+            except ValueError:
+                message = None
+            if e.code == 503:
+                raise DaemonBusy(message or "Daemon queue full.") from None
+            raise DaemonError(message or f"HTTP {e.code}") from None
+
+    def ping(self, timeout=0.5):
+        """Returns the daemon's status, or None if it is not reachable."""
+        try:
+            return self._request('GET', '/status', timeout=timeout)
+        except (OSError, ValueError, DaemonError):
+            return None
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def submit(self, kind, priority=PRIORITY_BATCH, wait=True, **params):
+        """
+        Submits a job and returns its id. While the daemon's queue is full,
+        waits and retries if wait is set, else raises DaemonBusy.
+        """
+        payload = dict(params, kind=kind, priority=priority)
+        while True:
+            try:
+                return self._request('POST', '/jobs', payload)['job_id']
+            except DaemonBusy:
+                if not wait:
+                    raise
+                time.sleep(RETRY_AFTER_SECONDS)
+
+    def job(self, job_id):
+        return self._request('GET', f'/jobs/{job_id}')
+
+    def cancel(self, job_id):
+        return self._request('DELETE', f'/jobs/{job_id}')
+
+    def results(self, job_id, start=0):
+        """
+        Yields the job's result dicts as they are produced.
+        Raises:
+            DaemonError if the job failed or was cancelled, since it then has
+            fewer results than pages.
+        """
+        with self._open('GET', f'/jobs/{job_id}/results?start={start}') as response:
+            for line in response:
+                message = json.loads(line)
+                event = message.pop('event')
+                if event == 'result':
+                    yield message
+                elif event == 'end':
+                    if message['state'] == 'failed':
+                        raise DaemonError(f"Job {job_id} failed: {message['error']}")
+                    if message['state'] == 'cancelled':
+                        raise DaemonError(f"Job {job_id} was cancelled"
+                                          + (f": {message['error']}" if message['error'] else "."))
+                    return
+
+    def _iter_page_results(self, kind, image_paths, output_dir, priority, params):
+        """Yields a PageResult per page; pages a failed or cancelled job never got to get an error."""
+        paths = [os.path.abspath(path) for path in image_paths]
+        job_id = self.submit(kind, priority, paths=paths, output_dir=os.path.abspath(output_dir), **params)
+        finished = False
+        try:
+            reported = set()
+            try:
+                for result in self.results(job_id):
+                    reported.add(result['source_path'])
+                    yield page_outputs.PageResult(result['source_path'], result['output_path'], result['error'])
+            except DaemonError as e:
+                for path in paths:
+                    if path not in reported:
+                        yield page_outputs.PageResult(path, error=str(e))
+            finished = True
+        finally:
+            if not finished: # The caller stopped early (or the stream broke); don't leave the job running
+                try:
+                    self.cancel(job_id)
+                except (OSError, DaemonError):
+                    pass
+
+    def iter_batch(self, image_paths, output_dir, priority=PRIORITY_BATCH, cache=None, **clean_options):
+        """
+        Like batch_processor.iter_batch, but the daemon does the cleaning.
+        cache is ignored; the daemon uses its own result cache.
+        """
+        return self._iter_page_results('clean', image_paths, output_dir, priority, clean_options)
+
+    def iter_ocr_batch(self, image_paths, output_dir, lang='en', priority=PRIORITY_BATCH, cache=None, **ocr_options):
+        """
+        Like batch_processor.iter_ocr_batch, but OCR runs on the daemon's warm readers.
+        cache is ignored; the daemon uses its own result cache.
+        """
+        ocr_options['lang'] = lang
+        return self._iter_page_results('ocr', image_paths, output_dir, priority, ocr_options)
+
+    def extract_text(self, pil_image, lang='en', priority=PRIORITY_INTERACTIVE, **options):
+        """Like ocr_processor.extract_text_from_image, but on the daemon."""
+        buffer = io.BytesIO()
+        pil_image.save(buffer, format='PNG', compress_level=1)
+        job_id = self.submit('ocr_image', priority, image=base64.b64encode(buffer.getvalue()).decode('ascii'),
+                             lang=lang, **options)
+        for result in self.results(job_id):
+            return result['text']
+        raise DaemonError(f"Job {job_id} ended without a result.")
+
+    def warmup(self, lang='en', priority=PRIORITY_INTERACTIVE):
+        """Asks the daemon to load the reader for lang; returns the job id without waiting."""
+        return self.submit('warmup', priority, lang=lang)
+
+
+def find_daemon(url=DEFAULT_URL, timeout=0.3):
+    """Returns a DaemonClient if a daemon answers at url, else None."""
+    client = DaemonClient(url)
+    return client if client.ping(timeout) is not None else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve OCR and cleaning jobs with warm EasyOCR readers.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="loopback address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2, help="job worker threads (OCR steps still run one at a time)")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING_JOBS,
+                        help="unfinished jobs accepted before new ones are refused")
+    parser.add_argument("--max-readers", type=int, default=ocr_processor.READER_CACHE_MAX_ENTRIES,
+                        help="language sets kept loaded at once")
+    parser.add_argument("--preload", metavar="LANG", action="append", default=[],
+                        help="load the reader for these languages at startup (e.g. 'en' or 'en,pl'; repeatable)")
+    parser.add_argument("--cache-dir", default=result_cache.DEFAULT_CACHE_DIR, help="result cache folder")
+    parser.add_argument("--no-cache", action="store_true", help="always recompute, never use the result cache")
+    parser.add_argument("--stats-prom", metavar="PATH", help="write running totals in the Prometheus text format")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+    if not is_loopback(args.host):
+        parser.error("--host must be a loopback address; the daemon reads and writes any path it is sent")
+
+    ocr_processor.READER_CACHE.max_entries = max(1, args.max_readers)
+    service = OcrService(workers=args.workers, max_pending=args.max_pending,
+                         cache=None if args.no_cache else result_cache.ResultCache(args.cache_dir))
+    server = OcrServer((args.host, args.port), service, token=None, verbose=args.verbose)
+    token_file = token_path(server.server_address[1])
+    try:
+        server.token = write_token(token_file)
+    except OSError as e:
+        print(f"Could not write the token file {token_file}: {e}")
+        server.server_close()
+        return 1
+    service.start()
+    for lang in args.preload:
+        service.submit('warmup', PRIORITY_INTERACTIVE, lang=lang.split(','))
+
+    sinks = [instrumentation.PrometheusSink(args.stats_prom)] if args.stats_prom else []
+    print(f"OCR daemon listening on http://{args.host}:{server.server_address[1]} (Ctrl+C to stop)")
+    with instrumentation.recording(*sinks):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.stop()
+            if read_token(token_file) == server.token: # Another daemon may have taken over the port since
+                os.remove(token_file)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,29 @@
 # ocr_processor.py
+"""
+OCR with EasyOCR.
+
+EasyOCR imports torch, which takes seconds, so it is only imported when a
+reader is first needed; importing this module is cheap. warm_up() does the
+import and the model load ahead of time, e.g. in a background thread.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+import cv2
 from PIL import Image
-import easyocr
 import numpy as np # EasyOCR works well with numpy arrays
 
-# Global reader instance to load models only once per language set
-# We'll initialize it lazily
-EASYOCR_READER = None
-CURRENT_EASYOCR_LANGS = []
+import instrumentation
+import text_regions
+
+# Readers are loaded lazily and kept per language set, see ReaderCache below
+READER_CACHE_MAX_ENTRIES = 2 # Each reader holds its own detector/recognizer models
+
+# Pages whose text is much taller than this are shrunk for the text detector,
+# whose cost grows with the pixel count; recognition still uses full-resolution crops
+TARGET_TEXT_HEIGHT = 32 # Typical glyph height in pixels the detector is run at
+MIN_OCR_SCALE = 0.25
 
 def get_available_languages():
     """
@@ -20,25 +37,221 @@ def get_available_languages():
     # you might let them type it in, or provide a more exhaustive list.
 
 
-def _initialize_reader(lang_list):
-    """Initializes or re-initializes the EasyOCR reader if necessary."""
-    global EASYOCR_READER, CURRENT_EASYOCR_LANGS
-    # Check if the reader needs to be (re)initialized
-    # This happens if it's the first time, or if the requested languages changed
-    if EASYOCR_READER is None or set(lang_list) != set(CURRENT_EASYOCR_LANGS):
+class ReaderCache:
+    """
+    Thread-safe LRU cache of EasyOCR readers, keyed by the (unordered) language set.
+    Concurrent requests for the same languages share a single model load, while
+    loads for different language sets can run in parallel.
+    """
+
+    def __init__(self, max_entries=READER_CACHE_MAX_ENTRIES, max_bytes=None, loader=None):
+        """
+        Args:
+            max_entries: Maximum number of readers kept loaded.
+            max_bytes: Optional budget for the combined model parameter size;
+                       least recently used readers are evicted beyond it.
+            loader: Callable building a reader from a language list
+                    (defaults to easyocr.Reader on CPU).
+        """
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._loader = loader or self._load_easyocr_reader
+        self._readers = OrderedDict() # key -> (reader, size in bytes), oldest first
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    @staticmethod
+    def normalize_key(lang_list):
+        return tuple(sorted(set(lang_list)))
+
+    @staticmethod
+    def _load_easyocr_reader(lang_list):
+        import easyocr # Deferred: pulls in torch
         print(f"Initializing EasyOCR reader for languages: {lang_list}. This may take a moment...")
-        try:
-            # gpu=True if you have a compatible GPU and CUDA installed, otherwise False
-            EASYOCR_READER = easyocr.Reader(lang_list, gpu=False)
-            CURRENT_EASYOCR_LANGS = lang_list
-            print("EasyOCR reader initialized.")
-        except Exception as e:
-            EASYOCR_READER = None # Ensure it's None on failure
-            raise RuntimeError(f"Failed to initialize EasyOCR reader: {e}")
-    return EASYOCR_READER
+        # gpu=True if you have a compatible GPU and CUDA installed, otherwise False
+        reader = easyocr.Reader(lang_list, gpu=False)
+        print("EasyOCR reader initialized.")
+        return reader
+
+    @staticmethod
+    def _reader_size(reader):
+        """Estimates the memory held by a reader's model parameters."""
+        size = 0
+        for model in (getattr(reader, 'detector', None), getattr(reader, 'recognizer', None)):
+            if hasattr(model, 'parameters'):
+                size += sum(p.numel() * p.element_size() for p in model.parameters())
+        return size
+
+    def _lookup(self, key):
+        """Returns the cached reader for key (marking it recently used) or None. Needs self._lock."""
+        entry = self._readers.get(key)
+        if entry is None:
+            return None
+        self._readers.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def get(self, lang_list):
+        """Returns a reader for lang_list, loading it if it is not cached yet."""
+        key = self.normalize_key(lang_list)
+        with self._lock:
+            reader = self._lookup(key)
+        if reader is not None:
+            instrumentation.event('reader_cache', hits=1)
+            return reader
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have finished loading while we waited for the key
+            with self._lock:
+                reader = self._lookup(key)
+                if reader is None:
+                    self.misses += 1
+            if reader is not None:
+                instrumentation.event('reader_cache', hits=1)
+                return reader
+
+            start = time.perf_counter()
+            reader = self._loader(list(key))
+            elapsed = time.perf_counter() - start
+            size = self._reader_size(reader)
+
+            with self._lock:
+                self.load_seconds += elapsed
+                self._readers[key] = (reader, size)
+                self._evict()
+            instrumentation.event('reader_cache', misses=1, load_s=elapsed, model_bytes=size)
+            return reader
+
+    def _evict(self):
+        def over_budget():
+            if len(self._readers) > self.max_entries:
+                return True
+            if self.max_bytes is not None:
+                return sum(size for _, size in self._readers.values()) > self.max_bytes
+            return False
+
+        # Never evict the most recently used entry, even if it alone is over budget
+        while len(self._readers) > 1 and over_budget():
+            self._readers.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._readers.clear()
+
+    def is_loaded(self, lang_list):
+        """True if a reader for lang_list is loaded (without counting a hit or loading it)."""
+        with self._lock:
+            return self.normalize_key(lang_list) in self._readers
+
+    def stats(self):
+        """Returns the cache counters as a dict."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'load_seconds': self.load_seconds,
+                'cached': [list(key) for key in self._readers],
+                'cached_bytes': sum(size for _, size in self._readers.values()),
+            }
+
+
+READER_CACHE = ReaderCache()
+
+
+def _initialize_reader(lang_list):
+    """Returns a (cached) EasyOCR reader for the given languages."""
+    try:
+        return READER_CACHE.get(lang_list)
+    except Exception as e:
+        raise RuntimeError(f"Failed to initialize EasyOCR reader: {e}")
+
+
+def warm_up(lang='en'):
+    """
+    Imports EasyOCR and loads the reader for lang, so the first OCR call
+    doesn't wait for it. Blocks until done; meant for a background thread.
+    Raises:
+        RuntimeError if the reader cannot be initialized.
+    """
+    _initialize_reader([lang] if not isinstance(lang, list) else lang)
 
 
-def extract_text_from_image(pil_image: Image.Image, lang: str = 'en'):
+def is_ready(lang='en'):
+    """True if OCR in lang can start without loading a model first."""
+    return READER_CACHE.is_loaded([lang] if not isinstance(lang, list) else lang)
+
+
+def _image_to_array(pil_image):
+    """Converts a PIL image into the NumPy array EasyOCR expects."""
+    # If image is RGBA, convert to RGB first as EasyOCR might not handle alpha well directly
+    if pil_image.mode == 'RGBA':
+        return np.array(pil_image.convert('RGB'))
+    if pil_image.mode == '1': # Bilevel cleaned pages; EasyOCR needs 8-bit pixels
+        return np.array(pil_image.convert('L'))
+    return np.array(pil_image)
+
+
+def ocr_scale(text_height, target_text_height=TARGET_TEXT_HEIGHT):
+    """
+    Returns the factor (at most 1) a page is resized by before text detection,
+    so that glyphs of text_height pixels end up about target_text_height high.
+    Pages with unknown or already small text are left alone.
+    """
+    if not text_height or not target_text_height or text_height <= 1.25 * target_text_height:
+        return 1.0
+    return max(MIN_OCR_SCALE, target_text_height / text_height)
+
+
+def _plan_page(pil_image, use_regions, target_text_height):
+    """
+    Layout of a page for OCR: the regions to OCR (see text_regions.plan_ocr_regions,
+    [None] means the whole page) and the detector scale (see ocr_scale).
+    """
+    if not use_regions and not target_text_height:
+        return [None], 1.0
+    with instrumentation.stage('ocr_layout', width=pil_image.width, height=pil_image.height) as timing:
+        binary = text_regions.binarize_for_layout(pil_image)
+        components = text_regions.ink_components(binary)
+        regions = text_regions.plan_ocr_regions(binary, components=components) if use_regions else [None]
+        scale = 1.0
+        if target_text_height:
+            scale = ocr_scale(text_regions.estimate_text_height(binary, components), target_text_height)
+        timing.add(regions=len(regions), blank_pages=int(not regions), downscaled_pages=int(scale < 1.0))
+    return regions, scale
+
+
+def _crop_array(image_array, region):
+    if region is None:
+        return image_array, 0, 0
+    x0, y0, x1, y1 = region
+    return np.ascontiguousarray(image_array[y0:y1, x0:x1]), x0, y0
+
+
+def _detect_boxes(reader, img, scale):
+    """
+    Runs the text detector on img shrunk by scale and returns its
+    (horizontal_list, free_list) in the pixels of img.
+    """
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    horizontal_list, free_list = reader.detect(img, reformat=False)
+    horizontal_list, free_list = horizontal_list[0], free_list[0]
+    if scale < 1.0:
+        horizontal_list = [[int(round(v / scale)) for v in box] for box in horizontal_list]
+        free_list = [[[x / scale, y / scale] for x, y in box] for box in free_list]
+    return horizontal_list, free_list
+
+
+def extract_text_from_image(pil_image: Image.Image, lang: str = 'en', use_regions=True,
+                            target_text_height=TARGET_TEXT_HEIGHT):
     """
     Extracts text from a PIL Image using EasyOCR.
     Args:
@@ -46,6 +259,10 @@ def extract_text_from_image(pil_image: Image.Image, lang: str = 'en'):
         lang: Language code for OCR (e.g., 'en', 'fr').
               EasyOCR can accept a list of languages too, e.g., ['en', 'fr']
               For simplicity in the GUI, we'll pass a single lang, but wrap it in a list.
+        use_regions: Only OCR the text blocks found by text_regions (blank pages
+                     return "" without running the detector); False OCRs the whole page.
+        target_text_height: Glyph height to shrink large text to for detection
+                            (see ocr_scale), or None to detect at full resolution.
     Returns:
         Extracted text as a string, or an error message string.
     """
@@ -60,17 +277,24 @@ def extract_text_from_image(pil_image: Image.Image, lang: str = 'en'):
         if reader is None: # Should not happen if _initialize_reader raises error, but defensive
             return "OCR Error: EasyOCR reader could not be initialized."
 
-        # EasyOCR prefers a NumPy array
-        # Convert PIL image to NumPy array
-        # If image is RGBA, convert to RGB first as EasyOCR might not handle alpha well directly
-        if pil_image.mode == 'RGBA':
-            image_for_ocr = np.array(pil_image.convert('RGB'))
-        else:
-            image_for_ocr = np.array(pil_image)
+        image_for_ocr = _image_to_array(pil_image)
 
         # detail=0 means it returns only the text, not bounding boxes etc.
         # paragraph=True tries to join nearby text into paragraphs.
-        result = reader.readtext(image_for_ocr, detail=0, paragraph=True)
+        result = []
+        regions, scale = _plan_page(pil_image, use_regions, target_text_height)
+        for region in regions:
+            crop, _, _ = _crop_array(image_for_ocr, region)
+            with instrumentation.stage('ocr', width=crop.shape[1], height=crop.shape[0]):
+                if scale < 1.0:
+                    # Detect on the shrunk crop, recognize from the full-resolution one
+                    from easyocr.utils import reformat_input
+                    img, img_cv_grey = reformat_input(crop)
+                    horizontal_list, free_list = _detect_boxes(reader, img, scale)
+                    result += reader.recognize(img_cv_grey, horizontal_list, free_list,
+                                               detail=0, paragraph=True, reformat=False)
+                else:
+                    result += reader.readtext(crop, detail=0, paragraph=True)
         
         extracted_text = "\n".join(result)
         return extracted_text.strip()
@@ -79,4 +303,77 @@ def extract_text_from_image(pil_image: Image.Image, lang: str = 'en'):
         return f"OCR Error: {re}"
     except Exception as e:
         # This will catch errors during readtext or other unexpected issues
-        return f"OCR Error: An unexpected error occurred with EasyOCR: {e}"
\ No newline at end of file
+        return f"OCR Error: An unexpected error occurred with EasyOCR: {e}"
+
+
+def extract_lines_from_images(pil_images, lang='en', batch_size=32, use_regions=True,
+                              target_text_height=TARGET_TEXT_HEIGHT):
+    """
+    Runs OCR over several pages with a single reader.
+    Text regions are detected page by page, but the crops of all pages are then
+    pooled, sorted by width and recognized in shared batches of batch_size.
+    EasyOCR's own recognize() handles crops one at a time on CPU, so pooling
+    them amortizes the per-call model overhead across pages.
+    Args:
+        pil_images: List of PIL.Image objects.
+        lang: Language code or list of codes, as for extract_text_from_image.
+        batch_size: Number of text crops per recognizer batch.
+        use_regions: Run the detector only on the text blocks found by
+                     text_regions, and not at all on blank pages.
+        target_text_height: Glyph height to shrink large text to for detection
+                            (see ocr_scale), or None to detect at full resolution.
+    Returns:
+        A list with one entry per page, each a list of (box, text, confidence)
+        tuples in reading order. box holds the four [x, y] corners in page pixels.
+    Raises:
+        RuntimeError if the reader cannot be initialized.
+    """
+    lang_list = [lang] if not isinstance(lang, list) else lang
+    reader = _initialize_reader(lang_list) # Imports EasyOCR if needed
+    import easyocr
+    from easyocr.recognition import get_text
+    from easyocr.utils import get_image_list, reformat_input
+    model_height = getattr(easyocr.easyocr, 'imgH', 64)
+
+    crops = [] # (page index, box, crop resized to the model height)
+    for page_index, pil_image in enumerate(pil_images):
+        page_array = _image_to_array(pil_image)
+        regions, scale = _plan_page(pil_image, use_regions, target_text_height)
+        for region in regions:
+            region_array, x0, y0 = _crop_array(page_array, region)
+            with instrumentation.stage('ocr_detect', width=region_array.shape[1], height=region_array.shape[0]) as timing:
+                img, img_cv_grey = reformat_input(region_array)
+                horizontal_list, free_list = _detect_boxes(reader, img, scale)
+                # Crops come from the full-resolution page, whatever size the detector saw
+                image_list, _ = get_image_list(horizontal_list, free_list, img_cv_grey,
+                                               model_height=model_height, sort_output=False)
+                timing.add(crops=len(image_list))
+            # Boxes are relative to the region; move them back into page coordinates
+            crops.extend((page_index, [[x + x0, y + y0] for x, y in box], crop) for box, crop in image_list)
+
+    # Similar widths in one batch means little padding per crop
+    crops.sort(key=lambda item: max(item[2].shape))
+    ignore_char = ''.join(set(reader.character) - set(reader.lang_char))
+
+    page_lines = [[] for _ in pil_images]
+    for start in range(0, len(crops), batch_size):
+        batch = crops[start:start + batch_size]
+        max_width = math.ceil(max(max(crop.shape) for _, _, crop in batch) / model_height) * model_height
+        with instrumentation.stage('ocr_recognize', crops=len(batch)):
+            recognized = get_text(reader.character, model_height, int(max_width), reader.recognizer,
+                                  reader.converter, [(box, crop) for _, box, crop in batch],
+                                  ignore_char, 'greedy', 5, batch_size, 0.1, 0.5, 0.003, 0, reader.device)
+        for (page_index, _, _), (box, text, confidence) in zip(batch, recognized):
+            box = [[int(x), int(y)] for x, y in box]
+            page_lines[page_index].append((box, text, float(confidence)))
+
+    for lines in page_lines:
+        lines.sort(key=lambda line: line[0][0][1]) # sort by vertical position
+    return page_lines
+
+
+def lines_to_text(lines):
+    """Joins OCR lines into paragraphs, the same way readtext(paragraph=True) does."""
+    from easyocr.utils import get_paragraph
+    paragraphs = get_paragraph([list(line) for line in lines], x_ths=1.0, y_ths=0.5, mode='ltr')
+    return "\n".join(text for _, text in paragraphs).strip()
@@ -0,0 +1,100 @@
+# page_archive.py
+"""
+Single-file archives of cleaned pages, for handing a whole batch on as one document.
+
+  - .tif / .tiff: a multi-page TIFF with one bilevel frame per page, CCITT
+    Group 4 compressed by default (the fax and document scanner format, which
+    any document viewer opens). On cleaned notes it is about 20% smaller than
+    the 1-bit PNGs.
+  - .zip: the page PNGs as they are, stored without recompressing them.
+
+batch_processor.run_folder adds every cleaned page of a run to the archive,
+in input order, as the pages are cleaned (see its archive option and --archive).
+"""
+import io
+import os
+import zipfile
+
+from PIL import Image, TiffImagePlugin
+
+ARCHIVE_EXTENSIONS = ('.tif', '.tiff', '.zip')
+TIFF_COMPRESSIONS = ('group4', 'group3', 'tiff_lzw', 'tiff_adobe_deflate', 'packbits', 'raw')
+DEFAULT_TIFF_COMPRESSION = 'group4'
+PAGE_NAME_TAG = 285 # TIFF PageName, holds the file name of each page
+
+
+class TiffArchive:
+    """Appends pages to a multi-page bilevel TIFF as they are added."""
+
+    def __init__(self, path, compression=DEFAULT_TIFF_COMPRESSION):
+        if compression not in TIFF_COMPRESSIONS:
+            raise ValueError(f"Unknown TIFF compression '{compression}'. Available: {', '.join(TIFF_COMPRESSIONS)}")
+        self.path = path
+        self.compression = compression
+        self.page_count = 0
+        self._writer = TiffImagePlugin.AppendingTiffWriter(path, new=True)
+
+    def add_page(self, image_path, name=None):
+        """Adds the image at image_path as the next frame; anything but pure black and white is thresholded."""
+        self._add(image_path, name or os.path.basename(image_path))
+
+    def add_png(self, data, name):
+        """Like add_page, for a page that is in memory as PNG bytes."""
+        self._add(io.BytesIO(data), name)
+
+    def _add(self, source, name):
+        with Image.open(source) as page:
+            if page.mode != '1':
+                page = page.convert('L').convert('1', dither=Image.Dither.NONE)
+            page.save(self._writer, format='TIFF', compression=self.compression, tiffinfo={PAGE_NAME_TAG: name})
+        self._writer.newFrame()
+        self.page_count += 1
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ZipArchive:
+    """Stores the page files in a ZIP archive without compressing them again."""
+
+    def __init__(self, path):
+        self.path = path
+        self.page_count = 0
+        self._zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+
+    def add_page(self, image_path, name=None):
+        self._zip.write(image_path, name or os.path.basename(image_path))
+        self.page_count += 1
+
+    def add_png(self, data, name):
+        """Like add_page, for a page that is in memory as PNG bytes."""
+        self._zip.writestr(name, data)
+        self.page_count += 1
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_archive(path, compression=DEFAULT_TIFF_COMPRESSION):
+    """
+    Creates (or overwrites) the archive at path, a TiffArchive or ZipArchive
+    depending on its extension. compression only applies to TIFFs.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.tif', '.tiff'):
+        return TiffArchive(path, compression)
+    if ext == '.zip':
+        return ZipArchive(path)
+    raise ValueError(f"Unsupported archive type '{ext}'. Use one of: {', '.join(ARCHIVE_EXTENSIONS)}")
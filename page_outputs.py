@@ -0,0 +1,87 @@
+# page_outputs.py
+"""
+Where a batch puts the outputs of each page, and the record of how a page went.
+Shared by batch_processor.py and pipeline.py (which batch_processor runs), so
+neither has to import the other for them.
+"""
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+
+import ocr_processor
+
+
+@dataclass
+class PageResult:
+    """Outcome of processing a single source image."""
+    source_path: str
+    output_path: str = None
+    error: str = None
+    source_hash: str = None # Content hash of the source file, when it was read
+    duplicate_of: str = None # Page whose outputs this near-duplicate links to
+    encoded: bytes = field(default=None, repr=False) # Cleaned PNG, when kept in memory for an archive
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def output_path_for(image_path, output_dir):
+    """Returns the path the cleaned version of image_path is saved to."""
+    base, _ = os.path.splitext(os.path.basename(image_path))
+    return os.path.join(output_dir, f"{base}_cleaned.png") # Always save as PNG for cleaned
+
+
+def ocr_sidecar_paths(image_path, output_dir):
+    """Returns the (text, json) sidecar paths for the OCR result of image_path."""
+    base, _ = os.path.splitext(os.path.basename(image_path))
+    return os.path.join(output_dir, f"{base}.txt"), os.path.join(output_dir, f"{base}.json")
+
+
+def write_output(path, data):
+    """
+    Writes data (bytes or str) to path through a temporary file and os.replace.
+    Outputs of near-duplicate pages may be hard links to each other (see
+    batch_processor.link_output); replacing the name instead of writing into
+    the file keeps rewriting one page from changing the others.
+    """
+    tmp_path = path + '.tmp'
+    try:
+        if isinstance(data, str):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        else:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def copy_output(src, path):
+    """Copies src to path the way write_output writes, without reading it all into memory."""
+    tmp_path = path + '.tmp'
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_ocr_sidecars(image_path, output_dir, lang, lines):
+    """Writes the .txt and .json OCR sidecars for image_path and returns the text path."""
+    text = ocr_processor.lines_to_text(lines)
+    text_path, json_path = ocr_sidecar_paths(image_path, output_dir)
+    write_output(text_path, text)
+    write_output(json_path, json.dumps({
+        'source': image_path,
+        'lang': lang,
+        'text': text,
+        'lines': [{'text': t, 'confidence': conf, 'box': box} for box, t, conf in lines],
+    }, ensure_ascii=False, indent=2))
+    return text_path
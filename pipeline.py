@@ -0,0 +1,291 @@
+# pipeline.py
+"""
+Stage-overlapping streaming pipeline for batch runs.
+
+Every page goes read -> clean -> save -> OCR, but each stage runs on its own
+threads and the stages are connected by bounded queues:
+  - read:  I/O threads loading the file bytes
+  - clean: threads decoding and thresholding (OpenCV releases the GIL, so they run in parallel)
+  - save:  threads encoding and writing the cleaned PNG
+  - ocr:   a few workers sharing one warm reader, grouping pages into recognizer batches
+While OCR works on one group of pages, the next ones are already being read,
+cleaned and saved. The bounded queues give backpressure: a fast stage blocks
+instead of piling up decoded pages, so memory stays flat.
+"""
+import io
+import os
+import queue
+import threading
+from dataclasses import dataclass
+
+from PIL import Image
+
+import bg_rem
+import instrumentation
+import ocr_processor
+import page_outputs
+import result_cache
+
+_DONE = object() # End-of-stream marker; every worker of a stage consumes exactly one
+
+
+@dataclass
+class _Page:
+    """A page travelling through the pipeline. Large buffers are dropped as soon as they are used."""
+    source_path: str
+    data: bytes = None # Encoded source file
+    source_hash: str = None
+    cache_key: str = None
+    encoded: bytes = None # Cleaned PNG (from the cache or the save stage)
+    kept: bytes = None # The cleaned PNG, once saved, when the caller wants it back (keep_encoded)
+    image: object = None # Cleaned OpenCV image; after saving, a PIL image (usually 1-bit) for OCR
+    output_path: str = None
+    output_hash: str = None
+    ocr_result: object = None
+    error: str = None
+
+
+def _fail_pages(pages, message):
+    for page in pages:
+        page.error = message
+
+
+def _start_stage(name, func, workers, in_queue, out_queue, next_workers, stop, group_size=1,
+                 on_error=_fail_pages):
+    """
+    Starts worker threads that call func(list_of_pages) on up to group_size
+    pages at a time. Pages that already failed are passed through untouched,
+    and once the stop event is set all pages are, so the queues drain quickly.
+    If func raises, on_error(pages, message) records the failure on the group,
+    so a worker never dies with pages (or end markers) still owed downstream.
+    When the last worker finishes, next_workers end markers are sent on.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            finished = False
+            while not finished:
+                first = in_queue.get()
+                if first is _DONE:
+                    break
+                group = [first]
+                while len(group) < group_size:
+                    try:
+                        page = in_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if page is _DONE:
+                        finished = True
+                        break
+                    group.append(page)
+
+                todo = [page for page in group if page.error is None] if not stop.is_set() else []
+                try:
+                    if todo:
+                        func(todo)
+                except Exception as e:
+                    on_error(todo, str(e))
+                finally:
+                    for page in group:
+                        out_queue.put(page)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(next_workers):
+                    out_queue.put(_DONE)
+
+    for i in range(workers):
+        threading.Thread(target=worker, name=f"pipeline-{name}-{i}", daemon=True).start()
+
+
+def _per_page(func):
+    """Wraps a one-page stage function so an error only fails that page."""
+    def run(pages):
+        for page in pages:
+            try:
+                func(page)
+            except Exception as e:
+                page.error = str(e)
+    return run
+
+
+def iter_pipeline(image_paths, output_dir, read_workers=2, clean_workers=None, save_workers=2,
+                  ocr_workers=1, queue_size=8, ocr_options=None, block_size=21, c_value=10,
+                  fast_decode=True, cache=None, engine=bg_rem.DEFAULT_ENGINE, bit_depth=bg_rem.DEFAULT_PNG_BIT_DEPTH,
+                  compress_level=bg_rem.DEFAULT_PNG_COMPRESS_LEVEL, max_tile_bytes=None, keep_encoded=False,
+                  write_png=True):
+    """
+    Processes image_paths with all stages overlapping and yields, in completion
+    order, a (clean_result, ocr_result) pair of page_outputs.PageResults per
+    page. ocr_result is None when OCR is off or the page could not be cleaned.
+    Args:
+        read_workers, clean_workers, save_workers, ocr_workers: Threads per stage.
+                 clean_workers defaults to the CPU count. EasyOCR readers are not
+                 documented as thread-safe, so keep ocr_workers at 1 unless verified.
+        queue_size: Capacity of each queue between stages (bounds memory use).
+        ocr_options: dict with 'lang', optionally 'pages_per_batch', 'batch_size',
+                     'use_regions' and 'target_text_height', or None to only clean.
+        block_size, c_value, fast_decode, cache, engine, bit_depth, compress_level, max_tile_bytes,
+        keep_encoded, write_png:
+                 As for batch_processor.clean_image_file. With max_tile_bytes the cleaning
+                 runs in bands, but the cleaned page is still held whole for saving and OCR.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    clean_workers = clean_workers or os.cpu_count() or 1
+    if ocr_options:
+        lang = ocr_options.get('lang', 'en')
+        pages_per_batch = ocr_options.get('pages_per_batch', 8)
+        batch_size = ocr_options.get('batch_size', 32)
+        use_regions = ocr_options.get('use_regions', True)
+        target_text_height = ocr_options.get('target_text_height', ocr_processor.TARGET_TEXT_HEIGHT)
+        ocr_workers = max(1, ocr_workers)
+    else:
+        ocr_workers = 0
+
+    def read(page):
+        with instrumentation.stage('read') as timing:
+            with open(page.source_path, 'rb') as f:
+                page.data = f.read()
+            page.source_hash = result_cache.hash_bytes(page.data)
+            timing.add(bytes_read=len(page.data))
+        if cache is not None:
+            page.cache_key = result_cache.clean_key(page.source_hash, block_size, c_value, engine,
+                                                    decode='gray' if fast_decode else 'rgb',
+                                                    depth=bit_depth, level=compress_level)
+            cached_path = cache.get_image_path(page.cache_key)
+            if cached_path is not None:
+                instrumentation.event('result_cache', hits=1)
+                with open(cached_path, 'rb') as f:
+                    page.encoded = f.read()
+                page.data = None
+            else:
+                instrumentation.event('result_cache', misses=1)
+
+    def clean(page):
+        if page.encoded is not None:
+            if ocr_workers: # Cached result, but OCR still needs the pixels
+                page.image = Image.open(io.BytesIO(page.encoded))
+                page.image.load()
+            return
+        if max_tile_bytes:
+            with Image.open(io.BytesIO(page.data)) as pil_img:
+                if fast_decode and pil_img.format == 'JPEG':
+                    pil_img.draft('L', pil_img.size) # Keep the decoded source at one byte per pixel
+                page.image = bg_rem.remove_background_banded(pil_img, block_size, c_value, max_tile_bytes, engine)
+            page.data = None
+            return
+        if fast_decode:
+            gray_image = bg_rem.load_gray(page.data)
+        else:
+            with Image.open(io.BytesIO(page.data)) as pil_img:
+                gray_image = bg_rem.pil_to_gray(pil_img)
+        page.data = None
+        page.image = bg_rem.remove_background(gray_image, block_size=block_size, c_value=c_value, engine=engine)
+
+    def save(page):
+        page.output_path = page_outputs.output_path_for(page.source_path, output_dir)
+        fresh = page.encoded is None
+        with instrumentation.stage('encode' if fresh else 'write') as timing:
+            if fresh:
+                # Same encoder as clean_image_file, so both paths produce identical files
+                page.encoded = bg_rem.encode_png(page.image, bit_depth, compress_level)
+                timing.add(width=page.image.shape[1], height=page.image.shape[0])
+            if write_png:
+                page_outputs.write_output(page.output_path, page.encoded)
+                timing.add(bytes_written=len(page.encoded))
+        page.output_hash = result_cache.hash_bytes(page.encoded)
+        if fresh and cache is not None:
+            cache.put_png(page.cache_key, page.encoded)
+        if keep_encoded:
+            page.kept = page.encoded
+        page.encoded = None
+        if not ocr_workers:
+            page.image = None
+        elif fresh:
+            # Pages waiting for OCR are held packed, 8 pixels per byte
+            page.image = bg_rem.to_bilevel(page.image)
+
+    def ocr(pages):
+        todo = []
+        for page in pages:
+            key = result_cache.ocr_key(page.output_hash, lang, regions=use_regions,
+                                       text_height=target_text_height) if cache is not None else None
+            cached = cache.get_lines(key) if key else None
+            if cached is not None:
+                _finish_ocr(page, cached)
+            else:
+                todo.append((page, key))
+        if todo:
+            try:
+                page_lines = ocr_processor.extract_lines_from_images(
+                    [page.image for page, _ in todo], lang=lang, batch_size=batch_size,
+                    use_regions=use_regions, target_text_height=target_text_height)
+            except Exception as e:
+                for page, _ in todo:
+                    page.ocr_result = page_outputs.PageResult(page.output_path, error=f"OCR failed: {e}")
+                    page.image = None
+                return
+            for (page, key), lines in zip(todo, page_lines):
+                _finish_ocr(page, lines)
+                if key and page.ocr_result.ok:
+                    try:
+                        cache.put_lines(key, lines)
+                    except OSError as e: # The sidecars are written; only the cache entry is missing
+                        print(f"Could not cache the OCR result of {page.output_path}: {e}")
+
+    def fail_ocr(pages, message):
+        for page in pages:
+            if page.ocr_result is None:
+                page.ocr_result = page_outputs.PageResult(page.output_path, error=f"OCR failed: {message}")
+            page.image = None
+
+    def _finish_ocr(page, lines):
+        try:
+            text_path = page_outputs.write_ocr_sidecars(page.output_path, output_dir, lang, lines)
+            page.ocr_result = page_outputs.PageResult(page.output_path, text_path, source_hash=page.output_hash)
+        except Exception as e:
+            page.ocr_result = page_outputs.PageResult(page.output_path, error=str(e))
+        page.image = None
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(5 if ocr_workers else 4)]
+    stop = threading.Event() # Set when the consumer stops early; the stages then only pass pages on
+    _start_stage('read', _per_page(read), read_workers, queues[0], queues[1], clean_workers, stop)
+    _start_stage('clean', _per_page(clean), clean_workers, queues[1], queues[2], save_workers, stop)
+    if ocr_workers:
+        _start_stage('save', _per_page(save), save_workers, queues[2], queues[3], ocr_workers, stop)
+        _start_stage('ocr', ocr, ocr_workers, queues[3], queues[4], 1, stop, group_size=pages_per_batch,
+                     on_error=fail_ocr)
+    else:
+        _start_stage('save', _per_page(save), save_workers, queues[2], queues[3], 1, stop)
+
+    def feed():
+        for path in image_paths:
+            if stop.is_set():
+                break
+            queues[0].put(_Page(path))
+        for _ in range(read_workers):
+            queues[0].put(_DONE)
+    threading.Thread(target=feed, name="pipeline-feed", daemon=True).start()
+
+    finished = False
+    try:
+        while True:
+            page = queues[-1].get()
+            if page is _DONE:
+                finished = True
+                return
+            clean_result = page_outputs.PageResult(
+                page.source_path, None if page.error or not write_png else page.output_path, page.error,
+                page.source_hash, encoded=page.kept)
+            yield clean_result, page.ocr_result
+    finally:
+        if not finished:
+            # The consumer stopped early (break or exception). Without draining, the stage
+            # threads would stay blocked on full queues for good.
+            stop.set()
+            while queues[-1].get() is not _DONE:
+                pass
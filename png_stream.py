@@ -0,0 +1,105 @@
+# png_stream.py
+"""
+Minimal streaming PNG writer.
+
+PIL can only save an image it holds completely in memory. This writer takes
+rows band by band and compresses them as they arrive, so very large pages can
+be written without ever materializing the full output. Rows are stored as
+8-bit gray or, for black-and-white pages, packed to 1 bit per pixel.
+The PNG is written next to its path and only moved there once complete, so an
+existing file at that path (or a hard link to it) is never written into. A
+binary file object can be given instead of a path, to write into it directly.
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class PngStripWriter:
+    """
+    Writes a grayscale PNG from consecutive bands of rows.
+    With bit_depth 1 every non-zero pixel becomes white.
+    Usage:
+        with PngStripWriter(path, width, height) as writer:
+            for band in bands:
+                writer.write_rows(band)
+    """
+
+    def __init__(self, path, width, height, compress_level=6, bit_depth=8):
+        if bit_depth not in (1, 8):
+            raise ValueError(f"bit_depth must be 1 or 8, got {bit_depth}")
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.rows_written = 0
+        self._row_bytes = (width * bit_depth + 7) // 8
+        self.path = path
+        if isinstance(path, str):
+            self._tmp_path = path + '.tmp'
+            self._file = open(self._tmp_path, 'wb')
+        else:
+            self._tmp_path = None
+            self._file = path
+        self._compressor = zlib.compressobj(compress_level)
+        self._file.write(PNG_SIGNATURE)
+        # IHDR: width, height, bit depth, color type 0 (gray), deflate, adaptive filtering, no interlace
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, 0, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+    def write_rows(self, rows):
+        """Appends a (n, width) uint8 array of rows."""
+        rows = np.asarray(rows, dtype=np.uint8)
+        if rows.ndim != 2 or rows.shape[1] != self.width:
+            raise ValueError(f"Expected rows of width {self.width}, got shape {rows.shape}")
+        if self.rows_written + rows.shape[0] > self.height:
+            raise ValueError("More rows written than the declared image height.")
+        if self.bit_depth == 1:
+            rows = np.packbits(rows != 0, axis=1) # First pixel in the high bit, rows padded to whole bytes
+        # Every PNG scanline starts with its filter type; 0 means "None"
+        scanlines = np.zeros((rows.shape[0], self._row_bytes + 1), dtype=np.uint8)
+        scanlines[:, 1:] = rows
+        data = self._compressor.compress(scanlines.tobytes())
+        if data:
+            self._write_chunk(b'IDAT', data)
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self._compressor is None: # Already closed or discarded
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"PNG declared {self.height} rows but {self.rows_written} were written.")
+            self._write_chunk(b'IDAT', self._compressor.flush())
+            self._write_chunk(b'IEND', b'')
+        except Exception:
+            self._discard()
+            raise
+        self._compressor = None
+        if self._tmp_path is not None:
+            self._file.close()
+            os.replace(self._tmp_path, self.path)
+
+    def _discard(self):
+        self._compressor = None
+        if self._tmp_path is not None:
+            self._file.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard() # The caller is already handling an error; leave any old file alone
@@ -0,0 +1,121 @@
+# preview.py
+"""
+Preview subsystem for the GUI image panes.
+
+Showing a 40-megapixel photo by resizing it on the Tk thread freezes the
+window. Instead, each image gets a small pyramid of downscaled copies, built
+once on a worker thread (JPEGs are decoded at reduced size directly), and every
+redisplay only resizes the nearest pyramid level, also off the Tk thread.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+BASE_SIZE = 1600 # Longest side of the largest pyramid level
+MIN_LEVEL_SIZE = 256 # Pyramid levels stop once they get this small
+DISPLAY_MODES = ('RGB', 'RGBA', 'L') # Modes ImageTk handles directly
+
+
+def build_pyramid(source, base_size=BASE_SIZE):
+    """
+    Builds preview levels for an image, largest first.
+    Args:
+        source: Image file path, or a PIL image (which is left untouched).
+        base_size: Longest side of the largest level.
+    Returns:
+        List of PIL images, each half the size of the previous one.
+    """
+    if isinstance(source, Image.Image):
+        base = _downscale(source, base_size)
+    else:
+        with Image.open(source) as img:
+            # JPEG only: let the decoder scale down by up to 8x while decoding.
+            # The requested size must keep the aspect ratio, or the short side limits the scaling.
+            scale = base_size / max(img.size)
+            img.draft('RGB', (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+            base = _downscale(img, base_size)
+
+    if base.mode not in DISPLAY_MODES:
+        base = base.convert('RGB')
+    levels = [base]
+    while max(levels[-1].size) > MIN_LEVEL_SIZE:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def _downscale(img, base_size):
+    # reduce() is a cheap integer box filter; the final thumbnail then only
+    # works on an image at most twice the target size
+    factor = max(img.size) // base_size
+    base = img.reduce(factor) if factor > 1 else img.copy()
+    base.thumbnail((base_size, base_size), Image.BILINEAR)
+    return base
+
+
+def pick_level(levels, size):
+    """Returns the smallest level that still fills size=(width, height) when fitted into it."""
+    target_w, target_h = size
+    for level in reversed(levels):
+        if level.width >= target_w or level.height >= target_h:
+            return level
+    return levels[0]
+
+
+class PreviewCache:
+    """
+    Keeps preview pyramids for recently shown images and renders previews on
+    worker threads. Results are handed to a callback, still on the worker
+    thread; GUI code must marshal them to the Tk thread itself.
+    """
+
+    def __init__(self, max_images=32, max_workers=2):
+        self.max_images = max_images
+        self._pyramids = OrderedDict() # key -> levels, oldest first
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preview')
+
+    def _get_pyramid(self, key, source):
+        with self._lock:
+            if key in self._pyramids:
+                self._pyramids.move_to_end(key)
+                return self._pyramids[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock: # Don't build the same pyramid twice (e.g. prefetch + display)
+            with self._lock:
+                if key in self._pyramids:
+                    return self._pyramids[key]
+            levels = build_pyramid(source)
+            with self._lock:
+                self._pyramids[key] = levels
+                while len(self._pyramids) > self.max_images:
+                    old_key, _ = self._pyramids.popitem(last=False)
+                    self._key_locks.pop(old_key, None)
+            return levels
+
+    def _render(self, key, source, size, callback):
+        try:
+            preview = pick_level(self._get_pyramid(key, source), size).copy()
+            preview.thumbnail(size, Image.LANCZOS)
+            callback(preview)
+        except Exception as e:
+            print(f"Preview error for {key}: {e}") # Log to console; the pane keeps its old content
+
+    def request(self, key, source, size, callback):
+        """
+        Renders a preview of source fitting size=(width, height) and calls
+        callback(pil_image) with it. key identifies the image in the cache.
+        """
+        self._executor.submit(self._render, key, source, size, callback)
+
+    def prefetch(self, key, source):
+        """Builds the pyramid for an image that is likely to be shown soon."""
+        self._executor.submit(self._get_pyramid, key, source)
+
+    def discard(self, key):
+        with self._lock:
+            self._pyramids.pop(key, None)
+            self._key_locks.pop(key, None)
@@ -0,0 +1,217 @@
+# result_cache.py
+"""
+Persistent, content-addressed cache for cleaned images and OCR results.
+
+Entries are keyed by a hash of the source image bytes plus the processing
+parameters, so an unchanged page processed with unchanged settings is never
+decoded, thresholded or OCRed twice. The cache lives in a plain folder; file
+modification times double as "last used" stamps for LRU eviction, which keeps
+it usable from several worker processes at once. Only the process that created
+a ResultCache keeps track of its size and evicts; copies pickled into worker
+processes count what they add, for their owner to account().
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import cv2
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'NOTES_DIGITIZER_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'notes_digitizer'),
+)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3 # 2 GiB
+
+
+def hash_bytes(data):
+    """Returns the hex digest used to address content."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Hashes a file's contents without loading it all into memory."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """On-disk cache with a size cap and least-recently-used eviction."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size = None # Bytes in the cache, computed on the first write
+        self._owner = True # False in copies pickled into other processes
+        self.unaccounted_bytes = 0 # Added by a copy, not yet passed to its owner's account()
+
+    def __getstate__(self):
+        # Copies sent to worker processes must not each scan the whole cache on their first write
+        return dict(self.__dict__, _size=None, _owner=False, unaccounted_bytes=0)
+
+    @staticmethod
+    def make_key(source_hash, kind, **params):
+        """
+        Builds a cache key.
+        Args:
+            source_hash: Hash of the source image bytes (see hash_file/hash_bytes).
+            kind: What is stored, e.g. 'clean' or 'ocr'.
+            params: Every processing parameter that influences the result.
+        """
+        payload = json.dumps([source_hash, kind, params], sort_keys=True)
+        return hash_bytes(payload.encode('utf-8'))
+
+    def _path(self, key, ext):
+        # Two-level layout keeps directories small on huge archives
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def _hit(self, path):
+        """Returns path if it is cached, marking it as recently used."""
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def _store(self, path, write):
+        """Atomically writes an entry through write(file_object)."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._account(os.path.getsize(path))
+
+    # --- Cleaned images (stored as PNG) ---
+
+    def get_image_path(self, key):
+        """Returns the path of the cached PNG for key, or None."""
+        return self._hit(self._path(key, '.png'))
+
+    def get_image(self, key):
+        """Returns the cached cleaned image as an OpenCV grayscale array, or None."""
+        path = self.get_image_path(key)
+        if path is None:
+            return None
+        return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+    def put_image(self, key, cv_image, bilevel=False):
+        """Caches a cleaned image; bilevel stores a black-and-white one at 1 bit per pixel."""
+        ok, encoded = cv2.imencode('.png', cv_image, [cv2.IMWRITE_PNG_BILEVEL, 1] if bilevel else [])
+        if not ok:
+            raise ValueError("Could not encode image for the cache.")
+        self._store(self._path(key, '.png'), lambda f: f.write(encoded.tobytes()))
+
+    def put_png(self, key, data):
+        """Caches PNG bytes that are already encoded."""
+        self._store(self._path(key, '.png'), lambda f: f.write(data))
+
+    def put_image_file(self, key, png_path):
+        """Caches an already encoded PNG file without decoding it."""
+        def write(f):
+            with open(png_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+        self._store(self._path(key, '.png'), write)
+
+    # --- OCR results (stored as JSON) ---
+
+    def get_json(self, key):
+        path = self._hit(self._path(key, '.json'))
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None # Treat unreadable entries as misses
+
+    def put_json(self, key, value):
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        self._store(self._path(key, '.json'), lambda f: f.write(data))
+
+    def get_text(self, key):
+        """Returns the cached OCR text for key, or None (also for entries of another kind)."""
+        value = self.get_json(key)
+        text = value.get('text') if isinstance(value, dict) else None
+        return text if isinstance(text, str) else None
+
+    def put_text(self, key, text):
+        self.put_json(key, {'text': text})
+
+    def get_lines(self, key):
+        """Returns the cached OCR lines for key, or None (also for entries of another kind)."""
+        value = self.get_json(key)
+        lines = value.get('lines') if isinstance(value, dict) else None
+        return lines if isinstance(lines, list) else None
+
+    def put_lines(self, key, lines):
+        self.put_json(key, {'lines': lines})
+
+    # --- Size accounting and eviction ---
+
+    def _entries(self):
+        """Yields (mtime, size, path) for every cache entry."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    yield stat.st_mtime, stat.st_size, entry.path
+
+    def account(self, added_bytes):
+        """Adds bytes a copy in a worker process wrote (its unaccounted_bytes), evicting if needed."""
+        self._account(added_bytes)
+
+    def _account(self, added_bytes):
+        if not self._owner:
+            self.unaccounted_bytes += added_bytes
+            return
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += added_bytes
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache is below 90% of max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9) if self.max_bytes is not None else total
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass # Already removed by another process
+        self._size = total
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self._size = 0
+
+
+def clean_key(source_hash, block_size, c_value, engine='gaussian', **params):
+    """Key of the remove_background output for a source image; params hold any further settings."""
+    return ResultCache.make_key(source_hash, 'clean', block_size=block_size, c_value=c_value, engine=engine, **params)
+
+
+def ocr_key(image_hash, lang, **params):
+    """Key of the OCR result for an image; params describe any preprocessing applied first."""
+    lang_list = [lang] if not isinstance(lang, list) else lang
+    return ResultCache.make_key(image_hash, 'ocr', lang=sorted(set(lang_list)), **params)
+
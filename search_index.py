@@ -0,0 +1,320 @@
+# search_index.py
+"""
+Full-text search over OCR results, with the position of every hit.
+
+OCR sidecars (the .json files written next to the cleaned pages, see
+batch_processor.write_ocr_sidecars) are loaded into a SQLite database:
+    documents  one per output folder (a notebook or batch)
+    pages      one per OCRed page: sidecar and image path, language
+    lines      one per recognized line: text, confidence and bounding box
+    lines_fts  FTS5 index over the line texts, ranked with bm25
+Batch runs add pages as their OCR finishes (see run_folder's index argument);
+index_folder catches up on a whole folder and skips sidecars that have not
+changed since they were indexed.
+
+    python search_index.py index OUTPUT_FOLDER
+    python search_index.py search "quadratic formula" --limit 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+import instrumentation
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    'NOTES_DIGITIZER_INDEX',
+    os.path.join(os.path.expanduser('~'), '.local', 'share', 'notes_digitizer', 'search.sqlite'),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    sidecar_path TEXT NOT NULL UNIQUE,
+    image_path TEXT,
+    lang TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    indexed_at REAL
+);
+CREATE INDEX IF NOT EXISTS pages_document ON pages(document_id);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    page_id INTEGER NOT NULL REFERENCES pages(id),
+    line_no INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    confidence REAL,
+    x0 INTEGER, y0 INTEGER, x1 INTEGER, y1 INTEGER
+);
+CREATE INDEX IF NOT EXISTS lines_page ON lines(page_id);
+-- External content table: the text is stored once, in lines; the triggers keep the index in step
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(
+    text, content='lines', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS lines_ai AFTER INSERT ON lines BEGIN
+    INSERT INTO lines_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS lines_ad AFTER DELETE ON lines BEGIN
+    INSERT INTO lines_fts(lines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+@dataclass
+class SearchHit:
+    """One matching line."""
+    document: str # Folder the page belongs to
+    image_path: str
+    sidecar_path: str
+    line_no: int
+    text: str
+    snippet: str # The line with the matched terms in [brackets]
+    confidence: float
+    box: tuple # (x0, y0, x1, y1) in page pixels
+    score: float # bm25; lower is better
+
+
+def match_expression(query):
+    """
+    Turns plain search words into an FTS5 query matching lines that contain
+    all of them. Words are quoted, so punctuation can't cause syntax errors;
+    a trailing * keeps its prefix-search meaning.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def _bounding_box(box):
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))
+
+
+def _load_sidecar(sidecar_path):
+    """Returns the parsed sidecar, or None if the file is not an OCR sidecar."""
+    try:
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('lines'), list):
+        return None
+    return data
+
+
+class SearchIndex:
+    """
+    The SQLite search database. One instance can be shared between threads;
+    several processes can use the same file (WAL mode, writes wait for each other).
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _document_id(self, folder):
+        self._conn.execute("INSERT OR IGNORE INTO documents(path) VALUES (?)", (folder,))
+        return self._conn.execute("SELECT id FROM documents WHERE path = ?", (folder,)).fetchone()[0]
+
+    def _delete_page(self, page_id):
+        self._conn.execute("DELETE FROM lines WHERE page_id = ?", (page_id,))
+        self._conn.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+
+    def add_page(self, sidecar_path, data=None):
+        """
+        Indexes (or re-indexes) the page of an OCR sidecar.
+        Args:
+            sidecar_path: Path of the .json sidecar.
+            data: Its parsed contents, if the caller already has them.
+        Returns:
+            The number of lines indexed, or None if the file is not an OCR sidecar.
+        """
+        sidecar_path = os.path.abspath(sidecar_path)
+        if data is None:
+            data = _load_sidecar(sidecar_path)
+            if data is None:
+                return None
+        stat = os.stat(sidecar_path)
+        rows = []
+        for line_no, line in enumerate(data['lines']):
+            x0, y0, x1, y1 = _bounding_box(line['box'])
+            rows.append((line_no, line['text'], line.get('confidence'), x0, y0, x1, y1))
+
+        with instrumentation.stage('index', lines=len(rows)), self._lock, self._conn:
+            document_id = self._document_id(os.path.dirname(sidecar_path))
+            old = self._conn.execute("SELECT id FROM pages WHERE sidecar_path = ?", (sidecar_path,)).fetchone()
+            if old is not None:
+                self._delete_page(old[0])
+            lang = data.get('lang')
+            page_id = self._conn.execute(
+                "INSERT INTO pages(document_id, sidecar_path, image_path, lang, mtime_ns, size, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (document_id, sidecar_path, data.get('source'), ','.join(lang) if isinstance(lang, list) else lang,
+                 stat.st_mtime_ns, stat.st_size, time.time()),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO lines(page_id, line_no, text, confidence, x0, y0, x1, y1) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(page_id,) + row for row in rows],
+            )
+        return len(rows)
+
+    def remove_page(self, sidecar_path):
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT id FROM pages WHERE sidecar_path = ?",
+                                     (os.path.abspath(sidecar_path),)).fetchone()
+            if old is not None:
+                self._delete_page(old[0])
+
+    def index_folder(self, folder):
+        """
+        Brings the index up to date with the OCR sidecars in folder: new and
+        changed ones are (re)indexed, removed ones dropped.
+        Returns:
+            (indexed, unchanged, removed) page counts.
+        """
+        folder = os.path.abspath(folder)
+        with self._lock:
+            known = {path: (mtime_ns, size) for path, mtime_ns, size in self._conn.execute(
+                "SELECT p.sidecar_path, p.mtime_ns, p.size FROM pages p JOIN documents d ON d.id = p.document_id "
+                "WHERE d.path = ?", (folder,))}
+
+        indexed = unchanged = 0
+        present = set()
+        for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+            if not entry.is_file() or not entry.name.lower().endswith('.json'):
+                continue
+            present.add(entry.path)
+            stat = entry.stat()
+            if known.get(entry.path) == (stat.st_mtime_ns, stat.st_size):
+                unchanged += 1
+            elif self.add_page(entry.path) is not None:
+                indexed += 1
+
+        removed = [path for path in known if path not in present]
+        for path in removed:
+            self.remove_page(path)
+        return indexed, unchanged, len(removed)
+
+    def search(self, query, limit=20, document=None, raw=False):
+        """
+        Finds the lines matching query, best first.
+        Args:
+            query: Words that must all occur in a line (a trailing * searches
+                   by prefix), or an FTS5 query expression if raw is set.
+            limit: Maximum number of hits.
+            document: Only search pages of this folder.
+        Returns:
+            List of SearchHit.
+        Raises:
+            ValueError for an invalid raw query.
+        """
+        expression = query if raw else match_expression(query)
+        if not expression:
+            return []
+        sql = ("SELECT d.path, p.image_path, p.sidecar_path, l.line_no, l.text, "
+               "snippet(lines_fts, 0, '[', ']', '...', 16), l.confidence, l.x0, l.y0, l.x1, l.y1, lines_fts.rank "
+               "FROM lines_fts JOIN lines l ON l.id = lines_fts.rowid "
+               "JOIN pages p ON p.id = l.page_id JOIN documents d ON d.id = p.document_id "
+               "WHERE lines_fts MATCH ?")
+        params = [expression]
+        if document is not None:
+            sql += " AND d.path = ?"
+            params.append(os.path.abspath(document))
+        sql += " ORDER BY lines_fts.rank LIMIT ?"
+        params.append(limit)
+        try:
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query {query!r}: {e}") from None
+        return [SearchHit(document_path, image_path, sidecar_path, line_no, text, snippet, confidence,
+                          (x0, y0, x1, y1), score)
+                for document_path, image_path, sidecar_path, line_no, text, snippet, confidence,
+                    x0, y0, x1, y1, score in rows]
+
+    def stats(self):
+        """Returns the number of documents, pages and lines in the index."""
+        with self._lock:
+            return {table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ('documents', 'pages', 'lines')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the text of OCRed note pages.")
+    parser.add_argument("--db", default=DEFAULT_INDEX_PATH, help="index database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="add or update the OCR results of output folders")
+    index_parser.add_argument("folders", nargs="+")
+
+    search_parser = commands.add_parser("search", help="find lines containing all the given words")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=20)
+    search_parser.add_argument("--document", metavar="FOLDER", help="only search pages in this output folder")
+    search_parser.add_argument("--raw", action="store_true", help="pass the query to FTS5 as it is (AND/OR/NEAR, ...)")
+    search_parser.add_argument("--json", action="store_true", help="print the hits as JSON lines")
+
+    commands.add_parser("stats", help="show the size of the index")
+    args = parser.parse_args(argv)
+
+    with SearchIndex(args.db) as index:
+        if args.command == "index":
+            for folder in args.folders:
+                indexed, unchanged, removed = index.index_folder(folder)
+                print(f"{folder}: {indexed} pages indexed, {unchanged} unchanged, {removed} removed.")
+        elif args.command == "search":
+            start = time.perf_counter()
+            try:
+                hits = index.search(args.query, limit=args.limit, document=args.document, raw=args.raw)
+            except ValueError as e:
+                print(e)
+                return 1
+            elapsed = time.perf_counter() - start
+            for hit in hits:
+                if args.json:
+                    print(json.dumps(asdict(hit), ensure_ascii=False))
+                else:
+                    x0, y0, x1, y1 = hit.box
+                    print(f"{os.path.basename(hit.image_path or hit.sidecar_path)} line {hit.line_no + 1} "
+                          f"at ({x0},{y0})-({x1},{y1}): {hit.snippet}")
+            if not args.json:
+                print(f"{len(hits)} hits in {elapsed * 1000:.1f} ms.")
+        else:
+            stats = index.stats()
+            print(f"{stats['documents']} documents, {stats['pages']} pages, {stats['lines']} lines in {args.db}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,64 @@
+# test_autotune.py
+"""Tests for autotune; run with python -m pytest."""
+import cv2
+import numpy as np
+import pytest
+
+import autotune
+import bg_rem
+
+SWEPT_ENGINES = ('gaussian', 'mean', 'sauvola', 'niblack')
+
+
+def _shaded_page(width=700, height=500):
+    """A gray page with paper texture, a lighting gradient and some text."""
+    rng = np.random.default_rng(0)
+    page = cv2.GaussianBlur((rng.random((height, width)) * 255).astype(np.uint8), (0, 0), 3)
+    page = cv2.add(page, np.tile(np.linspace(0, 80, width).astype(np.uint8), (height, 1)))
+    for y in range(40, height, 40):
+        cv2.putText(page, "shaded notes 0123", (20, y), cv2.FONT_HERSHEY_SIMPLEX, 1, 20, 2)
+    return page
+
+
+@pytest.mark.parametrize('engine', SWEPT_ENGINES)
+def test_sweep_binaries_match_remove_background(engine):
+    page = _shaded_page()
+    prepare = autotune._binarizer_for(engine)
+    for block_size in (3, 21, 81):
+        binarize = prepare(page, block_size)
+        for c_value in (2, 7.5, 15):
+            expected = bg_rem.remove_background(page, block_size, c_value, engine)
+            assert np.array_equal(binarize(c_value), expected), (block_size, c_value)
+
+
+@pytest.mark.parametrize('engine', SWEPT_ENGINES)
+def test_crops_with_a_halo_match_the_full_page(engine):
+    page = _shaded_page()
+    block_size, c_value = 41, 10
+    halo = block_size // 2
+    y0, y1, x0, x1 = 100, 300, 150, 450
+    region = page[y0 - halo:y1 + halo, x0 - halo:x1 + halo]
+    crop = autotune._binarizer_for(engine)(region, block_size)(c_value)[halo:-halo, halo:-halo]
+    assert np.array_equal(crop, bg_rem.remove_background(page, block_size, c_value, engine)[y0:y1, x0:x1])
+
+
+def test_sauvola_threshold_is_computed_once_per_block_size(monkeypatch):
+    calls = []
+
+    def counting_threshold(gray_image, block_size):
+        calls.append(block_size)
+        return original(gray_image, block_size)
+    original = bg_rem.sauvola_threshold
+    monkeypatch.setattr(bg_rem, 'sauvola_threshold', counting_threshold)
+
+    block_sizes, c_values = (15, 31), (2, 6, 10, 20)
+    results = autotune.sweep([_shaded_page()], block_sizes, c_values, engine='sauvola')
+    assert len(results) == len(block_sizes) * len(c_values)
+    crops = len(autotune.select_crops(_shaded_page()))
+    assert sorted(calls) == sorted(list(block_sizes) * crops)
+
+
+def test_flatten_falls_back_to_the_engine():
+    assert autotune._binarizer_for('flatten') is None
+    results = autotune.sweep([_shaded_page()], (21,), (10, 20), engine='flatten')
+    assert {(r['block_size'], r['c_value']) for r in results} == {(21, 10), (21, 20)}
@@ -0,0 +1,59 @@
+# test_batch_manifest.py
+"""Tests for batch_manifest; run with python -m pytest."""
+import os
+
+import batch_manifest
+import result_cache
+from page_outputs import PageResult
+
+PARAMS = {'block_size': 21, 'c_value': 10, 'levels': (1, 2)}
+
+
+def _done(tmp_path, content=b'page'):
+    """A source file and its output, recorded as done; returns (manifest, source path)."""
+    source, output = tmp_path / 'a.png', tmp_path / 'a_cleaned.png'
+    source.write_bytes(content)
+    output.write_bytes(b'cleaned')
+    manifest = batch_manifest.BatchManifest(str(tmp_path / 'out'))
+    assert manifest.pending('clean', [str(source)], PARAMS) == [str(source)]
+    manifest.record('clean', PageResult(str(source), str(output), source_hash=result_cache.hash_file(str(source))), PARAMS)
+    return manifest, str(source)
+
+
+def test_finished_files_are_current_after_a_reload(tmp_path):
+    _, source = _done(tmp_path)
+    manifest = batch_manifest.BatchManifest(str(tmp_path / 'out'))
+    assert manifest.pending('clean', [source], dict(PARAMS, levels=[1, 2])) == [] # JSON turns tuples into lists
+    assert manifest.pending('ocr', [source], PARAMS) == [source]
+
+
+def test_changed_parameters_contents_or_missing_outputs_make_files_pending(tmp_path):
+    manifest, source = _done(tmp_path)
+    assert manifest.pending('clean', [source], dict(PARAMS, c_value=12)) == [source]
+
+    with open(source, 'wb') as f:
+        f.write(b'PAGE') # Same size, new contents
+    os.utime(source, ns=(1, 1))
+    assert manifest.pending('clean', [source], PARAMS) == [source]
+
+    (tmp_path / 'again').mkdir()
+    manifest, source = _done(tmp_path / 'again')
+    os.remove(tmp_path / 'again' / 'a_cleaned.png')
+    assert manifest.pending('clean', [source], PARAMS) == [source]
+
+
+def test_touched_but_unchanged_files_are_current(tmp_path):
+    manifest, source = _done(tmp_path)
+    os.utime(source, ns=(1, 1))
+    assert manifest.pending('clean', [source], PARAMS) == []
+    # The new mtime was recorded, so the next run does not hash the file again
+    assert batch_manifest.BatchManifest(str(tmp_path / 'out'))._records[('clean', source)]['mtime_ns'] == 1
+
+
+def test_errors_are_retried_and_a_torn_last_line_is_ignored(tmp_path):
+    manifest, source = _done(tmp_path)
+    manifest.record('clean', PageResult(source, error='broken'), PARAMS)
+    with open(manifest.path, 'a', encoding='utf-8') as f:
+        f.write('{"stage": "clean", "sou') # Interrupted while appending
+    manifest = batch_manifest.BatchManifest(str(tmp_path / 'out'))
+    assert manifest.pending('clean', [source], PARAMS) == [source]
@@ -0,0 +1,202 @@
+# test_batch_processor.py
+"""Tests for batch_processor; run with python -m pytest."""
+import os
+import shutil
+import threading
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import batch_manifest
+import batch_processor
+import bg_rem
+import page_outputs
+import pipeline
+import result_cache
+
+
+def _write_page(path, seed):
+    """Saves a photo-like gray page with random lines of text; equal seeds give equal pages."""
+    rng = np.random.default_rng(seed)
+    page = np.full((1000, 800), 235, dtype=np.uint8)
+    for y in range(80, 950, 45):
+        text = ''.join(rng.choice(list('abcdefghijk '), 30))
+        cv2.putText(page, text, (40, y), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 30, 2)
+    cv2.imwrite(str(path), page)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'max_tile_bytes': 1 << 20},
+    {'pipelined': True},
+    {'pipelined': True, 'max_tile_bytes': 1 << 20},
+])
+def test_rewriting_a_duplicate_leaves_its_representative_alone(tmp_path, options):
+    input_dir, output_dir = tmp_path / 'in', str(tmp_path / 'out')
+    input_dir.mkdir()
+    a, b = str(input_dir / 'a.png'), str(input_dir / 'b.png')
+    _write_page(a, seed=1)
+    shutil.copyfile(a, b)
+
+    summary = batch_processor.run_folder([a, b], output_dir, manifest=batch_manifest.BatchManifest(output_dir),
+                                         skip_duplicates=True, workers=1, **options)
+    assert [r.duplicate_of for r in summary.clean_results] == [None, a]
+    a_out, b_out = (batch_processor.output_path_for(path, output_dir) for path in (a, b))
+    assert os.path.samefile(a_out, b_out) # Linked, not cleaned twice
+    a_cleaned = _read(a_out)
+
+    # b is retaken; an incremental run without deduplication cleans only b again
+    _write_page(b, seed=2)
+    summary = batch_processor.run_folder([a, b], output_dir, manifest=batch_manifest.BatchManifest(output_dir),
+                                         workers=1, **options)
+    assert [r.source_path for r in summary.clean_results] == [b]
+    assert _read(a_out) == a_cleaned
+    assert _read(b_out) != a_cleaned
+
+
+def test_outputs_are_replaced_not_written_through(tmp_path):
+    text_path, linked_path = str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')
+    page_outputs.write_output(text_path, 'first')
+    batch_processor.link_output(text_path, linked_path)
+
+    page_outputs.write_output(text_path, 'second')
+    assert _read(text_path) == b'second'
+    assert _read(linked_path) == b'first'
+    assert sorted(os.listdir(tmp_path)) == ['a.txt', 'b.txt'] # No temporary files left behind
+
+
+def test_changing_the_ocr_mode_makes_pages_pending_again(tmp_path):
+    page, output_dir = str(tmp_path / 'a_cleaned.png'), str(tmp_path / 'out')
+    _write_page(page, seed=1)
+    manifest = batch_manifest.BatchManifest(output_dir)
+    region_params = batch_processor._ocr_params({'lang': 'en'})
+    manifest.record('ocr', batch_processor.PageResult(page), region_params)
+
+    assert manifest.pending('ocr', [page], batch_processor._ocr_params({'lang': ['en'], 'use_regions': True})) == []
+    assert manifest.pending('ocr', [page], batch_processor._ocr_params({'lang': 'en', 'use_regions': False})) == [page]
+
+
+def test_changing_the_ocr_text_height_makes_pages_pending_again(tmp_path):
+    page, output_dir = str(tmp_path / 'a_cleaned.png'), str(tmp_path / 'out')
+    _write_page(page, seed=1)
+    manifest = batch_manifest.BatchManifest(output_dir)
+    manifest.record('ocr', batch_processor.PageResult(page), batch_processor._ocr_params({'lang': 'en'}))
+
+    default_height = batch_processor.ocr_processor.TARGET_TEXT_HEIGHT
+    assert manifest.pending('ocr', [page], batch_processor._ocr_params({'target_text_height': default_height})) == []
+    for height in (default_height * 2, None):
+        assert manifest.pending('ocr', [page], batch_processor._ocr_params({'target_text_height': height})) == [page]
+
+
+def test_gui_and_batch_runs_share_clean_cache_entries(tmp_path):
+    source = str(tmp_path / 'color.jpg')
+    _write_page(str(tmp_path / 'gray.png'), seed=1)
+    cv2.imwrite(source, cv2.cvtColor(cv2.imread(str(tmp_path / 'gray.png')), cv2.COLOR_BGR2HSV)) # Any colors will do
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'))
+    result = batch_processor.clean_image_file(source, str(tmp_path), cache=cache, fast_decode=False)
+    assert result.ok
+
+    # The key and pixels of the GUI's "Process Current" for the same settings
+    gui_params = {'block_size': 21, 'c_value': 10, 'engine': bg_rem.DEFAULT_ENGINE}
+    key = batch_processor.clean_cache_key(result.source_hash, dict(gui_params, fast_decode=False))
+    with Image.open(source) as pil_img:
+        expected = bg_rem.remove_background(bg_rem.pil_to_cv(pil_img), **gui_params)
+    assert np.array_equal(cache.get_image(key), expected)
+
+
+def test_pipeline_uses_the_batch_cache_keys(tmp_path):
+    source = str(tmp_path / 'page.png')
+    _write_page(source, seed=1)
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'))
+    options = {'block_size': 31, 'c_value': 8, 'bit_depth': 8}
+    [(clean_result, _)] = pipeline.iter_pipeline([source], str(tmp_path / 'out'), cache=cache, **options)
+    assert cache.get_image_path(batch_processor.clean_cache_key(clean_result.source_hash, options)) is not None
+
+
+class _RecordingArchive:
+    """Stands in for a page_archive archive and records how each page was added."""
+
+    def __init__(self):
+        self.pages = [] # (name, 'memory' or 'file', PNG bytes)
+
+    def add_png(self, data, name):
+        self.pages.append((name, 'memory', data))
+
+    def add_page(self, image_path, name=None):
+        self.pages.append((name or os.path.basename(image_path), 'file', _read(image_path)))
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_archive_gets_pages_in_order_from_memory(tmp_path, pipelined):
+    input_dir, output_dir = tmp_path / 'in', str(tmp_path / 'out')
+    input_dir.mkdir()
+    paths = [str(input_dir / f'p{i}.png') for i in range(4)]
+    for i, path in enumerate(paths):
+        _write_page(path, seed=i)
+    manifest = batch_manifest.BatchManifest(output_dir)
+    batch_processor.run_folder(paths[:2], output_dir, manifest=manifest, workers=2, chunk_size=1)
+
+    archive = _RecordingArchive()
+    summary = batch_processor.run_folder(paths, output_dir, manifest=manifest, archive=archive, pipelined=pipelined,
+                                         workers=2, chunk_size=1, ordered=False)
+    names = [os.path.basename(batch_processor.output_path_for(path, output_dir)) for path in paths]
+    assert [name for name, _, _ in archive.pages] == names
+    # Unchanged pages come from their PNGs, the ones cleaned in this run straight from memory
+    assert [how for _, how, _ in archive.pages] == ['file', 'file', 'memory', 'memory']
+    assert all(data == _read(os.path.join(output_dir, name)) for name, _, data in archive.pages)
+    assert all(r.encoded is None for r in summary.clean_results) # Not held on to after archiving
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_archive_only_runs_write_no_pngs(tmp_path, pipelined):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    input_dir.mkdir()
+    a, b, c = (str(input_dir / name) for name in ('a.png', 'b.png', 'c.png'))
+    _write_page(a, seed=1)
+    shutil.copyfile(a, b)
+    _write_page(c, seed=2)
+
+    archive = _RecordingArchive()
+    summary = batch_processor.run_folder([a, b, c], str(output_dir), archive=archive, write_png=False,
+                                         skip_duplicates=True, pipelined=pipelined, workers=1)
+    assert summary.error_count == 0 and summary.duplicate_count == 1
+    assert [(name, how) for name, how, _ in archive.pages] == [
+        ('a_cleaned.png', 'memory'), ('b_cleaned.png', 'memory'), ('c_cleaned.png', 'memory')]
+    assert archive.pages[0][2] == archive.pages[1][2]
+    assert os.listdir(output_dir) == []
+
+
+def test_archive_only_needs_an_archive_and_no_manifest(tmp_path):
+    with pytest.raises(ValueError):
+        batch_processor.run_folder([], str(tmp_path), write_png=False)
+    with pytest.raises(ValueError):
+        batch_processor.run_folder([], str(tmp_path), write_png=False, archive=_RecordingArchive(),
+                                   manifest=batch_manifest.BatchManifest(str(tmp_path)))
+
+
+def test_watch_retries_a_failed_file_only_once_it_changes(tmp_path):
+    input_dir, output_dir = tmp_path / 'in', str(tmp_path / 'out')
+    input_dir.mkdir()
+    broken = input_dir / 'broken.png'
+    broken.write_bytes(b'not an image')
+    summaries, stop = [], threading.Event()
+
+    def on_summary(summary):
+        summaries.append(summary)
+        if len(summaries) == 1:
+            broken.write_bytes(b'still not an image') # Changed once, after the first failure
+    timer = threading.Timer(1.0, stop.set) # About 20 polls
+    timer.start()
+    batch_processor.watch_folder(str(input_dir), output_dir, interval=0.05, stop_event=stop,
+                                 on_summary=on_summary, workers=1)
+    timer.cancel()
+
+    assert len(summaries) == 2 # Tried once per version, not on every poll
+    assert all(not r.ok for summary in summaries for r in summary.clean_results)
@@ -0,0 +1,46 @@
+# test_bg_rem.py
+"""Tests for bg_rem; run with python -m pytest."""
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import bg_rem
+
+
+def _shaded_page(width=600, height=900):
+    """A gray page with a lighting gradient and lines of text, as a PIL image."""
+    page = np.tile(np.linspace(170, 240, width).astype(np.uint8), (height, 1))
+    for y in range(40, height, 35):
+        cv2.putText(page, "banded page 0123", (15, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 40, 2)
+    return Image.fromarray(page)
+
+
+# Small enough for many bands per page, each read with block_size // 2 extra rows above and below
+TILE_BYTES = 600 * bg_rem.TILE_BYTES_PER_PIXEL * 70
+
+
+@pytest.mark.parametrize('engine', bg_rem.get_available_engines())
+def test_banded_output_matches_the_whole_page(engine):
+    page = _shaded_page()
+    expected = bg_rem.remove_background(bg_rem.pil_to_gray(page), 31, 10, engine)
+    bands = list(bg_rem.iter_background_bands(page, 31, 10, TILE_BYTES, engine))
+    assert len(bands) > 2
+    assert np.array_equal(bg_rem.remove_background_banded(page, 31, 10, TILE_BYTES, engine), expected)
+
+
+@pytest.mark.parametrize('bit_depth', [1, 8])
+def test_streamed_png_matches_the_whole_page(tmp_path, bit_depth):
+    page = _shaded_page()
+    expected = bg_rem.remove_background(bg_rem.pil_to_gray(page), 31, 10)
+    path = str(tmp_path / 'page.png')
+    bg_rem.remove_background_to_file(page, path, 31, 10, TILE_BYTES, bit_depth=bit_depth)
+    with Image.open(path) as written:
+        assert np.array_equal(bg_rem.pil_to_gray(written), expected)
+
+    stream = io.BytesIO()
+    bg_rem.remove_background_to_file(page, stream, 31, 10, TILE_BYTES, bit_depth=bit_depth)
+    with open(path, 'rb') as f:
+        assert stream.getvalue() == f.read()
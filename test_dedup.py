@@ -0,0 +1,50 @@
+# test_dedup.py
+"""Tests for dedup; run with python -m pytest."""
+import cv2
+import numpy as np
+
+import dedup
+
+
+def _photo(seed, angle=0.0, shift=(0, 0), blur=0):
+    """A lit photo of a page of random text (equal seeds, equal text), taken at a small angle and offset."""
+    rng = np.random.default_rng(seed)
+    page = np.full((1754, 1240), 225, dtype=np.uint8)
+    for y in range(150, 900, 60):
+        text = ''.join(rng.choice(list('abcdefghijklmnop '), 32))
+        cv2.putText(page, text, (90, y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 35, 3)
+    transform = cv2.getRotationMatrix2D((620, 877), angle, 1.0)
+    transform[:, 2] += shift
+    page = cv2.warpAffine(page, transform, (1240, 1754), borderValue=225)
+    return cv2.GaussianBlur(page, (0, 0), blur) if blur else page
+
+
+def _write(tmp_path, name, photo):
+    path = str(tmp_path / name)
+    cv2.imwrite(path, photo)
+    return path
+
+
+def test_retakes_are_grouped_under_the_sharpest(tmp_path):
+    blurry = _write(tmp_path, 'a.png', _photo(1, blur=2))
+    sharp = _write(tmp_path, 'b.png', _photo(1, angle=1.0, shift=(8, -5)))
+    other = _write(tmp_path, 'c.png', _photo(2)) # Same layout and close hash, but different text
+    assert dedup.find_duplicates([blurry, sharp, other]) == {blurry: sharp}
+
+
+def test_unreadable_images_are_left_alone(tmp_path):
+    page = _write(tmp_path, 'a.png', _photo(1))
+    broken = tmp_path / 'b.png'
+    broken.write_bytes(b'not an image')
+    assert dedup.find_duplicates([page, str(broken)]) == {}
+
+
+def test_bk_tree_finds_every_hash_within_the_distance():
+    rng = np.random.default_rng(0)
+    hashes = [int(h) for h in rng.integers(0, 1 << 62, 200)]
+    tree = dedup.BKTree()
+    for i, hash_value in enumerate(hashes):
+        tree.add(hash_value, i)
+    query = hashes[0] ^ 0b1011
+    expected = {i for i, h in enumerate(hashes) if dedup.hamming(h, query) <= 20}
+    assert {value for _, value in tree.find(query, 20)} == expected
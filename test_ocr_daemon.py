@@ -0,0 +1,78 @@
+# test_ocr_daemon.py
+"""Tests for ocr_daemon; run with python -m pytest."""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import ocr_daemon
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = 'test-token'
+
+
+@pytest.fixture
+def daemon():
+    """(service, client) of a daemon on a free port; the service's workers are not started."""
+    service = ocr_daemon.OcrService(workers=1)
+    server = ocr_daemon.OcrServer(('127.0.0.1', 0), service, token=TOKEN)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ocr_daemon.DaemonClient(f'http://127.0.0.1:{server.server_address[1]}', timeout=10.0, token=TOKEN)
+    yield service, client
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def _write_pages(folder, count):
+    paths = []
+    for i in range(count):
+        page = np.full((200, 300), 230, dtype=np.uint8)
+        cv2.putText(page, f"page {i}", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, 20, 2)
+        paths.append(str(folder / f'p{i}.png'))
+        cv2.imwrite(paths[-1], page)
+    return paths
+
+
+def test_daemon_and_batch_processor_do_not_import_each_other_at_load_time():
+    check = "import sys, ocr_daemon; assert 'batch_processor' not in sys.modules; import batch_processor"
+    subprocess.run([sys.executable, '-c', check], cwd=HERE, check=True)
+
+
+def test_clean_job_reports_every_page(daemon, tmp_path):
+    service, client = daemon
+    service.start()
+    paths = _write_pages(tmp_path, 3)
+    results = list(client.iter_batch(paths, str(tmp_path / 'out')))
+    assert [r.source_path for r in results] == paths
+    assert all(r.ok and os.path.exists(r.output_path) for r in results)
+
+
+def test_cancelled_job_gives_an_error_for_every_page_it_did_not_do(daemon, tmp_path):
+    service, client = daemon
+    paths = _write_pages(tmp_path, 2)
+
+    def cancel_when_submitted():
+        while not service.status()['jobs']:
+            time.sleep(0.01)
+        with service._lock:
+            job_id = next(iter(service._jobs))
+        service.cancel(job_id)
+    threading.Thread(target=cancel_when_submitted, daemon=True).start()
+
+    results = list(client.iter_batch(paths, str(tmp_path / 'out')))
+    assert [r.source_path for r in results] == paths
+    assert all(not r.ok and 'cancelled' in r.error for r in results)
+
+
+@pytest.mark.parametrize('start', ['x', '-1', '1.5', '%C2%B2'])
+def test_bad_result_start_is_a_400(daemon, start):
+    service, client = daemon
+    job_id = client.submit('warmup')
+    with pytest.raises(ocr_daemon.DaemonError, match='start must be'):
+        client._request('GET', f'/jobs/{job_id}/results?start={start}')
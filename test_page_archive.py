@@ -0,0 +1,44 @@
+# test_page_archive.py
+"""Tests for page_archive; run with python -m pytest."""
+import zipfile
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+import bg_rem
+import page_archive
+
+
+def _cleaned_page(path):
+    page = np.full((300, 400), 255, dtype=np.uint8)
+    cv2.putText(page, "archived", (20, 150), cv2.FONT_HERSHEY_SIMPLEX, 2, 0, 4)
+    data = bg_rem.encode_png(page, bit_depth=1)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def test_tiff_pages_from_memory_match_pages_from_files(tmp_path):
+    page_path = str(tmp_path / 'p_cleaned.png')
+    data = _cleaned_page(page_path)
+    with page_archive.open_archive(str(tmp_path / 'pages.tif')) as archive:
+        archive.add_page(page_path)
+        archive.add_png(data, 'p_cleaned.png')
+        assert archive.page_count == 2
+
+    with Image.open(str(tmp_path / 'pages.tif')) as tiff:
+        frames = [(frame.tag_v2.get(page_archive.PAGE_NAME_TAG), np.array(frame.convert('L')))
+                  for frame in ImageSequence.Iterator(tiff)]
+    assert [name for name, _ in frames] == ['p_cleaned.png', 'p_cleaned.png']
+    assert np.array_equal(frames[0][1], frames[1][1])
+    assert np.array_equal(frames[0][1], cv2.imread(page_path, cv2.IMREAD_GRAYSCALE))
+
+
+def test_zip_stores_pages_from_memory_as_they_are(tmp_path):
+    data = _cleaned_page(str(tmp_path / 'p_cleaned.png'))
+    with page_archive.open_archive(str(tmp_path / 'pages.zip')) as archive:
+        archive.add_png(data, 'p_cleaned.png')
+    with zipfile.ZipFile(str(tmp_path / 'pages.zip')) as z:
+        assert z.getinfo('p_cleaned.png').compress_type == zipfile.ZIP_STORED
+        assert z.read('p_cleaned.png') == data
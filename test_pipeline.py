@@ -0,0 +1,37 @@
+# test_pipeline.py
+"""Tests for pipeline; run with python -m pytest."""
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import pipeline
+
+
+def _pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+
+@pytest.mark.parametrize('stop_with', ['break', 'exception'])
+def test_stopping_early_ends_the_stage_threads(tmp_path, stop_with):
+    source = str(tmp_path / 'page.png')
+    cv2.imwrite(source, np.random.default_rng(0).integers(0, 255, (300, 300), dtype=np.uint8))
+    paths = [source] * 40 # Far more pages than the queues hold
+
+    def consume():
+        for _ in pipeline.iter_pipeline(paths, str(tmp_path / 'out'), clean_workers=2, queue_size=1):
+            if stop_with == 'break':
+                break
+            raise KeyError('consumer failed')
+    if stop_with == 'break':
+        consume()
+    else:
+        with pytest.raises(KeyError):
+            consume()
+
+    deadline = time.monotonic() + 5
+    while _pipeline_threads() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _pipeline_threads() == []
@@ -0,0 +1,60 @@
+# test_result_cache.py
+"""Tests for result_cache; run with python -m pytest."""
+import os
+import pickle
+
+import cv2
+import numpy as np
+
+import batch_processor
+import result_cache
+
+
+def _cache_bytes(cache):
+    return sum(size for _, size, _ in cache._entries())
+
+
+def test_keys_depend_on_every_parameter():
+    key = result_cache.clean_key('hash', 21, 10, 'gaussian', depth=1)
+    assert key == result_cache.clean_key('hash', 21, 10, 'gaussian', depth=1)
+    assert key != result_cache.clean_key('hash', 21, 10, 'gaussian', depth=8)
+    assert key != result_cache.clean_key('hash', 21, 10, 'mean', depth=1)
+    assert result_cache.ocr_key('hash', ['pl', 'en']) == result_cache.ocr_key('hash', ['en', 'pl', 'en'])
+    assert result_cache.ocr_key('hash', 'en', regions=True) != result_cache.ocr_key('hash', 'en', regions=False)
+
+
+def test_text_and_lines_entries_are_misses_for_each_other(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path))
+    cache.put_text('text-key', "some text")
+    cache.put_lines('lines-key', [[[[0, 0], [1, 0], [1, 1], [0, 1]], "line", 0.5]])
+    assert cache.get_lines('text-key') is None
+    assert cache.get_text('lines-key') is None
+    assert cache.get_text('text-key') == "some text"
+
+
+def test_copies_in_workers_leave_size_checks_to_the_owner(tmp_path, monkeypatch):
+    owner = result_cache.ResultCache(str(tmp_path), max_bytes=1000)
+    worker_copy = pickle.loads(pickle.dumps(owner))
+
+    def no_scans():
+        raise AssertionError("A worker's copy scanned the cache.")
+    monkeypatch.setattr(worker_copy, '_entries', no_scans)
+    for i in range(4):
+        worker_copy.put_json(f'key{i}', {'data': 'x' * 400})
+    assert _cache_bytes(owner) > 1000 # Nothing evicted in the worker
+    assert worker_copy.unaccounted_bytes == _cache_bytes(owner)
+
+    owner.account(worker_copy.unaccounted_bytes)
+    assert _cache_bytes(owner) <= 900
+
+
+def test_pool_runs_keep_the_cache_within_its_limit(tmp_path):
+    pages = []
+    for i in range(6):
+        pages.append(str(tmp_path / f'p{i}.png'))
+        cv2.imwrite(pages[-1], np.random.default_rng(i).integers(0, 255, (200, 200), dtype=np.uint8))
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'), max_bytes=15000)
+    os.makedirs(tmp_path / 'out')
+    results = list(batch_processor.iter_batch(pages, str(tmp_path / 'out'), workers=2, chunk_size=1, cache=cache))
+    assert all(r.ok for r in results)
+    assert _cache_bytes(cache) <= 15000
@@ -0,0 +1,69 @@
+# test_text_regions.py
+"""Tests for text_regions; run with python -m pytest."""
+import cv2
+import numpy as np
+
+import text_regions
+
+
+def _page_with_text(lines, width=1200, height=900):
+    """A binary page (ink 0, paper 255) with each (x, y) in lines starting a line of text."""
+    page = np.full((height, width), 255, dtype=np.uint8)
+    for x, y in lines:
+        cv2.putText(page, "Notes on the edge of the page", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+    return page
+
+
+def _ink_outside(binary, regions):
+    inside = np.zeros(binary.shape, dtype=bool)
+    for x0, y0, x1, y1 in regions:
+        inside[y0:y1, x0:x1] = True
+    return int(np.count_nonzero((binary == 0) & ~inside))
+
+
+def test_regions_cover_text_touching_the_page_edges():
+    width, height = 1200, 900
+    page = _page_with_text([(0, 30)] + [(2, y) for y in range(90, 400, 50)] + [(600, height - 2)], width, height)
+    ink_xs = np.nonzero((page == 0).any(axis=0))[0]
+    assert ink_xs[0] <= 6 # The text really starts at the left edge
+
+    regions = text_regions.find_text_regions(page)
+    assert regions
+    assert _ink_outside(page, regions) == 0
+    assert min(region[0] for region in regions) <= ink_xs[0]
+
+
+def test_regions_cover_text_in_the_middle_of_the_page():
+    page = _page_with_text([(150, y) for y in range(200, 500, 50)])
+    regions = text_regions.find_text_regions(page)
+    assert _ink_outside(page, regions) == 0
+    # The block hugs the text instead of spanning the page
+    x0, y0, x1, y1 = regions[0]
+    assert x0 > 100 and y0 > 100
+
+
+def test_blank_page_has_no_regions():
+    page = np.full((900, 1200), 255, dtype=np.uint8)
+    assert text_regions.find_text_regions(page) == []
+    assert text_regions.plan_ocr_regions(page) == []
+
+
+def test_a_single_short_line_on_a_large_page_is_not_blank():
+    width, height = 3000, 4000
+    page = np.full((height, width), 255, dtype=np.uint8)
+    cv2.putText(page, "call Ann 5pm", (1200, 1800), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+    page = np.where(page < 128, 0, 255).astype(np.uint8) # Cleaned pages are strictly binary
+    assert np.count_nonzero(page == 0) < text_regions.BLANK_INK_RATIO * width * height # Sparse indeed
+
+    regions = text_regions.find_text_regions(page)
+    assert len(regions) == 1
+    assert _ink_outside(page, regions) == 0
+    assert text_regions.plan_ocr_regions(page) == regions
+
+
+def test_specks_alone_are_still_blank():
+    rng = np.random.default_rng(0)
+    page = np.full((4000, 3000), 255, dtype=np.uint8)
+    for x, y in zip(rng.integers(0, 2997, 300), rng.integers(0, 3997, 300)):
+        page[y:y + 3, x:x + 3] = 0 # Dust: bigger than MIN_COMPONENT_AREA, but no letter
+    assert text_regions.find_text_regions(page) == []
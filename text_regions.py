@@ -0,0 +1,148 @@
+# text_regions.py
+"""
+Layout analysis on binarized pages, run before OCR.
+
+Connected components of the ink (as produced by bg_rem.remove_background) are
+filtered for specks and page-sized blobs, then grown into text blocks on a
+downscaled mask. OCR then only runs on those blocks instead of the whole page,
+and pages with (almost) no ink and nothing shaped like letters skip the text
+detector entirely.
+"""
+import cv2
+import numpy as np
+from PIL import Image
+
+import bg_rem
+
+BLANK_INK_RATIO = 0.001 # Pages with less ink than this (after removing specks) may be blank...
+BLANK_MAX_LETTERS = 1 # ...if they also have no more letter-like components than this
+MIN_COMPONENT_AREA = 6 # Smaller ink components are specks, not writing
+FULL_PAGE_COVERAGE = 0.7 # If the blocks cover more of the page than this, OCR the page as a whole
+MAX_REGIONS = 12 # Beyond this, per-call overhead outweighs the saved pixels; OCR the blocks' bounding box
+
+
+def binarize_for_layout(pil_image):
+    """
+    Returns a binary image (ink 0, paper 255) for layout analysis.
+    Pages that are already binary (cleaned output) are used as they are,
+    anything else goes through remove_background first.
+    """
+    gray_image = bg_rem.pil_to_gray(pil_image) if isinstance(pil_image, Image.Image) else pil_image
+    if np.count_nonzero((gray_image != 0) & (gray_image != 255)) == 0:
+        return gray_image
+    return bg_rem.remove_background(gray_image)
+
+
+def ink_components(binary):
+    """
+    Returns the stats rows (cv2.CC_STAT_*) of the ink components that can be
+    writing: no specks, no ruling lines, and nothing spanning most of the page
+    (frames, shadows).
+    """
+    height, width = binary.shape
+    ink = (binary == 0).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:] # Row 0 is the paper
+    w, h = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    rules = ((w > width // 4) & (w > 20 * h)) | ((h > height // 4) & (h > 20 * w))
+    blobs = (w > width // 2) & (h > height // 2)
+    keep = (stats[:, cv2.CC_STAT_AREA] >= MIN_COMPONENT_AREA) & ~rules & ~blobs
+    return stats[keep]
+
+
+def _letter_like(components, page_height):
+    """Mask of the components shaped like letters or letter groups: not thin rules, not huge drawings."""
+    heights = components[:, cv2.CC_STAT_HEIGHT]
+    widths = components[:, cv2.CC_STAT_WIDTH]
+    return (heights >= 4) & (heights <= page_height // 10) & (widths <= 10 * heights) & (heights <= 10 * widths)
+
+
+def estimate_text_height(binary, components=None):
+    """
+    Estimates the typical glyph height in pixels as the median height of
+    letter-like ink components, or returns None if there are too few of them.
+    """
+    if components is None:
+        components = ink_components(binary)
+    letter_like = _letter_like(components, binary.shape[0])
+    if np.count_nonzero(letter_like) < 10:
+        return None
+    return float(np.median(components[letter_like, cv2.CC_STAT_HEIGHT]))
+
+
+def find_text_regions(binary, min_ink_ratio=BLANK_INK_RATIO, components=None):
+    """
+    Finds text blocks on a binary page.
+    Args:
+        binary: Binary image (ink 0, paper 255), e.g. from binarize_for_layout.
+        min_ink_ratio: Pages with less ink than this fraction and at most
+                       BLANK_MAX_LETTERS letter-like components are treated as blank.
+                       A single short line has little ink, but several letters.
+        components: ink_components(binary), if the caller already has them.
+    Returns:
+        List of (x0, y0, x1, y1) page rectangles in reading order (top to
+        bottom, then left to right); empty for a blank page.
+    """
+    height, width = binary.shape
+    if components is None:
+        components = ink_components(binary)
+    if (components[:, cv2.CC_STAT_AREA].sum() < min_ink_ratio * height * width
+            and np.count_nonzero(_letter_like(components, height)) <= BLANK_MAX_LETTERS):
+        return []
+
+    text_height = estimate_text_height(binary, components) or max(8.0, height / 100)
+    # Work on a mask a few pixels per text line high; plenty for block shapes and cheap to dilate
+    scale = max(1, int(text_height // 4))
+    mask = np.zeros((height // scale + 1, width // scale + 1), dtype=np.uint8)
+    for x, y, w, h, _ in components:
+        mask[y // scale:(y + h) // scale + 1, x // scale:(x + w) // scale + 1] = 255
+
+    # Close the gaps between letters, words and neighbouring lines of a block
+    # (lines on ruled paper can be up to three text heights apart)
+    gap_x = max(3, int(3 * text_height / scale) | 1)
+    gap_y = max(3, int(2 * text_height / scale) | 1)
+    mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (gap_x, gap_y)))
+    block_count, labels = cv2.connectedComponents(mask, connectivity=8)
+
+    # A block spans the bounding boxes of the ink components in it, plus a margin.
+    # (Shrinking the dilated block back by half a kernel would cut into text near
+    # the page edge, where the dilation was clipped.)
+    x, y, w, h = (components[:, stat] for stat in (cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP,
+                                                     cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT))
+    block_of = labels[y // scale, x // scale] # Each component's top-left cell lies in its block
+    x0s, y0s = np.full(block_count, width), np.full(block_count, height)
+    x1s, y1s = np.zeros(block_count, dtype=int), np.zeros(block_count, dtype=int)
+    np.minimum.at(x0s, block_of, x)
+    np.minimum.at(y0s, block_of, y)
+    np.maximum.at(x1s, block_of, x + w)
+    np.maximum.at(y1s, block_of, y + h)
+
+    margin = int(text_height // 2)
+    regions = []
+    for block in range(1, block_count):
+        x0, y0 = max(0, x0s[block] - margin), max(0, y0s[block] - margin)
+        x1, y1 = min(width, x1s[block] + margin), min(height, y1s[block] + margin)
+        if x1 > x0 and y1 > y0:
+            regions.append((int(x0), int(y0), int(x1), int(y1)))
+    regions.sort(key=lambda region: (region[1], region[0]))
+    return regions
+
+
+def plan_ocr_regions(pil_image, min_ink_ratio=BLANK_INK_RATIO, components=None):
+    """
+    Decides what to send to the recognizer for one page.
+    pil_image may also be the binary from binarize_for_layout, with its
+    ink_components if they are already known.
+    Returns:
+        [] for a blank page, [None] to OCR the whole page (the blocks would
+        cover most of it anyway), or the list of (x0, y0, x1, y1) blocks.
+    """
+    binary = binarize_for_layout(pil_image)
+    regions = find_text_regions(binary, min_ink_ratio, components)
+    if len(regions) > MAX_REGIONS:
+        regions = [(min(r[0] for r in regions), min(r[1] for r in regions),
+                    max(r[2] for r in regions), max(r[3] for r in regions))]
+    covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+    if regions and covered > FULL_PAGE_COVERAGE * binary.shape[0] * binary.shape[1]:
+        return [None]
+    return regions